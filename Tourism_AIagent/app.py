@@ -1,18 +1,37 @@
 # app.py
 import os
-from typing import List
+import re
+import time
+from typing import Callable, List, Optional, Tuple
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, flash, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, jsonify, send_file, g
 
-from hotpepper_client import HotpepperClient
+from hotpepper_client import HotpepperClient, range_code_for_radius
 from google_client import GooglePlacesClient
-from scoring_restaurant import calc_restaurant_scores
-from scoring_place import calc_place_scores
-from reasoner import generate_reason_and_stay_time
+from scoring_batch import score_places_batch, score_restaurants_batch, apply_batch_scores
+from reasoner import generate_reason_and_stay_time, reason_key, BatchReasoner, HttpReasonerBackend
+from enrichment import enrich_hotpepper_spots, hydrate_details, details_photo_url
+from cache import TTLCache, SqliteBackend, MISSING
+from snapshot import open_snapshot
+from gazetteer import StationGazetteer, normalize_station_name
+from matching import ShopMatcher
+from singleflight import SingleFlight
+from spatial_index import SpotIndex
+from search_jobs import SearchJob, SearchJobRegistry
+from rate_limiter import ApiQuota, SqliteQuotaStore, QuotaExceeded
+from photo_cache import PhotoCache, photo_cache_key, CHUNK_SIZE
+from image_variants import (
+    GOOGLE_PHOTO_HOSTS,
+    snap_width, negotiate_format, is_google_photo_url, with_maxwidth, can_transcode, transcode,
+)
 from spot import Spot
+from spot_batch import SpotBatch
+from itinerary import plan_spots, format_clock, parse_clock
+import metrics
+
+from http_session import http_get
 
 from urllib.parse import urlparse
-import requests
 
 load_dotenv()
 
@@ -22,8 +41,139 @@ app.secret_key = "change-this-secret"  # フラッシュメッセージ用（適
 HOTPEPPER_API_KEY = os.getenv("HOTPEPPER_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-hotpepper_client = HotpepperClient(HOTPEPPER_API_KEY) if HOTPEPPER_API_KEY else None
-google_client = GooglePlacesClient(GOOGLE_API_KEY) if GOOGLE_API_KEY else None
+# API の向き先（ベンチマークで代役サーバーを使うときだけ指定。空なら本物の API）
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL", "")
+HOTPEPPER_API_BASE_URL = os.getenv("HOTPEPPER_API_BASE_URL", "")
+
+# Google Places の結果キャッシュ設定（PLACES_CACHE_DB を指定するとディスクにも保存）
+PLACES_CACHE_SIZE = int(os.getenv("PLACES_CACHE_SIZE", "2000"))
+PLACES_CACHE_TTL_SEC = float(os.getenv("PLACES_CACHE_TTL_SEC", str(24 * 3600)))
+PLACES_CACHE_DB = os.getenv("PLACES_CACHE_DB", "")
+
+# キャッシュのスナップショット（python snapshot.py build で作る）。mmap で開いてワーカー間で共有し、
+# メモリ・SQLite のキャッシュに無いときの読み取り元にする
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "")
+snapshot = open_snapshot(SNAPSHOT_FILE)
+
+
+def snapshot_part(kind: str, name: str):
+    """スナップショットの表（無ければ None）"""
+    if snapshot is None or not snapshot.has(kind, name):
+        return None
+    return snapshot.coords(name) if kind == "coords" else snapshot.table(name)
+
+
+places_cache_backend = SqliteBackend(PLACES_CACHE_DB) if PLACES_CACHE_DB else None
+place_id_cache = TTLCache(PLACES_CACHE_SIZE, PLACES_CACHE_TTL_SEC, places_cache_backend, name="place_id",
+                          fallback=snapshot_part("table", "place_id"))
+details_cache = TTLCache(PLACES_CACHE_SIZE, PLACES_CACHE_TTL_SEC, places_cache_backend, name="details",
+                         fallback=snapshot_part("table", "details"))
+
+# Hotpepper の店 → Google の place_id の対応（店ごとの FindPlace の代わりに、
+# Nearby Search 1回で突き合わせる。決まった対応は長めに保存して使い回す）
+SHOP_MATCHING = os.getenv("SHOP_MATCHING", "1") == "1"
+SHOP_MATCH_TTL_SEC = float(os.getenv("SHOP_MATCH_TTL_SEC", str(30 * 24 * 3600)))
+shop_place_cache = TTLCache(PLACES_CACHE_SIZE, SHOP_MATCH_TTL_SEC, places_cache_backend, name="shop_place",
+                            fallback=snapshot_part("table", "shop_place"))
+shop_matcher = ShopMatcher(shop_place_cache) if SHOP_MATCHING else None
+
+# 駅名 → 座標の表（起動時に読み込み、Geocoding で引いた駅は追記される）
+STATIONS_FILE = os.getenv(
+    "STATIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stations.csv")
+)
+station_gazetteer = StationGazetteer(STATIONS_FILE, fallback=snapshot_part("coords", "stations"))
+
+# 取得済みスポットの空間インデックス（この時間内に取得した範囲なら Nearby Search を省略）
+SPOT_INDEX_MAX_AGE_SEC = float(os.getenv("SPOT_INDEX_MAX_AGE_SEC", str(6 * 3600)))
+spot_index = SpotIndex(max_age_sec=SPOT_INDEX_MAX_AGE_SEC)
+
+# 外部 API のレート制限（RATE_LIMIT_DB を指定すると、同じファイルを見るプロセス全体で共有）
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "")
+RATE_LIMIT_MAX_WAIT_SEC = float(os.getenv("RATE_LIMIT_MAX_WAIT_SEC", "1.0"))
+
+api_quota = ApiQuota(
+    store=SqliteQuotaStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else None,
+    max_wait_sec=RATE_LIMIT_MAX_WAIT_SEC,
+)
+
+hotpepper_client = (
+    HotpepperClient(HOTPEPPER_API_KEY, quota=api_quota, base_url=HOTPEPPER_API_BASE_URL or None)
+    if HOTPEPPER_API_KEY else None
+)
+google_client = (
+    GooglePlacesClient(
+        GOOGLE_API_KEY,
+        place_id_cache=place_id_cache,
+        details_cache=details_cache,
+        gazetteer=station_gazetteer,
+        spot_index=spot_index,
+        quota=api_quota,
+        base_url=GOOGLE_API_BASE_URL or None,
+    )
+    if GOOGLE_API_KEY else None
+)
+
+# Hotpepper → Google 補完の同時実行数と締め切り（秒）
+ENRICH_MAX_WORKERS = int(os.getenv("ENRICH_MAX_WORKERS", "8"))
+ENRICH_DEADLINE_SEC = float(os.getenv("ENRICH_DEADLINE_SEC", "6"))
+
+# 飲食の Place Details は上位 DETAILS_TOP_N 件だけ検索時に取り、残りはカードが近づいたら取る
+# （0 なら従来どおり全候補の詳細を先に取る）
+DETAILS_TOP_N = int(os.getenv("DETAILS_TOP_N", "5"))
+
+# 飲食を Hotpepper だけで採点する（予算・設備・起点からの距離）。Hotpepper 1回で候補を
+# HOTPEPPER_POOL_SIZE 件まで取って全部並べ、Google は表示するカードの写真を取るときだけ使う
+HOTPEPPER_FAST_PATH = os.getenv("HOTPEPPER_FAST_PATH", "0") == "1"
+HOTPEPPER_POOL_SIZE = int(os.getenv("HOTPEPPER_POOL_SIZE", "100"))
+
+# 理由文を LLM でまとめて作る（REASONER_BACKEND=http のとき）。上位 REASONER_MAX_SPOTS 件を1回で送り、
+# ページはルールベースの文で先に返す。届いた文は内訳ごとにキャッシュし、ページが /reasons から
+# REASONER_DEADLINE_SEC 秒まで取りに来て差し替える（それより遅れた分はルールベースの文のまま）
+REASONER_BACKEND = os.getenv("REASONER_BACKEND", "rule")
+REASONER_URL = os.getenv("REASONER_URL", "")
+REASONER_API_KEY = os.getenv("REASONER_API_KEY", "")
+REASONER_MODEL = os.getenv("REASONER_MODEL", "")
+REASONER_DEADLINE_SEC = float(os.getenv("REASONER_DEADLINE_SEC", "10"))
+REASONER_MAX_SPOTS = int(os.getenv("REASONER_MAX_SPOTS", "60"))
+REASONER_CACHE_TTL_SEC = float(os.getenv("REASONER_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+
+reason_cache = TTLCache(PLACES_CACHE_SIZE, REASONER_CACHE_TTL_SEC, places_cache_backend, name="reason")
+batch_reasoner = (
+    BatchReasoner(
+        HttpReasonerBackend(REASONER_URL, api_key=REASONER_API_KEY, model=REASONER_MODEL),
+        reason_cache,
+        max_spots=REASONER_MAX_SPOTS,
+    )
+    if REASONER_BACKEND == "http" and REASONER_URL else None
+)
+
+# Nearby Search のページ送り（1 なら従来どおり最初の20件だけ、最大3ページ=60件）
+NEARBY_MAX_PAGES = int(os.getenv("NEARBY_MAX_PAGES", "1"))
+NEARBY_MAX_RESULTS = int(os.getenv("NEARBY_MAX_RESULTS", "60"))
+NEARBY_TIME_BUDGET_SEC = float(os.getenv("NEARBY_TIME_BUDGET_SEC", "6"))
+
+# 同じ検索条件の同時リクエストは1回の上流呼び出しにまとめ、結果を短時間使い回す
+SEARCH_CACHE_TTL_SEC = float(os.getenv("SEARCH_CACHE_TTL_SEC", "120"))
+search_flight = SingleFlight()
+search_result_cache = TTLCache(maxsize=256, ttl_sec=SEARCH_CACHE_TTL_SEC, name="search")
+
+# 結果ページで中身まで描いておくカードの先読み枚数（表示中＋この枚数）。
+# 残りのカードは枠だけ返し、スワイプで近づいたら取りに来てもらう（写真もそのときに読む）
+CARD_PREFETCH = int(os.getenv("CARD_PREFETCH", "2"))
+CARD_BATCH_MAX = 10   # 1回で返すカードの上限
+JOB_EXPIRED_MESSAGE = "検索結果の有効期限が切れました。もう一度検索してください。"
+
+# 行程プラン：「行きたい」にしたカード（無ければ上位 ITINERARY_TOP_K 件）を1日で回る順に並べる
+ITINERARY_TOP_K = int(os.getenv("ITINERARY_TOP_K", "8"))
+ITINERARY_MAX_STOPS = int(os.getenv("ITINERARY_MAX_STOPS", "60"))
+ITINERARY_MINUTES = int(os.getenv("ITINERARY_MINUTES", "480"))
+ITINERARY_START = os.getenv("ITINERARY_START", "10:00")
+
+# 段階表示モード：結果ページの枠を先に返し、カードは仕上がった順に追加していく。
+# 進み具合とカードはプロセス内の search_jobs に置くので、複数ワーカーで動かすときは
+# 同じワーカーに振り分ける（sticky session）か、ワーカー1つで動かすこと（ジョブは10分で消える）
+PROGRESSIVE_RESULTS = os.getenv("PROGRESSIVE_RESULTS", "0") == "1"
+search_jobs = SearchJobRegistry(max_workers=int(os.getenv("PROGRESSIVE_MAX_JOBS", "8")))
 
 
 # ---- UI用の選択肢 ----
@@ -73,24 +223,26 @@ def map_genre_key_to_label(category: str, key: str) -> str:
         return PLACE_GENRES.get(key, key)
 
 
-def map_place_type_from_genre_key(genre_key: str) -> str:
-    if genre_key == "nature":
-        return "park"
-    if genre_key == "sightseeing":
-        return "tourist_attraction"
-    if genre_key == "history_culture":
-        return "tourist_attraction"
-    if genre_key == "shopping":
-        return "shopping_mall"
-    if genre_key == "museum":
-        return "museum"
-    if genre_key == "themepark":
-        return "amusement_park"
-    if genre_key == "zoo_aquarium":
-        return "zoo"
-    if genre_key == "hot_spring":
-        return "spa"
-    return "tourist_attraction"
+# 観光ジャンル → Nearby Search のクエリ（type, keyword）の組。並列に投げて結果をまとめる
+PLACE_GENRE_QUERIES = {
+    "nature": (("park", None), ("campground", None)),
+    "sightseeing": (("tourist_attraction", None), ("park", "名所")),
+    "history_culture": (
+        ("tourist_attraction", None),
+        ("place_of_worship", None),
+        ("hindu_temple", None),
+        ("museum", "歴史"),
+    ),
+    "shopping": (("shopping_mall", None), ("department_store", None)),
+    "museum": (("museum", None), ("art_gallery", None)),
+    "themepark": (("amusement_park", None),),
+    "zoo_aquarium": (("zoo", None), ("aquarium", None)),
+    "hot_spring": (("spa", None), ("spa", "温泉"), ("lodging", "温泉")),
+}
+
+
+def map_place_queries_from_genre_key(genre_key: str):
+    return PLACE_GENRE_QUERIES.get(genre_key, (("tourist_attraction", None),))
 
 
 @app.route("/", methods=["GET"])
@@ -108,19 +260,22 @@ def index():
     )
 
 
-@app.route("/recommend", methods=["POST"])
-def recommend():
-    category = request.form.get("category")
-    genre_key = request.form.get("genre")
-    priority = request.form.get("priority")
-    station = request.form.get("station", "").strip()
-    search_mode = request.form.get("search_mode", "station")
+def read_search_form(form) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    検索フォーム → 検索条件。
+    入力エラーのときは (None, エラーメッセージ) を返す。
+    """
+    category = form.get("category")
+    genre_key = form.get("genre")
+    priority = form.get("priority")
+    station = form.get("station", "").strip()
+    search_mode = form.get("search_mode", "station")
 
-    radius_str = request.form.get("radius", "1000")
+    radius_str = form.get("radius", "1000")
     radius = int(radius_str)
 
-    lat_str = request.form.get("lat")
-    lng_str = request.form.get("lng")
+    lat_str = form.get("lat")
+    lng_str = form.get("lng")
     origin_lat = origin_lng = None
     if lat_str and lng_str:
         try:
@@ -131,90 +286,285 @@ def recommend():
 
     # 入力チェック
     if not category or not genre_key or not priority:
-        flash("カテゴリ・ジャンル・優先度を選択してください。", "error")
-        return redirect(url_for("index"))
+        return None, "カテゴリ・ジャンル・優先度を選択してください。"
 
     if search_mode == "station" and not station:
-        flash("検索方法が『駅名』のときは、駅名を入力してください。", "error")
-        return redirect(url_for("index"))
+        return None, "検索方法が『駅名』のときは、駅名を入力してください。"
 
     if search_mode == "map" and origin_lat is None:
-        flash("検索方法が『地図』のときは、地図をクリックして場所を選んでください。", "error")
-        return redirect(url_for("index"))
+        return None, "検索方法が『地図』のときは、地図をクリックして場所を選んでください。"
 
-    genre_label = map_genre_key_to_label(category, genre_key)
+    return {
+        "category": category,
+        "genre_key": genre_key,
+        "genre_label": map_genre_key_to_label(category, genre_key),
+        "priority": priority,
+        "station": station,
+        "search_mode": search_mode,
+        "radius": radius,
+        "origin_lat": origin_lat,
+        "origin_lng": origin_lng,
+    }, None
 
-    ranked_spots: List[Spot] = []
 
-    try:
-        if category == "restaurant":
-            if not hotpepper_client:
-                raise RuntimeError("Hotpepper API キーが設定されていません。")
-            if not google_client:
-                raise RuntimeError("Google API キーが設定されていません。")
-
-            # Hotpepper で候補店を取得（名前 + 位置だけ使う）
-            hp_spots = hotpepper_client.search_restaurants(
-                station_keyword=station,
-                user_genre_keyword=genre_label,
-                count=10,
-                lat=origin_lat if search_mode == "map" else None,
-                lng=origin_lng if search_mode == "map" else None,
-            )
+def search_key(params: dict) -> str:
+    """
+    同じ候補が返ってくる検索条件をまとめるキー。
+    優先度は採点にしか使わないので含めない。地図指定は約100m単位に丸める。
+    """
+    if params["search_mode"] == "map":
+        location = f"{params['origin_lat']:.3f},{params['origin_lng']:.3f}"
+    else:
+        location = normalize_station_name(params["station"])
+    return f"{params['category']}|{params['genre_key']}|{location}|{params['radius']}"
+
 
-            google_spots: List[Spot] = []
+def cache_candidates(key: str, fetched: dict) -> None:
+    """候補は SpotBatch（列にまとめた形）で持っておく（件数が多くてもメモリを食わない）。"""
+    search_result_cache.set(key, {"origin": fetched["origin"], "spots": SpotBatch.from_spots(fetched["spots"])})
 
-            for hp in hp_spots:
-                # 一致率UP: 店名 + 住所で検索
-                query = f"{hp.name} {hp.address}".strip()
 
-                # ① Google place_id を検索
-                place_id = google_client.find_place_id(query, hp.lat, hp.lng)
-                if not place_id:
-                    continue
+def cached_candidates(key: str):
+    """cache_candidates で持っておいた候補（Spot のリストに戻したもの）。無ければ MISSING。"""
+    cached = search_result_cache.get(key)
+    if cached is MISSING:
+        return MISSING
+    return {"origin": cached["origin"], "spots": cached["spots"].to_spots()}
 
-                # ② Google 詳細情報を取得
-                details = google_client.get_place_details(place_id)
-                if not details:
-                    continue
 
-                # ③ Google Photo の URL を取得（1枚目を採用）
-                photos = details.get("photos", [])
-                image_url = None
-                if photos:
-                    photo_ref = photos[0].get("photo_reference")
-                    if photo_ref:
-                        image_url = google_client.get_photo_url(photo_ref)
+def fetch_candidates(params: dict,
+                     on_candidates: Optional[Callable[[List[Spot], Tuple[float, float]], None]] = None) -> dict:
+    """
+    検索条件 → 採点前の候補 Spot 一覧と起点座標。
+    on_candidates を渡すと、候補が届くたびに (届いた Spot, 起点) で呼ぶ（段階表示用）。
+    ここで返す Spot は共有・キャッシュされるので書き換えないこと。
+    """
+    category = params["category"]
+    search_mode = params["search_mode"]
+    origin_lat, origin_lng = params["origin_lat"], params["origin_lng"]
+
+    def notify(spots: List[Spot], origin) -> None:
+        if on_candidates is not None and spots:
+            on_candidates(spots, origin)
+
+    if category == "restaurant" and HOTPEPPER_FAST_PATH:
+        if not hotpepper_client:
+            raise RuntimeError("Hotpepper API キーが設定されていません。")
+
+        origin = restaurant_origin(params)
+        candidates = hotpepper_client.search_pool(
+            station_keyword=params["station"],
+            user_genre_keyword=params["genre_label"],
+            max_results=HOTPEPPER_POOL_SIZE,
+            lat=origin[0] if origin else None,
+            lng=origin[1] if origin else None,
+            range_code=range_code_for_radius(params["radius"]),
+        )
+        mark_photos_pending(candidates)
+        notify(candidates, origin)
+
+    elif category == "restaurant":
+        if not hotpepper_client:
+            raise RuntimeError("Hotpepper API キーが設定されていません。")
+        if not google_client:
+            raise RuntimeError("Google API キーが設定されていません。")
+
+        origin = (origin_lat, origin_lng) if search_mode == "map" else None
 
-                # ④ Spot オブジェクト化（Google情報のみを使う）
-                spot_obj = Spot.from_google_details(details, image_url)
-                google_spots.append(spot_obj)
+        # Hotpepper で候補店を取得（名前 + 位置だけ使う）
+        hp_spots = hotpepper_client.search_restaurants(
+            station_keyword=params["station"],
+            user_genre_keyword=params["genre_label"],
+            count=10,
+            lat=origin_lat if search_mode == "map" else None,
+            lng=origin_lng if search_mode == "map" else None,
+        )
 
-            # スコア計算
-            scored_spots = [calc_restaurant_scores(s, priority) for s in google_spots]
+        # Google 側の補完（突き合わせ or find_place_id → details）を並列に実行し、終わった店から知らせる
+        # （戻り値は Hotpepper の並び順のまま。DETAILS_TOP_N > 0 なら details は採点の後で上位だけ）
+        with metrics.span("enrich"):
+            candidates = enrich_hotpepper_spots(
+                google_client,
+                hp_spots,
+                max_workers=ENRICH_MAX_WORKERS,
+                deadline_sec=ENRICH_DEADLINE_SEC,
+                on_result=lambda s: notify([s], origin),
+                matcher=shop_matcher,
+                origin=origin,
+                fetch_details=DETAILS_TOP_N <= 0,
+            )
+
+    else:
+        if not google_client:
+            raise RuntimeError("Google API キーが設定されていません。")
 
+        # 観光：search_mode に応じて起点座標を決める
+        if search_mode == "map" and origin_lat is not None and origin_lng is not None:
+            origin = (origin_lat, origin_lng)
         else:
-            if not google_client:
-                raise RuntimeError("Google API キーが設定されていません。")
+            origin = google_client.geocode_station(params["station"])
+
+        # ジャンルに対応する複数の type を並列に検索し、重複を除いてまとめる
+        queries = map_place_queries_from_genre_key(params["genre_key"])
+        candidates = []
+        pages = google_client.iter_nearby_pages_multi(
+            origin[0], origin[1], queries,
+            radius=params["radius"],
+            max_pages=NEARBY_MAX_PAGES,
+            max_results=NEARBY_MAX_RESULTS,
+            time_budget_sec=NEARBY_TIME_BUDGET_SEC,
+        )
+        for page in pages:
+            candidates.extend(page)
+            # ページ単位で先に採点してもらう（他の type やトークン待ちの間に進む）
+            notify(page, origin)
 
-            # 観光：search_mode に応じて起点座標を決める
-            if search_mode == "map" and origin_lat is not None and origin_lng is not None:
-                station_lat, station_lng = origin_lat, origin_lng
+    return {"origin": origin, "spots": candidates}
+
+
+def restaurant_origin(params: dict) -> Optional[Tuple[float, float]]:
+    """
+    Hotpepper だけで探すときの検索中心（地図の位置 or 駅の座標）。
+    駅の座標が分からなければ None（Hotpepper の「駅名＋ジャンル」検索にする）。
+    """
+    if params["search_mode"] == "map":
+        return params["origin_lat"], params["origin_lng"]
+    if not google_client:
+        return None
+    try:
+        return google_client.geocode_station(params["station"])
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+    except Exception as e:
+        print("GEOCODE_ERROR:", e)
+    return None
+
+
+def mark_photos_pending(spots: List[Spot]) -> None:
+    # Google が使えるなら、表示するときに写真を取りに行く
+    if google_client:
+        for spot in spots:
+            spot.details_pending = True
+
+
+class _Ranker:
+    """
+    共有の候補 Spot をコピーして採点・理由生成する。
+    同じ候補は1回しか採点しない（段階表示で先に出したカードと最終結果を同じ Spot にする）。
+    """
+
+    def __init__(self, params: dict):
+        self.params = params
+        self._scored = {}
+
+    def origin(self, fetched_origin):
+        # 地図指定は丸めたキーで候補を共有するので、採点は自分の起点で行う
+        if self.params["search_mode"] == "map":
+            return self.params["origin_lat"], self.params["origin_lng"]
+        return fetched_origin
+
+    def score(self, spots: List[Spot], fetched_origin) -> List[Spot]:
+        """スコア順に並べた採点済み Spot（total_score が無いものは除く）。"""
+        todo = [s for s in spots if id(s) not in self._scored]
+        priority = self.params["priority"]
+
+        with metrics.span("score"):
+            # 列にまとめて採点し、書き戻す先はコピー（キャッシュの Spot は書き換えない）
+            batch = SpotBatch.from_spots(todo)
+            copies = [s.clone() for s in todo]
+            if self.params["category"] == "restaurant":
+                # 予算・設備・起点からの距離（起点が分かれば）をまとめて計算する
+                apply_batch_scores(copies, score_restaurants_batch(batch, priority, self.origin(fetched_origin)))
+                scored = copies
             else:
-                station_lat, station_lng = google_client.geocode_station(station)
+                origin_lat, origin_lng = self.origin(fetched_origin)
+                queries = map_place_queries_from_genre_key(self.params["genre_key"])
+                place_types = sorted({place_type for place_type, _ in queries})
+                # 距離・人気・ジャンル一致はまとめて（NumPy で）計算する
+                apply_batch_scores(copies, score_places_batch(batch, priority, origin_lat, origin_lng, place_types))
+                scored = copies
+
+        with metrics.span("reason"):
+            for raw, spot in zip(todo, scored):
+                # 理由・滞在時間は1件ずつ独立に作れる
+                if spot.total_score is not None:
+                    generate_reason_and_stay_time(spot)
+                self._scored[id(raw)] = spot
 
-            place_type = map_place_type_from_genre_key(genre_key)
-            spots = google_client.nearby_places(station_lat, station_lng, place_type, radius=radius)
+        # total_score があるものだけ → スコア順に全部並べる（同点は元の並び順のまま）
+        ranked = [self._scored[id(s)] for s in spots]
+        ranked = [s for s in ranked if s.total_score is not None]
+        ranked.sort(key=lambda s: s.total_score, reverse=True)
+        return ranked
 
-            scored_spots = [
-                calc_place_scores(s, priority, station_lat, station_lng, place_type)
-                for s in spots
-            ]
 
-        # total_score があるものだけ → スコア順に全部並べる
-        scored_spots = [s for s in scored_spots if s.total_score is not None]
-        scored_spots.sort(key=lambda s: s.total_score, reverse=True)
-        ranked_spots = [generate_reason_and_stay_time(s) for s in scored_spots]
+def rank_candidates(params: dict, on_spot: Optional[Callable[[Spot], None]] = None
+                    ) -> Tuple[List[Spot], Optional[Tuple[float, float]]]:
+    """
+    検索条件 → 候補取得・補完・スコア計算・理由生成 → (スコア順の Spot リスト, 起点)。
+    on_spot を渡すと、1件仕上がるたびに呼ぶ（段階表示用）。
+    同じ条件の検索が実行中ならその結果を待って共有し、直近の結果はしばらく使い回す。
+    """
+    ranker = _Ranker(params)
+    key = search_key(params)
+
+    def stream(spots: List[Spot], origin) -> None:
+        if on_spot is not None:
+            for spot in ranker.score(spots, origin):
+                on_spot(spot)
+
+    fetched = cached_candidates(key)
+    if fetched is MISSING:
+        def run() -> dict:
+            with metrics.span("candidates"):
+                result = fetch_candidates(params, on_candidates=stream)
+            cache_candidates(key, result)
+            return result
+
+        fetched, leader = search_flight.do(key, run)
+        if not leader:
+            metrics.count("search.shared")
+            stream(fetched["spots"], fetched["origin"])
+    else:
+        metrics.count("cache.search.hit")
+        stream(fetched["spots"], fetched["origin"])
+
+    return ranker.score(fetched["spots"], fetched["origin"]), ranker.origin(fetched["origin"])
+
+
+def search_ranked_spots(params: dict, on_spot: Optional[Callable[[Spot], None]] = None) -> List[Spot]:
+    """rank_candidates の結果に、LLM の理由文の依頼と最初に見せるカードの詳細を足したもの。"""
+    ranked, origin = rank_candidates(params, on_spot)
+    # LLM の理由文は送るだけ（待たない。届いたらページが /reasons から取りに来る）
+    if batch_reasoner:
+        batch_reasoner.submit(ranked)
+    if DETAILS_TOP_N > 0 and google_client:
+        # 詳細（写真・住所）は最初に見せるカードの分だけ取る
+        with metrics.span("details"):
+            hydrate_details(google_client, ranked[:DETAILS_TOP_N], max_workers=ENRICH_MAX_WORKERS,
+                            matcher=shop_matcher, origin=origin, deadline_sec=ENRICH_DEADLINE_SEC)
+    return ranked
+
+
+@app.route("/recommend", methods=["POST"])
+def recommend():
+    params, error = read_search_form(request.form)
+    if error:
+        flash(error, "error")
+        return redirect(url_for("index"))
+
+    if PROGRESSIVE_RESULTS:
+        return _recommend_progressive(params)
+
+    ranked_spots: List[Spot] = []
+
+    try:
+        ranked_spots = search_ranked_spots(params)
+
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+        flash("アクセスが集中しています。少し時間をおいて再度お試しください。", "error")
+        return redirect(url_for("index"))
 
     except Exception as e:
         print("ERROR:", e)
@@ -225,60 +575,601 @@ def recommend():
         flash("条件に合うスポットが見つかりませんでした。駅名やジャンルを変えて再度お試しください。", "error")
         return redirect(url_for("index"))
 
+    with metrics.span("render"):
+        return render_results(params, ranked_spots)
+
+
+def render_results(params: dict, spots: List[Spot], job: Optional[SearchJob] = None, loading: bool = False):
+    """
+    結果ページ（カードスタック）。中身まで描くのは先頭の CARD_PREFETCH + 1 枚だけで、
+    残りは枠だけ置いておき、スワイプで近づいたら取りに来てもらう。
+    - 検索済みの spots は /recommend/cards に検索条件ごと取りに来る（サーバーに結果を預けないので、
+      どのワーカーに来ても・時間が経っても同じ検索をやり直して描ける）
+    - loading=True なら job が終わるまで新しいカードを /recommend/jobs/<job_id> から取りに来てもらう（段階表示）
+    """
+    if job is not None:
+        cards_url = url_for("recommend_job_cards", job_id=job.id)
+    else:
+        cards_url = url_for("recommend_cards", **search_query(params))
     return render_template(
         "result.html",
-        category=category,
-        genre_label=genre_label,
-        priority=priority,
-        station=station,
-        spots=ranked_spots,   # カードスタック用のリスト
+        category=params["category"],
+        genre_label=params["genre_label"],
+        priority=params["priority"],
+        station=params["station"],
+        spots=spots,   # カードスタック用のリスト
+        job_id=job.id if job is not None else None,
+        cards_url=cards_url,
+        loading=loading,
+        card_prefetch=CARD_PREFETCH,
+        itinerary_top_k=ITINERARY_TOP_K,
+        origin=search_origin(params),
+        reason_key=card_reason_key(),
+        reason_poll_sec=REASONER_DEADLINE_SEC if batch_reasoner else 0,
     )
 
 
+def search_query(params: dict) -> dict:
+    """検索条件 → 検索フォームと同じ名前のクエリ（read_search_form で読み戻せる）"""
+    query = {
+        "category": params["category"],
+        "genre": params["genre_key"],
+        "priority": params["priority"],
+        "search_mode": params["search_mode"],
+        "radius": params["radius"],
+    }
+    if params["search_mode"] == "map":
+        query["lat"], query["lng"] = params["origin_lat"], params["origin_lng"]
+    else:
+        query["station"] = params["station"]
+    return query
+
+
+def card_reason_key():
+    """
+    カードに載せる理由文のキーを作る関数 (spot, rank) → キー（LLM の文を後から差し替えるとき）。
+    LLM に送るのは上位 REASONER_MAX_SPOTS 件だけなので、それより下のカードは None。LLM を使わなければ None
+    """
+    if not batch_reasoner:
+        return None
+    return lambda spot, rank: reason_key(spot) if rank <= batch_reasoner.max_spots else None
+
+
+def search_origin(params: dict) -> Optional[Tuple[float, float]]:
+    """行程の起点（地図の位置 or 手元の駅の座標）。API は呼ばないので分からなければ None"""
+    if params["search_mode"] == "map":
+        return params["origin_lat"], params["origin_lng"]
+    return station_gazetteer.lookup(params["station"])
+
+
+def _recommend_progressive(params: dict):
+    """
+    ページの枠だけ先に返し、カードは検索ジョブの進み具合に合わせて
+    /recommend/jobs/<job_id> から少しずつ取りに来てもらう。
+    """
+    trace = metrics.current_trace()
+    trace_id = trace.id if trace is not None else None
+
+    def run(job: SearchJob) -> None:
+        # レスポンスを返した後も続くので、同じ trace_id で別のログ行にする
+        with metrics.traced("search_job", trace_id=trace_id, job_id=job.id):
+            job.finish(search_ranked_spots(params, on_spot=job.add))
+
+    job = search_jobs.start(run)
+    return render_results(params, [], job, loading=True)
+
+
+@app.route("/recommend/jobs/<job_id>")
+def recommend_job(job_id: str):
+    """段階表示用：いま仕上がっているカードのキーを暫定順位で返す（中身は /cards で取る）。"""
+    job = search_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": JOB_EXPIRED_MESSAGE}), 404
+
+    keys = [key for key, _ in job.snapshot()]
+    return jsonify({"done": job.done, "error": job.error, "keys": keys})
+
+
+@app.route("/recommend/jobs/<job_id>/cards")
+def recommend_job_cards(job_id: str):
+    """段階表示用：?keys=3,4,5 のカードの HTML を返す（表示中のカードとその少し先だけ取りに来る）。"""
+    job = search_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": JOB_EXPIRED_MESSAGE}), 404
+
+    wanted = _card_keys()
+    if wanted is None:
+        return jsonify({"error": "bad keys"}), 400
+
+    ranks = {key: (i + 1, spot) for i, (key, spot) in enumerate(job.snapshot())}
+    return jsonify({"cards": _render_cards([(key, *ranks[key]) for key in wanted if key in ranks])})
+
+
+@app.route("/recommend/cards")
+def recommend_cards():
+    """
+    ?keys=3,4,5 と検索フォームと同じ条件（search_query）で、その順位のカードの HTML を返す。
+    候補はキャッシュ（無ければ検索をやり直したもの）から採点し直すので、検索ジョブが無くても描ける。
+    キーはカードの順位（0 始まり）。
+    """
+    wanted = _card_keys()
+    if wanted is None:
+        return jsonify({"error": "bad keys"}), 400
+    try:
+        params, error = read_search_form(request.args)
+    except ValueError:
+        params, error = None, "bad parameters"
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        ranked, origin = rank_candidates(params)
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+        return jsonify({"error": "アクセスが集中しています。少し時間をおいて再度お試しください。"}), 503
+    except Exception as e:
+        print("ERROR:", e)
+        return jsonify({"error": "カードを読み込めませんでした。"}), 500
+
+    found = [(key, key + 1, ranked[key]) for key in wanted if 0 <= key < len(ranked)]
+    return jsonify({"cards": _render_cards(found, origin)})
+
+
+def _card_keys() -> Optional[List[int]]:
+    """?keys=3,4,5 → [3, 4, 5]（最大 CARD_BATCH_MAX 件）。不正なら None"""
+    try:
+        return [int(k) for k in request.args.get("keys", "").split(",") if k][:CARD_BATCH_MAX]
+    except ValueError:
+        return None
+
+
+def _render_cards(found: List[Tuple[int, int, Spot]], origin: Optional[Tuple[float, float]] = None) -> List[dict]:
+    """
+    (キー, 順位, Spot) のカードを描く。
+    詳細（写真・住所）が未取得のものはここで取り、届いている LLM の理由文は差し替えてから描く。
+    """
+    spots = [spot for _, _, spot in found]
+    if batch_reasoner:
+        batch_reasoner.apply_cached(spots)
+    if google_client:
+        with metrics.span("details"):
+            hydrate_details(google_client, spots, max_workers=ENRICH_MAX_WORKERS,
+                            matcher=shop_matcher, origin=origin, deadline_sec=ENRICH_DEADLINE_SEC)
+
+    with metrics.span("render"):
+        return [
+            {"key": key, "html": render_template("_card.html", spot=spot, rank=rank, key=key,
+                                                 reason_key=card_reason_key())}
+            for key, rank, spot in found
+        ]
+
+
+# reason_key の形（sha1 の16進）
+REASON_KEY_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+
+@app.route("/reasons")
+def spot_reasons():
+    """
+    ?keys=<reason_key>,... のうち LLM の理由文が届いているものを返す
+    （結果ページがルールベースの文を差し替えるために取りに来る）。
+    """
+    if not batch_reasoner:
+        return jsonify({"reasons": {}})
+    keys = [k for k in request.args.get("keys", "").split(",") if k][:REASONER_MAX_SPOTS]
+    if not all(REASON_KEY_PATTERN.match(k) for k in keys):
+        return jsonify({"error": "bad keys"}), 400
+    found = batch_reasoner.lookup(keys)
+    return jsonify({"reasons": {
+        key: {"reason": text, "stay_time_minutes": stay} for key, (text, stay) in found.items()
+    }})
+
+
+@app.route("/itinerary", methods=["POST"])
+def itinerary_plan():
+    """
+    JSON の spots（順位順。key / name / spot_type / lat / lng / stay_minutes / score）を、
+    start（"10:00"）から minutes 分で回る順に並べる。lat / lng があればそこから出発する。
+    カードの値をそのまま送ってもらうので、検索ジョブが無くても（別ワーカー・期限切れでも）作れる。
+    時間に収まらなかったスポットは dropped に key を入れて返す。
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("spots"), list):
+        return jsonify({"error": "bad parameters"}), 400
+    try:
+        minutes = min(max(int(body.get("minutes", ITINERARY_MINUTES)), 30), 24 * 60)
+        start = parse_clock(str(body.get("start", ITINERARY_START)))
+        origin = (float(body["lat"]), float(body["lng"])) if body.get("lat") is not None and body.get("lng") is not None else None
+        chosen = [_itinerary_spot(item) for item in body["spots"][:ITINERARY_MAX_STOPS]]
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "bad parameters"}), 400
+    if not chosen:
+        return jsonify({"error": "行程に入れるスポットがありません。"}), 400
+
+    with metrics.span("itinerary"):
+        plan = plan_spots([spot for _, spot in chosen], start, minutes, origin=origin)
+
+    stops = []
+    for stop in plan.stops:
+        key, spot = chosen[stop.index]
+        stops.append({
+            "key": key,
+            "name": spot.name,
+            "spot_type": spot.spot_type,
+            "lat": spot.lat,
+            "lng": spot.lng,
+            "arrive": format_clock(stop.arrive_min),
+            "depart": format_clock(stop.depart_min),
+            "stay_minutes": round(stop.depart_min - stop.arrive_min),
+            "travel_minutes": round(stop.travel_min),
+        })
+    return jsonify({
+        "stops": stops,
+        "dropped": [chosen[i][0] for i in plan.dropped],
+        "start": format_clock(plan.start_min),
+        "end": format_clock(plan.end_min),
+        "travel_minutes": round(plan.travel_min),
+        "solve_ms": round(plan.solve_ms, 2),
+    })
+
+
+def _itinerary_spot(item: dict) -> Tuple[str, Spot]:
+    """/itinerary の spots の1件 → (key, 行程を組むのに要る項目だけの Spot)。不正なら ValueError"""
+    lat, lng = float(item["lat"]), float(item["lng"])
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(f"bad location: {lat},{lng}")
+    stay = item.get("stay_minutes")
+    spot = Spot(
+        name=str(item.get("name", "")),
+        spot_type="restaurant" if item.get("spot_type") == "restaurant" else "place",
+        address="",
+        lat=lat,
+        lng=lng,
+        genre="",
+        stay_time_minutes=min(max(int(stay), 1), 24 * 60) if stay else None,
+        total_score=float(item.get("score") or 0),
+    )
+    return str(item.get("key", "")), spot
+
+
+# place_id として受け付ける文字（任意の文字列で Places API を呼ばせない）
+PLACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,256}$")
+
+
+@app.route("/places/<place_id>/details")
+def place_details(place_id: str):
+    """
+    カードの詳細（写真・住所・評価）を後から埋める用。
+    ?fields=basic なら評価を除いた安いフィールドだけ取る。
+    """
+    if not google_client:
+        return jsonify({"error": "Google API キーが設定されていません。"}), 503
+    if not PLACE_ID_PATTERN.match(place_id):
+        return jsonify({"error": "bad place_id"}), 400
+
+    fields = google_client.DETAILS_BASIC_FIELDS if request.args.get("fields") == "basic" else None
+    details = google_client.get_place_details(place_id, fields)
+    if not details:
+        return jsonify({"error": "not found"}), 404
+
+    spot = Spot.from_google_details(details, details_photo_url(google_client, details))
+    photo = None
+    if spot.image_url:
+        photo = {
+            "src": url_for("photo_proxy", url=spot.image_url, w=480),
+            "srcset": f"{url_for('photo_proxy', url=spot.image_url, w=480)} 1x, "
+                      f"{url_for('photo_proxy', url=spot.image_url, w=480, dpr=2)} 2x",
+        }
+    resp = jsonify({
+        "name": spot.name,
+        "address": spot.address,
+        "genre": spot.genre,
+        "rating": spot.rating,
+        "reviews_count": spot.reviews_count,
+        "photo": photo,
+    })
+    resp.headers["Cache-Control"] = "private, max-age=3600"
+    return resp
+
+
+@app.route("/stations/suggest")
+def station_suggest():
+    """駅名入力のオートコンプリート用（駅名表の前方一致）。"""
+    q = request.args.get("q", "")
+    return jsonify(station_gazetteer.suggest(q, limit=10))
+
+
+# ---- 運用向けの状態確認 ----
+
+# これらのエンドポイントは構造化ログを出さない（数が多く、中身もない）
+TRACE_LOG_SKIP = {"static", "metrics_endpoint"}
+
+
+@app.before_request
+def _start_request_trace():
+    # 上流（ロードバランサなど）が付けた ID があればそれを trace_id に使う
+    incoming = request.headers.get("X-Request-Id", "")[:64] or None
+    g.trace, g.trace_token = metrics.start_trace("request", incoming)
+
+
+@app.after_request
+def _finish_request_trace(resp):
+    trace = g.get("trace")
+    if trace is not None:
+        resp.headers["X-Trace-Id"] = trace.id
+        g.status = resp.status_code
+    return resp
+
+
+@app.teardown_request
+def _log_request_trace(exc):
+    token = g.pop("trace_token", None)
+    if token is None:
+        return
+    endpoint = request.endpoint or "unknown"
+    status = 500 if exc is not None else g.get("status", 500)
+    record = metrics.end_trace(
+        token,
+        log=endpoint not in TRACE_LOG_SKIP,
+        method=request.method,
+        path=request.path,
+        endpoint=endpoint,
+        status=status,
+    )
+    metrics.REGISTRY.observe("tourism_http_request_seconds", record["duration_ms"] / 1000, endpoint=endpoint)
+    metrics.REGISTRY.inc("tourism_http_requests_total", endpoint=endpoint, status=status)
+
+
+def _collect_app_metrics():
+    """/stats と同じ値を Prometheus 形式で出す。"""
+    caches = (place_id_cache, details_cache, shop_place_cache, search_result_cache, reason_cache)
+    yield ("tourism_cache_hits_total", "counter", "Cache hits per cache.",
+           [({"cache": c.name}, c.hits) for c in caches])
+    yield ("tourism_cache_misses_total", "counter", "Cache misses per cache.",
+           [({"cache": c.name}, c.misses) for c in caches])
+    yield ("tourism_cache_entries", "gauge", "Entries held in memory per cache.",
+           [({"cache": c.name}, len(c)) for c in caches])
+
+    quota = api_quota.stats()
+    for field, kind, help_text in (
+        ("calls", "counter", "Upstream API calls per endpoint."),
+        ("denied", "counter", "Upstream API calls skipped by the client-side rate limiter."),
+        ("over_limit", "counter", "429 / OVER_QUERY_LIMIT responses per endpoint."),
+        ("estimated_cost_usd", "gauge", "Estimated upstream API cost per endpoint."),
+    ):
+        name = f"tourism_api_{field}" + ("_total" if kind == "counter" else "")
+        yield (name, kind, help_text, [({"endpoint": e}, c[field]) for e, c in quota.items()])
+
+    flight = search_flight.stats()
+    yield ("tourism_search_shared_total", "counter", "Searches that joined an identical in-flight search.",
+           [({}, flight["shared"])])
+    index = spot_index.stats()
+    yield ("tourism_spot_index_hits_total", "counter", "Nearby queries answered from the local spot index.",
+           [({}, index["hits"])])
+
+
+metrics.REGISTRY.register_collector(_collect_app_metrics)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus 形式のメトリクス（段階ごとのレイテンシのヒストグラムなど）。"""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/stats")
+def stats():
+    """キャッシュのヒット/ミス数や外部 API の呼び出し数・概算料金などを JSON で返す。"""
+    return jsonify({
+        "places_cache": {
+            "place_id": place_id_cache.stats(),
+            "details": details_cache.stats(),
+            "shop_place": shop_place_cache.stats(),
+        },
+        "api_quota": api_quota.stats(),
+        "stations": len(station_gazetteer),
+        "snapshot": snapshot.info() if snapshot is not None else None,
+        "spot_index": spot_index.stats(),
+        "search": {
+            "results": search_result_cache.stats(),
+            "single_flight": search_flight.stats(),
+        },
+        "reasoner": batch_reasoner.stats() if batch_reasoner else {"backend": "rule"},
+    })
+
+
 # ---- 画像プロキシ（Google Photo API の403対策）----
 
 ALLOWED_IMAGE_HOSTS = {
     "maps.googleapis.com",
     "lh3.googleusercontent.com",
 }
+if GOOGLE_API_BASE_URL:
+    # 代役サーバーの写真も Google Photo API と同じ扱いにする
+    ALLOWED_IMAGE_HOSTS.add(urlparse(GOOGLE_API_BASE_URL).hostname)
+    GOOGLE_PHOTO_HOSTS.add(urlparse(GOOGLE_API_BASE_URL).hostname)
 
-@app.route("/photo")
-def photo_proxy():
+# 画像のディスクキャッシュ（photo_reference + 幅 ごとに保存し、上限を超えたら古い順に削除）
+PHOTO_CACHE_DIR = os.getenv(
+    "PHOTO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "photo_cache")
+)
+PHOTO_CACHE_MAX_MB = int(os.getenv("PHOTO_CACHE_MAX_MB", "512"))
+PHOTO_MAX_AGE_SEC = 86400
+PHOTO_CACHE_CONTROL = f"public, max-age={PHOTO_MAX_AGE_SEC}"
+
+photo_cache = PhotoCache(PHOTO_CACHE_DIR, max_bytes=PHOTO_CACHE_MAX_MB * 1024 * 1024)
+
+def plan_photo_request(img_url: str, w: Optional[str], dpr: Optional[str], accept: str):
     """
-    Google Places Photo 等の画像をサーバー側で取得して返す。
-    ブラウザ直アクセスだと403になりやすいのを回避する。
+    /photo の引数 → (取得・変換の方針, None)。不正なら (None, (メッセージ, ステータス))。
+    方針は source_url（取得する URL）・resize_width（こちらで縮小する幅）・fmt・transform・key。
     """
-    img_url = request.args.get("url", "")
     if not img_url:
-        return ("missing url", 400)
+        return None, ("missing url", 400)
 
     # 簡易セキュリティ（オープンプロキシ防止）
     try:
         u = urlparse(img_url)
     except Exception:
-        return ("bad url", 400)
+        return None, ("bad url", 400)
 
     if u.scheme not in ("http", "https"):
-        return ("bad scheme", 400)
+        return None, ("bad scheme", 400)
 
     if u.hostname not in ALLOWED_IMAGE_HOSTS:
-        return ("host not allowed", 403)
+        return None, ("host not allowed", 403)
 
+    # 表示幅（CSS px）と DPR から作る幅を決め、Accept から返す形式を決める
     try:
-        r = requests.get(img_url, timeout=8, allow_redirects=True, stream=True)
-        r.raise_for_status()
+        width = snap_width(int(w or 0), float(dpr or 1))
+    except ValueError:
+        return None, ("bad size", 400)
+    fmt = negotiate_format(accept)
+
+    # Google Photo は maxwidth を変えれば Google 側で縮小してくれる
+    source_url = img_url
+    resize_locally = width is not None
+    if width and is_google_photo_url(img_url):
+        source_url = with_maxwidth(img_url, width)
+        resize_locally = False
+
+    transform = can_transcode() and (fmt is not None or resize_locally)
+    variant = f"{fmt or 'jpeg'}@{width or 0}" if transform else ""
+    return {
+        "source_url": source_url,
+        "resize_width": width if resize_locally else None,
+        "fmt": fmt,
+        "transform": transform,
+        "key": photo_cache_key(source_url, variant),
+    }, None
 
-        content_type = r.headers.get("Content-Type", "image/jpeg")
-        data = r.content
 
-        resp = Response(data, mimetype=content_type)
-        resp.headers["Cache-Control"] = "public, max-age=86400"
+@app.route("/photo")
+def photo_proxy():
+    """
+    Google Places Photo 等の画像をサーバー側で取得して返す。
+    ブラウザ直アクセスだと403になりやすいのを回避する。
+    取得した画像はディスクにキャッシュし、2回目以降はディスクから返す。
+    w（表示幅）/ dpr を付けると縮小版を、Accept が対応していれば WebP / AVIF を返す。
+    """
+    plan, error = plan_photo_request(
+        request.args.get("url", ""),
+        request.args.get("w"),
+        request.args.get("dpr"),
+        request.headers.get("Accept", ""),
+    )
+    if error:
+        return error
+    key = plan["key"]
+
+    # 同じ写真（photo_reference + 幅 + 形式）なら中身は変わらないので、ETag が一致すれば 304
+    if key in request.if_none_match:
+        return _photo_headers(Response(status=304), key)
+
+    cached = photo_cache.lookup(key)
+    metrics.count("cache.photo.hit" if cached is not None else "cache.photo.miss")
+    if cached is not None:
+        body_path, meta = cached
+        resp = send_file(
+            body_path,
+            mimetype=meta.get("content_type", "image/jpeg"),
+            conditional=True,
+            etag=key,
+            last_modified=meta.get("stored_at"),
+            max_age=PHOTO_MAX_AGE_SEC,
+        )
+        resp.vary.add("Accept")
         return resp
 
+    source_url = plan["source_url"]
+    if plan["transform"]:
+        return _photo_variant(source_url, key, plan["resize_width"], plan["fmt"])
+
+    try:
+        r = _fetch_photo(source_url, stream=True)
+        r.raise_for_status()
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+        return _photo_busy()
     except Exception as e:
         print("PHOTO_PROXY_ERROR:", e)
         return ("failed to fetch image", 502)
 
+    content_type = r.headers.get("Content-Type", "image/jpeg")
+    if not content_type.startswith("image/"):
+        r.close()
+        return ("not an image", 502)
+
+    def generate():
+        # 全体をメモリに載せず、チャンクごとにクライアントへ流しつつディスクに保存
+        try:
+            yield from photo_cache.store_stream(key, r.iter_content(CHUNK_SIZE), content_type)
+        finally:
+            r.close()
+
+    return _photo_headers(Response(generate(), mimetype=content_type), key)
+
+
+def _fetch_photo(source_url: str, **kwargs):
+    """元画像を取得する。Google Photo API はレート制限と料金の集計を通す。"""
+    billed = is_google_photo_url(source_url)
+    if billed and not api_quota.acquire("photo"):
+        raise QuotaExceeded("photo: レート上限のため取得を見送りました")
+    with metrics.span("photo.fetch"):
+        r = http_get(source_url, timeout=8, allow_redirects=True, **kwargs)
+    if billed:
+        api_quota.check_response("photo", r)
+    return r
+
+
+def _photo_busy() -> Response:
+    # ブラウザには少し後で取り直してもらう（キャッシュさせない）
+    resp = Response("rate limited", status=503, mimetype="text/plain")
+    resp.headers["Retry-After"] = "2"
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+def _photo_variant(source_url: str, key: str, width, fmt):
+    """
+    縮小・形式変換した派生画像を作って返す（元画像もキャッシュしておく）。
+    変換できない画像は元のまま返す。
+    """
+    source_key = photo_cache_key(source_url)
+    source = photo_cache.read_bytes(source_key)
+    if source is None:
+        try:
+            r = _fetch_photo(source_url)
+            r.raise_for_status()
+        except QuotaExceeded as e:
+            print("QUOTA:", e)
+            return _photo_busy()
+        except Exception as e:
+            print("PHOTO_PROXY_ERROR:", e)
+            return ("failed to fetch image", 502)
+        content_type = r.headers.get("Content-Type", "image/jpeg")
+        if not content_type.startswith("image/"):
+            return ("not an image", 502)
+        source = (r.content, content_type)
+        photo_cache.store_bytes(source_key, *source)
+
+    try:
+        with metrics.span("photo.transcode"):
+            data, mimetype = transcode(source[0], width, fmt)
+    except ValueError as e:
+        print("PHOTO_TRANSCODE_ERROR:", e)
+        data, mimetype = source
+
+    photo_cache.store_bytes(key, data, mimetype)
+    return _photo_headers(Response(data, mimetype=mimetype), key)
+
+
+def _photo_headers(resp: Response, key: str) -> Response:
+    resp.set_etag(key)
+    if resp.status_code == 200:
+        resp.last_modified = time.time()
+    resp.headers["Cache-Control"] = PHOTO_CACHE_CONTROL
+    resp.vary.add("Accept")
+    return resp
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
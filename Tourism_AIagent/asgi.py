@@ -0,0 +1,415 @@
+# asgi.py
+"""
+/recommend と /photo を非同期で処理する ASGI アプリ。
+それ以外のページ（トップ・/stats・/metrics など）は Flask アプリをそのまま載せて返す。
+
+    pip install -r requirements.txt   # starlette / httpx / uvicorn / a2wsgi を含む
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+上流 API や画像の取得を待つ間にスレッドを占有しないので、1プロセスで数百件の
+検索・画像取得を同時に抱えられる。キャッシュ・駅名表・空間インデックス・レート制限・
+採点・テンプレートは app.py のものをそのまま共有する（flask run での同期版もそのまま動く）。
+"""
+import email.utils
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from flask import flash, redirect, session, url_for
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # 無ければ Starlette 同梱の（非推奨の）ものを使う
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as sync_app
+import metrics
+from async_clients import AsyncGooglePlacesClient, AsyncHotpepperClient
+from async_http import aclose_async_client, http_get_async
+from cache import MISSING
+from hotpepper_client import range_code_for_radius
+from enrichment import enrich_hotpepper_spots_async, hydrate_details_async
+from image_variants import is_google_photo_url, transcode
+from photo_cache import CHUNK_SIZE, photo_cache_key
+from rate_limiter import QuotaExceeded
+from singleflight import AsyncSingleFlight
+from spot import Spot
+
+search_flight = AsyncSingleFlight()
+
+metrics.REGISTRY.register_collector(lambda: [(
+    "tourism_async_search_shared_total", "counter",
+    "Async searches that joined an identical in-flight search.",
+    [({}, search_flight.shared)],
+)])
+
+
+def _google() -> AsyncGooglePlacesClient:
+    if not sync_app.google_client:
+        raise RuntimeError("Google API キーが設定されていません。")
+    return AsyncGooglePlacesClient(sync_app.google_client)
+
+
+def _hotpepper() -> AsyncHotpepperClient:
+    if not sync_app.hotpepper_client:
+        raise RuntimeError("Hotpepper API キーが設定されていません。")
+    return AsyncHotpepperClient(sync_app.hotpepper_client)
+
+
+# ---- 検索（app.fetch_candidates / search_ranked_spots の非同期版）----
+
+async def fetch_candidates_async(params: dict) -> dict:
+    search_mode = params["search_mode"]
+    origin_lat, origin_lng = params["origin_lat"], params["origin_lng"]
+
+    if params["category"] == "restaurant" and sync_app.HOTPEPPER_FAST_PATH:
+        origin = await restaurant_origin_async(params)
+        candidates = await _hotpepper().search_pool(
+            station_keyword=params["station"],
+            user_genre_keyword=params["genre_label"],
+            max_results=sync_app.HOTPEPPER_POOL_SIZE,
+            lat=origin[0] if origin else None,
+            lng=origin[1] if origin else None,
+            range_code=range_code_for_radius(params["radius"]),
+        )
+        sync_app.mark_photos_pending(candidates)
+    elif params["category"] == "restaurant":
+        hotpepper, google = _hotpepper(), _google()
+        origin = (origin_lat, origin_lng) if search_mode == "map" else None
+        hp_spots = await hotpepper.search_restaurants(
+            station_keyword=params["station"],
+            user_genre_keyword=params["genre_label"],
+            count=10,
+            lat=origin_lat if search_mode == "map" else None,
+            lng=origin_lng if search_mode == "map" else None,
+        )
+        with metrics.span("enrich"):
+            candidates = await enrich_hotpepper_spots_async(
+                google,
+                hp_spots,
+                max_concurrency=sync_app.ENRICH_MAX_WORKERS,
+                deadline_sec=sync_app.ENRICH_DEADLINE_SEC,
+                matcher=sync_app.shop_matcher,
+                origin=origin,
+                fetch_details=sync_app.DETAILS_TOP_N <= 0,
+            )
+    else:
+        google = _google()
+        if search_mode == "map" and origin_lat is not None and origin_lng is not None:
+            origin = (origin_lat, origin_lng)
+        else:
+            origin = await google.geocode_station(params["station"])
+
+        queries = sync_app.map_place_queries_from_genre_key(params["genre_key"])
+        candidates: List[Spot] = []
+        async for page in google.iter_nearby_pages_multi(
+            origin[0], origin[1], queries,
+            radius=params["radius"],
+            max_pages=sync_app.NEARBY_MAX_PAGES,
+            max_results=sync_app.NEARBY_MAX_RESULTS,
+            time_budget_sec=sync_app.NEARBY_TIME_BUDGET_SEC,
+        ):
+            candidates.extend(page)
+
+    return {"origin": origin, "spots": candidates}
+
+
+async def restaurant_origin_async(params: dict) -> Optional[Tuple[float, float]]:
+    """app.restaurant_origin の非同期版。"""
+    if params["search_mode"] == "map":
+        return params["origin_lat"], params["origin_lng"]
+    if not sync_app.google_client:
+        return None
+    try:
+        return await _google().geocode_station(params["station"])
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+    except Exception as e:
+        print("GEOCODE_ERROR:", e)
+    return None
+
+
+async def search_ranked_spots_async(params: dict) -> List[Spot]:
+    """
+    検索条件 → スコア順の Spot リスト。
+    直近の結果キャッシュは同期版と共有し、同じ条件の同時検索は1回にまとめる。
+    """
+    ranker = sync_app._Ranker(params)
+    key = sync_app.search_key(params)
+
+    fetched = sync_app.cached_candidates(key)
+    if fetched is MISSING:
+        async def run() -> dict:
+            with metrics.span("candidates"):
+                result = await fetch_candidates_async(params)
+            sync_app.cache_candidates(key, result)
+            return result
+
+        fetched, leader = await search_flight.do(key, run)
+        if not leader:
+            metrics.count("search.shared")
+    else:
+        metrics.count("cache.search.hit")
+
+    # 採点・理由生成は CPU を使うのでスレッドで
+    ranked = await run_in_threadpool(ranker.score, fetched["spots"], fetched["origin"])
+    # LLM の理由文は送るだけ（待たない。届いたらページが /reasons から取りに来る）
+    if sync_app.batch_reasoner:
+        sync_app.batch_reasoner.submit_async(ranked)
+    if sync_app.DETAILS_TOP_N > 0 and sync_app.google_client:
+        with metrics.span("details"):
+            await hydrate_details_async(_google(), ranked[:sync_app.DETAILS_TOP_N],
+                                        matcher=sync_app.shop_matcher, origin=ranker.origin(fetched["origin"]),
+                                        deadline_sec=sync_app.ENRICH_DEADLINE_SEC)
+    return ranked
+
+
+# ---- Flask 側のテンプレート・flash をそのまま使う ----
+
+async def _flask_response(request: Request, form: dict, view: Callable[[], object]) -> Response:
+    """
+    Flask のリクエストコンテキストの中で view を実行し、その応答を返す
+    （render_template / url_for / flash のセッション Cookie を同期版と同じにするため）。
+    テンプレートの描画はスレッドで行い、イベントループを止めない。
+    """
+    flask_app = sync_app.app
+    cookie = request.headers.get("cookie")
+
+    def run():
+        with flask_app.test_request_context(
+            request.url.path,
+            method=request.method,
+            base_url=str(request.base_url),
+            headers={"Cookie": cookie} if cookie else None,
+            data=form,
+        ):
+            rv = flask_app.make_response(view())
+            flask_app.session_interface.save_session(flask_app, session, rv)
+            return rv
+
+    rv = await run_in_threadpool(run)
+    resp = Response(rv.get_data(), status_code=rv.status_code)
+    resp.raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in rv.headers.items()]
+    return resp
+
+
+def _redirect_with_error(message: str) -> Callable[[], object]:
+    def view():
+        flash(message, "error")
+        return redirect(url_for("index"))
+    return view
+
+
+def traced_route(endpoint: str):
+    """Flask 側の before/after_request と同じ trace_id・構造化ログ・メトリクスを付ける。"""
+    def decorator(handler):
+        async def wrapper(request: Request) -> Response:
+            incoming = request.headers.get("x-request-id", "")[:64] or None
+            trace, token = metrics.start_trace("request", incoming)
+            status = 500
+            try:
+                resp = await handler(request)
+                resp.headers["X-Trace-Id"] = trace.id
+                status = resp.status_code
+                return resp
+            finally:
+                record = metrics.end_trace(
+                    token, method=request.method, path=request.url.path, endpoint=endpoint, status=status,
+                )
+                metrics.REGISTRY.observe(
+                    "tourism_http_request_seconds", record["duration_ms"] / 1000, endpoint=endpoint
+                )
+                metrics.REGISTRY.inc("tourism_http_requests_total", endpoint=endpoint, status=status)
+        return wrapper
+    return decorator
+
+
+@traced_route("recommend")
+async def recommend(request: Request) -> Response:
+    form = dict(parse_qsl((await request.body()).decode("utf-8"), keep_blank_values=True))
+    params, error = sync_app.read_search_form(form)
+    if error:
+        return await _flask_response(request, form, _redirect_with_error(error))
+
+    if sync_app.PROGRESSIVE_RESULTS:
+        # 段階表示はジョブ（スレッド）で進める同期版の仕組みをそのまま使う
+        return await _flask_response(request, form, lambda: sync_app._recommend_progressive(params))
+
+    try:
+        ranked_spots = await search_ranked_spots_async(params)
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+        return await _flask_response(
+            request, form, _redirect_with_error("アクセスが集中しています。少し時間をおいて再度お試しください。")
+        )
+    except Exception as e:
+        print("ERROR:", e)
+        return await _flask_response(request, form, _redirect_with_error(f"推薦中にエラーが発生しました: {e}"))
+
+    if not ranked_spots:
+        return await _flask_response(request, form, _redirect_with_error(
+            "条件に合うスポットが見つかりませんでした。駅名やジャンルを変えて再度お試しください。"
+        ))
+
+    def view():
+        with metrics.span("render"):
+            return sync_app.render_results(params, ranked_spots)
+
+    return await _flask_response(request, form, view)
+
+
+# ---- 画像プロキシ（app.photo_proxy の非同期版）----
+
+def _etag_matches(header: str, key: str) -> bool:
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == key:
+            return True
+    return False
+
+
+def _photo_headers(resp: Response, key: str, last_modified: Optional[float] = None) -> Response:
+    resp.headers["ETag"] = f'"{key}"'
+    if resp.status_code == 200:
+        resp.headers["Last-Modified"] = email.utils.formatdate(last_modified, usegmt=True)
+    resp.headers["Cache-Control"] = sync_app.PHOTO_CACHE_CONTROL
+    resp.headers["Vary"] = "Accept"
+    return resp
+
+
+def _photo_busy() -> Response:
+    return PlainTextResponse(
+        "rate limited", status_code=503, headers={"Retry-After": "2", "Cache-Control": "no-store"}
+    )
+
+
+async def _fetch_photo(source_url: str, stream: bool = False):
+    billed = is_google_photo_url(source_url)
+    quota = sync_app.api_quota
+    if billed and not await quota.acquire_async("photo"):
+        raise QuotaExceeded("photo: レート上限のため取得を見送りました")
+    with metrics.span("photo.fetch"):
+        r = await http_get_async(source_url, timeout=8, follow_redirects=True, stream=stream)
+    if billed and r.status_code == 429:
+        quota.record_over_limit("photo")
+        await r.aclose()
+        raise QuotaExceeded("photo: 429 Too Many Requests")
+    return r
+
+
+def _transcode(data: bytes, width, fmt):
+    with metrics.span("photo.transcode"):
+        return transcode(data, width, fmt)
+
+
+async def _photo_variant(source_url: str, key: str, width, fmt) -> Response:
+    photo_cache = sync_app.photo_cache
+    source_key = photo_cache_key(source_url)
+    source = await run_in_threadpool(photo_cache.read_bytes, source_key)
+    if source is None:
+        try:
+            r = await _fetch_photo(source_url)
+            r.raise_for_status()
+        except QuotaExceeded as e:
+            print("QUOTA:", e)
+            return _photo_busy()
+        except Exception as e:
+            print("PHOTO_PROXY_ERROR:", e)
+            return PlainTextResponse("failed to fetch image", status_code=502)
+        content_type = r.headers.get("Content-Type", "image/jpeg")
+        if not content_type.startswith("image/"):
+            return PlainTextResponse("not an image", status_code=502)
+        source = (r.content, content_type)
+        await run_in_threadpool(photo_cache.store_bytes, source_key, *source)
+
+    # 縮小・変換は CPU を使うのでスレッドで
+    try:
+        data, mimetype = await run_in_threadpool(_transcode, source[0], width, fmt)
+    except ValueError as e:
+        print("PHOTO_TRANSCODE_ERROR:", e)
+        data, mimetype = source
+
+    await run_in_threadpool(photo_cache.store_bytes, key, data, mimetype)
+    return _photo_headers(Response(data, media_type=mimetype), key)
+
+
+@traced_route("photo_proxy")
+async def photo(request: Request) -> Response:
+    q = request.query_params
+    plan, error = sync_app.plan_photo_request(
+        q.get("url", ""), q.get("w"), q.get("dpr"), request.headers.get("accept", "")
+    )
+    if error:
+        return PlainTextResponse(error[0], status_code=error[1])
+    key = plan["key"]
+
+    if _etag_matches(request.headers.get("if-none-match", ""), key):
+        return _photo_headers(Response(status_code=304), key)
+
+    photo_cache = sync_app.photo_cache
+    cached = photo_cache.lookup(key)
+    metrics.count("cache.photo.hit" if cached is not None else "cache.photo.miss")
+    if cached is not None:
+        body_path, meta = cached
+        resp = FileResponse(body_path, media_type=meta.get("content_type", "image/jpeg"))
+        return _photo_headers(resp, key, meta.get("stored_at"))
+
+    source_url = plan["source_url"]
+    if plan["transform"]:
+        return await _photo_variant(source_url, key, plan["resize_width"], plan["fmt"])
+
+    try:
+        r = await _fetch_photo(source_url, stream=True)
+    except QuotaExceeded as e:
+        print("QUOTA:", e)
+        return _photo_busy()
+    except Exception as e:
+        print("PHOTO_PROXY_ERROR:", e)
+        return PlainTextResponse("failed to fetch image", status_code=502)
+
+    content_type = r.headers.get("Content-Type", "image/jpeg")
+    if r.status_code != 200 or not content_type.startswith("image/"):
+        print("PHOTO_PROXY_ERROR:", r.status_code, content_type)
+        await r.aclose()
+        return PlainTextResponse("failed to fetch image", status_code=502)
+
+    async def body():
+        # 全体をメモリに載せず、チャンクごとにクライアントへ流しつつディスクに保存
+        writer = photo_cache.open_writer(key, content_type)
+        try:
+            async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                if chunk:
+                    writer.write(chunk)
+                    yield chunk
+            writer.commit()
+        finally:
+            writer.abort()
+            await r.aclose()
+
+    return _photo_headers(StreamingResponse(body(), media_type=content_type), key)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await aclose_async_client()
+
+
+application = Starlette(
+    routes=[
+        Route("/recommend", recommend, methods=["POST"]),
+        Route("/photo", photo, methods=["GET"]),
+        # それ以外は Flask アプリへ
+        Mount("/", app=WSGIMiddleware(sync_app.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,257 @@
+# async_clients.py
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from async_http import http_get_async
+from cache import MISSING
+from google_client import GooglePlacesClient
+from hotpepper_client import HotpepperClient, MAX_COUNT_PER_PAGE
+from rate_limiter import QuotaExceeded
+from spot import Spot, spot_identity
+import metrics
+
+
+async def _get_json(quota, endpoint: str, span_name: str, url: str, params: dict) -> dict:
+    """レート制限 → GET → JSON（同期版の _get_json と同じ扱い）。"""
+    if quota is not None and not await quota.acquire_async(endpoint):
+        metrics.count(f"quota.{endpoint}.denied")
+        raise QuotaExceeded(f"{endpoint}: レート上限のため呼び出しを見送りました")
+    with metrics.span(span_name):
+        resp = await http_get_async(url, params=params)
+        if resp.status_code == 429 and quota is not None:
+            quota.record_over_limit(endpoint)
+            raise QuotaExceeded(f"{endpoint}: 429 Too Many Requests")
+        resp.raise_for_status()
+        return resp.json()
+
+
+class AsyncGooglePlacesClient:
+    """
+    GooglePlacesClient の非同期版。
+    同期版のインスタンスを包み、キャッシュ・駅名表・空間インデックス・レート制限・
+    リクエストの組み立てと結果の解釈はそちらと共有する（HTTP だけ非同期にする）。
+    """
+
+    def __init__(self, client: GooglePlacesClient):
+        self.sync = client
+
+    async def _get_json(self, endpoint: str, url: str, params: dict) -> dict:
+        data = await _get_json(self.sync.quota, endpoint, f"google.{endpoint}", url, params)
+        self.sync._check_payload(endpoint, data)
+        return data
+
+    async def geocode_station(self, station_name: str) -> Tuple[float, float]:
+        c = self.sync
+        if c.gazetteer is not None:
+            coords = c.gazetteer.lookup(station_name)
+            if coords is not None:
+                metrics.count("gazetteer.hit")
+                return coords
+            metrics.count("gazetteer.miss")
+
+        data = await self._get_json("geocode", c.GEOCODE_URL, c._geocode_params(station_name))
+        lat, lng = c._parse_geocode(data, station_name)
+        if c.gazetteer is not None:
+            c.gazetteer.add(station_name, lat, lng)
+        return lat, lng
+
+    async def iter_nearby_pages(self, center_lat: float, center_lng: float, place_type: str,
+                                radius: int = 3000, max_pages: int = 3, max_results: int = 60,
+                                time_budget_sec: float = 6.0, keyword: Optional[str] = None,
+                                status: Optional[dict] = None, rankby: Optional[str] = None) -> AsyncIterator[List[Spot]]:
+        """同期版 iter_nearby_pages と同じ（トークン待ちは asyncio.sleep）。"""
+        c = self.sync
+        started = time.monotonic()
+        data = await self._get_json(
+            "nearby", c.PLACES_NEARBY_URL, c._nearby_params(center_lat, center_lng, place_type, radius, keyword, rankby)
+        )
+        total = 0
+        pages = max(1, min(max_pages, c.NEARBY_MAX_PAGES))
+
+        for page_no in range(pages):
+            results = c._spots_from_nearby_results(data.get("results", []), place_type)
+            page = results[:max_results - total]
+            total += len(page)
+            not_before = time.monotonic() + c.NEXT_PAGE_DELAY_SEC
+            token = data.get("next_page_token")
+            if status is not None and not token and len(page) == len(results):
+                status["complete"] = True
+            yield page
+
+            if not token or total >= max_results or page_no + 1 >= pages:
+                return
+
+            data = None
+            while data is None:
+                wait = not_before - time.monotonic()
+                if time.monotonic() + max(wait, 0) - started > time_budget_sec:
+                    return
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    page_data = await self._get_json(
+                        "nearby", c.PLACES_NEARBY_URL, {"key": c.api_key, "pagetoken": token}
+                    )
+                except QuotaExceeded as e:
+                    print("QUOTA:", e)
+                    return
+                if page_data.get("status") == "INVALID_REQUEST":
+                    not_before = time.monotonic() + c.NEXT_PAGE_RETRY_SEC
+                    continue
+                data = page_data
+
+    async def iter_nearby_pages_multi(self, center_lat: float, center_lng: float,
+                                      queries: Sequence[Tuple[str, Optional[str]]],
+                                      radius: int = 3000, max_pages: int = 1, max_results: int = 60,
+                                      time_budget_sec: float = 6.0) -> AsyncIterator[List[Spot]]:
+        """同期版 iter_nearby_pages_multi と同じ重複除去・件数の上限で、クエリごとのタスクを並行に回す。"""
+        c = self.sync
+        pages: asyncio.Queue = asyncio.Queue()   # (クエリ番号, ページ)。ページが None ならそのクエリは終わり
+        errors: List[Exception] = []
+
+        async def produce(i: int, place_type: str, keyword: Optional[str]) -> None:
+            tag = f"{place_type}|{keyword or ''}"
+            try:
+                if c.spot_index is not None:
+                    known = c.spot_index.query(tag, center_lat, center_lng, radius)
+                    if known is not None:
+                        metrics.count("spot_index.hit")
+                        pages.put_nowait((i, known[:max_results]))
+                        return
+
+                fetched: List[Spot] = []
+                status = {}
+                async for page in self.iter_nearby_pages(center_lat, center_lng, place_type, radius=radius,
+                                                         max_pages=max_pages, max_results=max_results,
+                                                         time_budget_sec=time_budget_sec, keyword=keyword,
+                                                         status=status):
+                    fetched.extend(page)
+                    pages.put_nowait((i, page))
+
+                if c.spot_index is not None:
+                    c.spot_index.add(tag, fetched, center_lat, center_lng, radius,
+                                     complete=status.get("complete", False))
+            except Exception as e:
+                print("NEARBY_ERROR:", place_type, keyword, e)
+                errors.append(e)
+            finally:
+                pages.put_nowait((i, None))
+
+        tasks = [asyncio.create_task(produce(i, t, k)) for i, (t, k) in enumerate(queries)]
+        try:
+            seen = set()
+            found = 0
+            active = len(queries)
+            while active and found < max_results:
+                _, page = await pages.get()
+                if page is None:
+                    active -= 1
+                    continue
+                fresh = []
+                for spot in page:
+                    key = spot_identity(spot)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    fresh.append(spot)
+                fresh = fresh[:max_results - found]
+                found += len(fresh)
+                if fresh:
+                    yield fresh
+
+            if queries and len(errors) == len(queries):
+                raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def find_place_id(self, name: str, lat: float, lng: float) -> Optional[str]:
+        c = self.sync
+        cache_key = c._place_id_cache_key(name, lat, lng)
+        if c.place_id_cache is not None:
+            cached = c.place_id_cache.get(cache_key)
+            if cached is not MISSING:
+                metrics.count("cache.place_id.hit")
+                return cached
+            metrics.count("cache.place_id.miss")
+
+        try:
+            data = await self._get_json("find_place", c.FIND_PLACE_URL, c._find_place_params(name, lat, lng))
+        except QuotaExceeded as e:
+            print("QUOTA:", e)
+            return None
+        place_id = c._parse_find_place(data)
+        if c.place_id_cache is not None:
+            c.place_id_cache.set(cache_key, place_id)
+        return place_id
+
+    async def get_place_details(self, place_id: str, fields: Optional[str] = None) -> dict:
+        c = self.sync
+        fields = fields or c.DETAILS_FIELDS
+        cached = c.cached_place_details(place_id, fields)
+        if cached is not None:
+            metrics.count("cache.details.hit")
+            return cached
+        if c.details_cache is not None:
+            metrics.count("cache.details.miss")
+
+        try:
+            data = await self._get_json("details", c.DETAILS_URL, c._details_params(place_id, fields))
+        except QuotaExceeded as e:
+            print("QUOTA:", e)
+            return {}
+        details = data.get("result", {})
+        if details and c.details_cache is not None:
+            c.details_cache.set(c._details_cache_key(place_id, fields), details)
+        return details
+
+    def cached_place_details(self, place_id: str, fields: Optional[str] = None) -> Optional[dict]:
+        return self.sync.cached_place_details(place_id, fields)
+
+    def get_photo_url(self, photo_ref: str, max_width: int = 800) -> str:
+        return self.sync.get_photo_url(photo_ref, max_width)
+
+
+class AsyncHotpepperClient:
+    """HotpepperClient の非同期版（設定・リクエストの組み立て・結果の解釈は同期版と共有）。"""
+
+    def __init__(self, client: HotpepperClient):
+        self.sync = client
+
+    async def search_restaurants(
+        self,
+        station_keyword: str,
+        user_genre_keyword: str,
+        count: int = 20,
+        lat: Optional[float] = None,
+        lng: Optional[float] = None,
+        range_code: int = 4,
+        start: int = 1,
+    ) -> List[Spot]:
+        c = self.sync
+        params = c._search_params(station_keyword, user_genre_keyword, count, lat, lng, range_code, start)
+        data = await _get_json(c.quota, "hotpepper", "hotpepper.gourmet", c.BASE_URL, params)
+        return c._parse_shops(data)
+
+    async def search_pool(
+        self,
+        station_keyword: str,
+        user_genre_keyword: str,
+        max_results: int = MAX_COUNT_PER_PAGE,
+        lat: Optional[float] = None,
+        lng: Optional[float] = None,
+        range_code: int = 4,
+    ) -> List[Spot]:
+        c = self.sync
+        spots: List[Spot] = []
+        while len(spots) < max_results:
+            count = min(MAX_COUNT_PER_PAGE, max_results - len(spots))
+            params = c._search_params(station_keyword, user_genre_keyword, count, lat, lng,
+                                      range_code, start=len(spots) + 1)
+            data = await _get_json(c.quota, "hotpepper", "hotpepper.gourmet", c.BASE_URL, params)
+            page, available = c._parse_page(data)
+            spots.extend(page)
+            if not page or len(spots) >= available:
+                break
+        return spots
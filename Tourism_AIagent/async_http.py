@@ -0,0 +1,94 @@
+# async_http.py
+import asyncio
+import os
+import weakref
+from typing import Optional
+
+try:
+    import httpx
+except ImportError:  # 非同期版（asgi.py）を使わないなら不要
+    httpx = None
+
+from http_session import DEFAULT_TIMEOUT, RETRY_TOTAL, RETRY_BACKOFF, RETRY_STATUSES
+
+# ---- 非同期版の通信設定（タイムアウトとリトライは http_session と同じ値を使う）----
+
+# 同時接続数の上限（スレッドを使わないので、同期版よりずっと大きくできる）
+ASYNC_POOL_MAXSIZE = int(os.getenv("ASYNC_HTTP_POOL_MAXSIZE", "200"))
+ASYNC_KEEPALIVE = int(os.getenv("ASYNC_HTTP_KEEPALIVE", "50"))
+
+# イベントループごとにクライアントを1つ持つ（httpx.AsyncClient はループをまたげない）
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def available() -> bool:
+    return httpx is not None
+
+
+def _build_client() -> "httpx.AsyncClient":
+    connect, read = DEFAULT_TIMEOUT
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read, connect=connect),
+        limits=httpx.Limits(max_connections=ASYNC_POOL_MAXSIZE, max_keepalive_connections=ASYNC_KEEPALIVE),
+        # プロキシ無効（環境変数の HTTP(S)_PROXY を見ない）
+        trust_env=False,
+    )
+
+
+def get_async_client() -> "httpx.AsyncClient":
+    """
+    いまのイベントループで共有する keep-alive 付きのクライアントを返す。
+    """
+    if httpx is None:
+        raise RuntimeError("非同期版を使うには httpx をインストールしてください（pip install httpx）。")
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = _build_client()
+    return client
+
+
+async def aclose_async_client() -> None:
+    """アプリ終了時に呼ぶ（接続を閉じる）。"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def http_get_async(url: str, params: Optional[dict] = None, timeout=None,
+                         follow_redirects: bool = False, stream: bool = False) -> "httpx.Response":
+    """
+    http_get の非同期版。5xx と接続エラーは http_session と同じ回数・間隔で再試行する（429 は再試行しない）。
+    stream=True のときは本文を読まずに返す（呼び出し側で aiter_bytes / aclose する）。
+    """
+    client = get_async_client()
+    if timeout is None:
+        timeout = httpx.USE_CLIENT_DEFAULT
+    elif not isinstance(timeout, httpx.Timeout):
+        timeout = httpx.Timeout(timeout)
+
+    attempt = 0
+    while True:
+        try:
+            request = client.build_request("GET", url, params=params, timeout=timeout)
+            resp = await client.send(request, stream=stream, follow_redirects=follow_redirects)
+        except httpx.TransportError:
+            if attempt >= RETRY_TOTAL:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= RETRY_TOTAL:
+                return resp
+            await resp.aclose()
+        await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+        attempt += 1
+
+
+async def http_post_json_async(url: str, payload, headers: Optional[dict] = None,
+                               timeout=None) -> "httpx.Response":
+    """http_post_json の非同期版（再試行はしない）。"""
+    client = get_async_client()
+    if timeout is None:
+        timeout = httpx.USE_CLIENT_DEFAULT
+    elif not isinstance(timeout, httpx.Timeout):
+        timeout = httpx.Timeout(timeout)
+    return await client.post(url, json=payload, headers=headers, timeout=timeout)
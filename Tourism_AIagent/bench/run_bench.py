@@ -0,0 +1,220 @@
+# run_bench.py
+"""
+代役サーバー（stub_server.py）を相手に、アプリの /recommend と /photo を負荷をかけて計測する。
+本物の API は呼ばない（料金もかからない）。
+
+    python bench/run_bench.py
+    python bench/run_bench.py --scenario recommend_place_cold photo_cold --requests 100 --concurrency 16
+    python bench/run_bench.py --latency nearby=300,details=150 --json bench_result.json
+
+シナリオごとに p50 / p95 / p99 レイテンシ、スループット、上流 API の呼び出し回数を出す。
+- *_warm：同じ条件を繰り返す（キャッシュが効いた状態。最初の1回は計測しない）
+- *_cold：毎回ちがう駅・写真（キャッシュの効かない初回検索）
+アプリの出力（リクエストごとのログなど）は --app-log のファイルへ逃がす。
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+from stub_server import StubServer, StubState, parse_latency
+
+# (メソッド, パス, test_client に渡す引数)
+RequestSpec = Tuple[str, str, dict]
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    make_request: Callable[[int], RequestSpec]   # i 番目のリクエスト
+    warmup: int = 0                              # 計測前に流す回数（warm 用）
+
+
+def _recommend(category: str, genre: str, station: str) -> RequestSpec:
+    form = {
+        "category": category,
+        "genre": genre,
+        "priority": "balance",
+        "station": station,
+        "search_mode": "station",
+        "radius": "1000",
+    }
+    return "POST", "/recommend", {"data": form}
+
+
+def _photo(photo_url: str) -> RequestSpec:
+    return "GET", "/photo", {
+        "query_string": {"url": photo_url, "w": 480, "dpr": 1},
+        "headers": {"Accept": "image/avif,image/webp,image/*"},
+    }
+
+
+def build_scenarios(stub_url: str, api_key: str) -> Dict[str, Scenario]:
+    def photo_url(ref: str) -> str:
+        return f"{stub_url}/maps/api/place/photo?maxwidth=800&photo_reference={ref}&key={api_key}"
+
+    scenarios = [
+        Scenario("recommend_place_warm", "観光・同じ駅とジャンルを繰り返す",
+                 lambda i: _recommend("place", "nature", "名古屋駅"), warmup=1),
+        Scenario("recommend_place_cold", "観光・毎回ちがう駅（Geocoding と Nearby Search が毎回走る）",
+                 lambda i: _recommend("place", "nature", f"ベンチ{i}駅")),
+        Scenario("recommend_restaurant_warm", "飲食・同じ駅とジャンルを繰り返す",
+                 lambda i: _recommend("restaurant", "ramen", "名古屋駅"), warmup=1),
+        Scenario("recommend_restaurant_cold", "飲食・毎回ちがう駅（FindPlace と Details が店ごとに走る）",
+                 lambda i: _recommend("restaurant", "ramen", f"ベンチ{i}駅")),
+        Scenario("photo_warm", "同じ写真を繰り返す（ディスクキャッシュから返す）",
+                 lambda i: _photo(photo_url("bench_warm")), warmup=1),
+        Scenario("photo_cold", "毎回ちがう写真（取得・縮小・変換が毎回走る）",
+                 lambda i: _photo(photo_url(f"bench_cold_{time.time_ns()}_{i}"))),
+    ]
+    return {s.name: s for s in scenarios}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近傍順位法のパーセンタイル（sorted_values は昇順）。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_scenario(flask_app, stub: StubServer, scenario: Scenario, requests_n: int, concurrency: int) -> dict:
+    def send(i: int) -> Tuple[float, int]:
+        method, path, kwargs = scenario.make_request(i)
+        with flask_app.test_client() as client:
+            started = time.perf_counter()
+            resp = client.open(path, method=method, **kwargs)
+            resp.get_data()   # ストリーミングの応答も最後まで読む
+            elapsed = time.perf_counter() - started
+            resp.close()
+        return elapsed, resp.status_code
+
+    for i in range(scenario.warmup):
+        send(-1 - i)
+
+    stub.state.reset_counts()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+        results = list(pool.map(send, range(requests_n)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    errors = sum(1 for _, status in results if status != 200)
+    upstream = stub.state.counts()
+    return {
+        "scenario": scenario.name,
+        "requests": requests_n,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        "throughput_rps": round(requests_n / wall, 2) if wall > 0 else 0.0,
+        "upstream_calls": upstream,
+        "upstream_calls_per_request": round(sum(upstream.values()) / requests_n, 2) if requests_n else 0.0,
+    }
+
+
+def print_report(results: List[dict]) -> None:
+    header = f"{'scenario':<28}{'n':>5}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'up/req':>8}  upstream"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        upstream = " ".join(f"{k}={v}" for k, v in sorted(r["upstream_calls"].items())) or "-"
+        print(
+            f"{r['scenario']:<28}{r['requests']:>5}{r['errors']:>5}"
+            f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+            f"{r['throughput_rps']:>9.2f}{r['upstream_calls_per_request']:>8.2f}  {upstream}"
+        )
+    print("(latency in ms)")
+
+
+def setup_app(stub: StubServer, workdir: str, keep_quota: bool, reasoner: bool = False):
+    """代役サーバーに向けた設定で app を読み込む（app は読み込み時に設定を読むので、その前に環境変数を作る）。"""
+    stations_file = os.path.join(workdir, "stations.csv")
+    shutil.copyfile(os.path.join(APP_DIR, "data", "stations.csv"), stations_file)
+    os.environ.update({
+        "GOOGLE_API_KEY": "bench",
+        "HOTPEPPER_API_KEY": "bench",
+        "GOOGLE_API_BASE_URL": stub.url,
+        "HOTPEPPER_API_BASE_URL": stub.hotpepper_url,
+        "STATIONS_FILE": stations_file,
+        "PHOTO_CACHE_DIR": os.path.join(workdir, "photo_cache"),
+        "PLACES_CACHE_DB": "",
+        "RATE_LIMIT_DB": "",
+        "PROGRESSIVE_RESULTS": "0",
+        # 理由文を代役の LLM に頼むか（頼まなければルールベース）
+        "REASONER_BACKEND": "http" if reasoner else "rule",
+        "REASONER_URL": stub.llm_url if reasoner else "",
+    })
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    import app
+    from rate_limiter import EndpointLimit
+
+    if not keep_quota:
+        # 計測の邪魔にならないよう上限だけ外す（呼び出し数・料金の集計はそのまま）
+        app.api_quota.limits = {
+            name: EndpointLimit(rate_per_sec=1e9, burst=1e9, cost_per_1000=limit.cost_per_1000)
+            for name, limit in app.api_quota.limits.items()
+        }
+    return app
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="代役 API サーバーを使ったベンチマーク")
+    parser.add_argument("--scenario", nargs="*", help="実行するシナリオ（省略時は全部）")
+    parser.add_argument("--requests", type=int, default=40, help="シナリオごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に投げるリクエスト数")
+    parser.add_argument("--latency", default="", help="上流の遅延(ms) 例: nearby=150,details=80")
+    parser.add_argument("--jitter", type=float, default=0.2, help="遅延のゆらぎ（±割合）")
+    parser.add_argument("--keep-quota", action="store_true", help="アプリのレート制限を本番と同じ値のままにする")
+    parser.add_argument("--reasoner", action="store_true", help="理由文を代役の LLM（/llm/reasons）に頼む")
+    parser.add_argument("--json", help="結果を JSON で書き出すファイル")
+    parser.add_argument("--app-log", default=os.devnull, help="アプリの標準出力の書き出し先")
+    args = parser.parse_args(argv)
+
+    stub = StubServer(state=StubState(latency_ms=parse_latency(args.latency), jitter=args.jitter)).start()
+    workdir = tempfile.mkdtemp(prefix="tourism-bench-")
+    try:
+        with open(args.app_log, "a", encoding="utf-8") as app_log:
+            with redirect_stdout(app_log):
+                app = setup_app(stub, workdir, args.keep_quota, reasoner=args.reasoner)
+            scenarios = build_scenarios(stub.url, app.GOOGLE_API_KEY)
+            names = args.scenario or list(scenarios)
+            unknown = [n for n in names if n not in scenarios]
+            if unknown:
+                parser.error(f"unknown scenario: {', '.join(unknown)} (choices: {', '.join(scenarios)})")
+
+            print(f"stub server: {stub.url}  latency(ms): {json.dumps(stub.state.latency_ms)}")
+            results = []
+            for name in names:
+                print(f"running {name}: {scenarios[name].description}", flush=True)
+                with redirect_stdout(app_log):
+                    results.append(run_scenario(app.app, stub, scenarios[name], args.requests, args.concurrency))
+    finally:
+        stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"latency_ms": stub.state.latency_ms, "results": results}, f, ensure_ascii=False, indent=2)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
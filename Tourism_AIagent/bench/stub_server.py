@@ -0,0 +1,422 @@
+# stub_server.py
+"""
+Google Places / Geocoding / Hotpepper の代役 HTTP サーバー（ベンチマーク用）。
+
+recordings/ の記録済みレスポンスを元に返す。
+- 検索位置や店名に合わせて座標・place_id をずらすので、条件が違えば別の結果になる
+  （キャッシュの効かない「初回検索」も再現できる）
+- エンドポイントごとに遅延を入れられる
+- エンドポイントごとの呼び出し回数を数える
+- 理由文の LLM の代役（POST /llm/reasons）もある
+
+
+    python bench/stub_server.py --port 8765 --latency nearby=150,details=80
+
+アプリ側は GOOGLE_API_BASE_URL / HOTPEPPER_API_BASE_URL をこのサーバーに向ける：
+    GOOGLE_API_BASE_URL=http://127.0.0.1:8765
+    HOTPEPPER_API_BASE_URL=http://127.0.0.1:8765/hotpepper/gourmet/v1/
+    REASONER_BACKEND=http REASONER_URL=http://127.0.0.1:8765/llm/reasons
+"""
+import argparse
+import base64
+import copy
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+# 遅延の既定値（ミリ秒）。実測のおおよその中央値
+DEFAULT_LATENCY_MS = {
+    "geocode": 80,
+    "nearby": 150,
+    "find_place": 90,
+    "details": 80,
+    "photo": 60,
+    "hotpepper": 120,
+    "llm": 400,
+}
+
+# 1x1 の透明 GIF（写真の記録が無いときに返す）
+PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+NEARBY_PAGES = 3
+
+# rankby=distance の Nearby Search（店の突き合わせ用）で返す件数と、
+# Hotpepper の店1軒のまわりに置く「Hotpepper に載っていない Google 上の飲食店」の数
+NEARBY_RANKBY_LIMIT = 20
+OTHER_RESTAURANTS_PER_SHOP = 3
+
+
+def _digest(*parts) -> str:
+    return hashlib.md5("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def _offset(seed: str, spread: float) -> Tuple[float, float]:
+    """文字列から決まる ±spread 度のずれ（同じ入力なら毎回同じ）。"""
+    h = int(_digest(seed)[:8], 16)
+    return ((h & 0xFFFF) / 0xFFFF * 2 - 1) * spread, ((h >> 16) / 0xFFFF * 2 - 1) * spread
+
+
+def parse_latency(text: str) -> Dict[str, float]:
+    """'nearby=150,details=80' → {'nearby': 150.0, 'details': 80.0}"""
+    latency = {}
+    for item in filter(None, (t.strip() for t in (text or "").split(","))):
+        name, _, value = item.partition("=")
+        if name not in DEFAULT_LATENCY_MS:
+            raise ValueError(f"unknown endpoint: {name}")
+        latency[name] = float(value)
+    return latency
+
+
+class StubState:
+    """記録済みレスポンス・遅延設定・呼び出し回数（全スレッド共通）。"""
+
+    def __init__(self, recordings_dir: str = RECORDINGS_DIR,
+                 latency_ms: Optional[Dict[str, float]] = None, jitter: float = 0.2):
+        self.recordings = {}
+        for name in ("geocode", "nearbysearch", "findplacefromtext", "details", "hotpepper_gourmet"):
+            with open(os.path.join(recordings_dir, f"{name}.json"), encoding="utf-8") as f:
+                self.recordings[name] = json.load(f)
+        photo_path = os.path.join(recordings_dir, "photo.jpg")
+        if os.path.exists(photo_path):
+            with open(photo_path, "rb") as f:
+                self.photo = (f.read(), "image/jpeg")
+        else:
+            self.photo = (PIXEL_GIF, "image/gif")
+
+        self.latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.jitter = jitter
+        self.llm_skip = 0
+        # Hotpepper の代役が返した店（id → (店, 緯度, 経度, 記録での番号)）。rankby=distance の検索はここから近い順に返す
+        self._shops: Dict[str, tuple] = {}
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, endpoint: str) -> None:
+        with self._lock:
+            self._counts[endpoint] += 1
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def delay(self, endpoint: str) -> None:
+        ms = self.latency_ms.get(endpoint, 0)
+        if ms > 0:
+            time.sleep(ms / 1000 * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    # ---- 各エンドポイント ----
+
+    def llm(self, body: dict) -> dict:
+        """理由文の代役。スポットの情報から決まった文を返す（llm_skip 件に1件は返さない＝締め切り遅れの代わり）"""
+        results = []
+        for item in body.get("spots", []):
+            if self.llm_skip and int(_digest(item["id"], item.get("name"))[:4], 16) % self.llm_skip == 0:
+                continue
+            scores = "・".join(f"{k}={v}" for k, v in sorted(item.get("scores", {}).items()) if k.endswith("_score"))
+            results.append({
+                "id": item["id"],
+                "reason": f"[LLM] {item.get('name')}（{item.get('genre')}）。{scores}",
+                "stay_time_minutes": 45 if item.get("spot_type") == "restaurant" else 75,
+            })
+        return {"model": body.get("model", "stub"), "results": results}
+
+    def geocode(self, q: dict) -> dict:
+        rec = self.recordings["geocode"]
+        data = copy.deepcopy(rec["response"])
+        address = q.get("address", "")
+        if address != rec["request"]["address"]:
+            loc = data["results"][0]["geometry"]["location"]
+            dlat, dlng = _offset(address, 0.05)
+            loc["lat"] += dlat
+            loc["lng"] += dlng
+            data["results"][0]["place_id"] = "bench_geo_" + _digest(address)[:16]
+        return data
+
+    def nearby(self, q: dict) -> dict:
+        rec = self.recordings["nearbysearch"]
+        if "pagetoken" in q:
+            location, place_type, keyword, page = json.loads(base64.urlsafe_b64decode(q["pagetoken"]))
+        else:
+            location, place_type, keyword, page = q.get("location", ""), q.get("type", ""), q.get("keyword", ""), 0
+
+        lat, lng = (float(v) for v in location.split(","))
+        if place_type == "restaurant" and q.get("rankby") == "distance":
+            return self._nearby_restaurants_by_distance(lat, lng)
+        if place_type == "restaurant":
+            return self._nearby_restaurants(lat, lng, location, page)
+        c_lat, c_lng = (float(v) for v in rec["request"]["location"].split(","))
+        tag = _digest(location, place_type, keyword, page)[:8]
+
+        data = copy.deepcopy(rec["response"])
+        for r in data["results"]:
+            loc = r["geometry"]["location"]
+            # 記録時の中心からの相対位置を保ったまま、今回の検索位置へ移す（ページごとに少しずらす）
+            loc["lat"] = lat + (loc["lat"] - c_lat) + page * 0.002
+            loc["lng"] = lng + (loc["lng"] - c_lng) - page * 0.002
+            r["place_id"] = f"{r['place_id']}_{tag}"
+            if place_type:
+                r["types"] = [place_type] + [t for t in r["types"] if t != place_type]
+            for photo in r.get("photos", []):
+                photo["photo_reference"] = f"{photo['photo_reference']}_{tag}"
+
+        if page + 1 < NEARBY_PAGES:
+            token = [location, place_type, keyword, page + 1]
+            data["next_page_token"] = base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+        else:
+            data.pop("next_page_token", None)
+        return data
+
+    def _nearby_restaurants(self, lat: float, lng: float, location: str, page: int) -> dict:
+        """
+        type=restaurant：Hotpepper の記録と同じ店を Google 側の表記で返す（店の突き合わせ用）。
+        Hotpepper の代役と同じ位置関係で並べ、表記ゆれ・座標のずれを入れ、4店に1店は載せない。
+        """
+        shops = self.recordings["hotpepper_gourmet"]["response"]["results"]["shop"]
+        c_lat = sum(s["lat"] for s in shops) / len(shops)
+        c_lng = sum(s["lng"] for s in shops) / len(shops)
+        results = []
+        for i, shop in enumerate(shops):
+            if i % 4 == 3 or page > 0:
+                continue
+            dlat, dlng = _offset(shop["id"], 0.0003)
+            name = shop["name"].replace(" ", "") if i % 2 else shop["name"]
+            results.append({
+                "name": name,
+                "place_id": "bench_nb_" + _digest(shop["id"], location)[:16],
+                "vicinity": shop.get("address", ""),
+                "geometry": {"location": {"lat": lat + (shop["lat"] - c_lat) + dlat,
+                                          "lng": lng + (shop["lng"] - c_lng) + dlng}},
+                "types": ["restaurant", "food", "point_of_interest", "establishment"],
+                "rating": round(3.0 + (i % 20) / 10, 1),
+                "user_ratings_total": 10 * i,
+                # 写真が付くのは半分だけ（残りは Place Details で取る）
+                "photos": [{"photo_reference": f"bench_nb_photo_{shop['id']}"}] if i % 2 == 0 else [],
+            })
+        return {"status": "OK", "results": results}
+
+    def _nearby_restaurants_by_distance(self, lat: float, lng: float) -> dict:
+        """
+        type=restaurant&rankby=distance：これまでに Hotpepper の代役が返した店と、そのまわりの
+        Hotpepper に無い飲食店のうち、近い順に NEARBY_RANKBY_LIMIT 件（本物と同じく1ページだけ）。
+        表記ゆれ・座標のずれを入れ、4店に1店は Google に載っていないことにする。
+        """
+        with self._lock:
+            shops = list(self._shops.items())
+        places = []
+        for shop_id, (shop, s_lat, s_lng, i) in shops:
+            if i % 4 != 3:
+                dlat, dlng = _offset(shop_id, 0.0003)
+                name = shop["name"].replace(" ", "") if i % 2 else shop["name"]
+                places.append((name, "bench_nb_" + _digest(shop_id)[:16], s_lat + dlat, s_lng + dlng,
+                               shop.get("address", ""), i))
+            for k in range(OTHER_RESTAURANTS_PER_SHOP):
+                dlat, dlng = _offset(f"{shop_id}|other{k}", 0.0015)
+                places.append((f"食堂 {_digest(shop_id, k)[:6]}", "bench_other_" + _digest(shop_id, k)[:16],
+                               s_lat + dlat, s_lng + dlng, "", i + k))
+
+        def dist(place) -> float:
+            dy = place[2] - lat
+            dx = (place[3] - lng) * math.cos(math.radians(lat))
+            return dx * dx + dy * dy
+
+        places.sort(key=dist)
+        results = []
+        for name, place_id, p_lat, p_lng, address, i in places[:NEARBY_RANKBY_LIMIT]:
+            results.append({
+                "name": name,
+                "place_id": place_id,
+                "vicinity": address,
+                "geometry": {"location": {"lat": p_lat, "lng": p_lng}},
+                "types": ["restaurant", "food", "point_of_interest", "establishment"],
+                "rating": round(3.0 + (i % 20) / 10, 1),
+                "user_ratings_total": 10 * i,
+                "photos": [{"photo_reference": f"bench_nb_photo_{place_id}"}] if i % 2 == 0 else [],
+            })
+        return {"status": "OK" if results else "ZERO_RESULTS", "results": results}
+
+    def find_place(self, q: dict) -> dict:
+        data = copy.deepcopy(self.recordings["findplacefromtext"]["response"])
+        data["candidates"] = [{"place_id": "bench_" + _digest(q.get("input", ""), q.get("locationbias", ""))[:16]}]
+        return data
+
+    def details(self, q: dict) -> dict:
+        data = copy.deepcopy(self.recordings["details"]["response"])
+        place_id = q.get("place_id", "")
+        h = int(_digest(place_id)[:8], 16)
+        result = data["result"]
+        dlat, dlng = _offset(place_id, 0.01)
+        result["place_id"] = place_id
+        result["name"] = f"{result['name']} #{h % 1000}"
+        result["rating"] = round(3.0 + (h % 20) / 10, 1)
+        result["user_ratings_total"] = h % 2000
+        result["geometry"]["location"]["lat"] += dlat
+        result["geometry"]["location"]["lng"] += dlng
+        for photo in result.get("photos", []):
+            photo["photo_reference"] = f"{photo['photo_reference']}_{place_id}"
+        return data
+
+    def hotpepper(self, q: dict) -> dict:
+        rec = self.recordings["hotpepper_gourmet"]
+        data = copy.deepcopy(rec["response"])
+        shops = data["results"]["shop"]
+        c_lat = sum(s["lat"] for s in shops) / len(shops)
+        c_lng = sum(s["lng"] for s in shops) / len(shops)
+        if q.get("lat") and q.get("lng"):
+            lat, lng = float(q["lat"]), float(q["lng"])
+        else:
+            dlat, dlng = _offset(q.get("keyword", ""), 0.05)
+            if q.get("keyword", "") == rec["request"]["keyword"]:
+                dlat = dlng = 0.0
+            lat, lng = c_lat + dlat, c_lng + dlng
+
+        # ページ送り（start は1始まり）。該当件数は記録にある店の数にそろえる
+        start = max(1, int(q.get("start") or 1))
+        count = int(q.get("count") or len(shops))
+        data["results"]["results_available"] = len(shops)
+        shops = shops[start - 1:start - 1 + count]
+        for s in shops:
+            s["lat"] = lat + (s["lat"] - c_lat)
+            s["lng"] = lng + (s["lng"] - c_lng)
+        with self._lock:
+            for i, s in enumerate(shops, start=start - 1):
+                self._shops[f"{s['id']}@{s['lat']:.5f},{s['lng']:.5f}"] = (s, s["lat"], s["lng"], i)
+        data["results"]["shop"] = shops
+        data["results"]["results_returned"] = str(len(shops))
+        data["results"]["results_start"] = start
+        return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive（アプリ側の接続プールをそのまま使わせる）
+    state: StubState = None
+
+    # パス → エンドポイント名（StubState の同名メソッドが応答を作る）
+    ROUTES = {
+        "/maps/api/geocode/json": "geocode",
+        "/maps/api/place/nearbysearch/json": "nearby",
+        "/maps/api/place/findplacefromtext/json": "find_place",
+        "/maps/api/place/details/json": "details",
+        "/hotpepper/gourmet/v1/": "hotpepper",
+    }
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+
+        if u.path == "/maps/api/place/photo":
+            self.state.hit("photo")
+            self.state.delay("photo")
+            body, content_type = self.state.photo
+            return self._send(200, body, content_type)
+
+        if u.path == "/_stub/stats":
+            return self._send_json(self.state.counts())
+
+        endpoint = self.ROUTES.get(u.path)
+        if endpoint is None:
+            return self._send(404, b"not found", "text/plain")
+        self.state.hit(endpoint)
+        self.state.delay(endpoint)
+        try:
+            data = getattr(self.state, endpoint)(q)
+        except Exception as e:
+            return self._send_json({"status": "INVALID_REQUEST", "error_message": str(e)}, status=400)
+        self._send_json(data)
+
+    def do_POST(self):
+        u = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if u.path != "/llm/reasons":
+            return self._send(404, b"not found", "text/plain")
+        self.state.hit("llm")
+        self.state.delay("llm")
+        try:
+            data = self.state.llm(json.loads(body or b"{}"))
+        except Exception as e:
+            return self._send_json({"error": str(e)}, status=400)
+        self._send_json(data)
+
+    def _send_json(self, data, status: int = 200):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=UTF-8")
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出さない（ベンチマークの出力が埋もれるため）
+        pass
+
+
+class StubServer:
+    """別スレッドで動く代役サーバー。url を GOOGLE_API_BASE_URL などに使う。"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, state: Optional[StubState] = None):
+        self.state = state or StubState()
+        handler = type("Handler", (_Handler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def hotpepper_url(self) -> str:
+        return self.url + "/hotpepper/gourmet/v1/"
+
+    @property
+    def llm_url(self) -> str:
+        return self.url + "/llm/reasons"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Google / Hotpepper API の代役サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="", help="エンドポイントごとの遅延(ms) 例: nearby=150,details=80")
+    parser.add_argument("--jitter", type=float, default=0.2, help="遅延のゆらぎ（±割合）")
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.host, args.port, StubState(latency_ms=parse_latency(args.latency), jitter=args.jitter))
+    print(f"stub server on {server.url} (hotpepper: {server.hotpepper_url})")
+    print("latency(ms):", json.dumps(server.state.latency_ms))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
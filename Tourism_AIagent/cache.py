@@ -0,0 +1,181 @@
+# cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Sequence
+
+# キャッシュに無いことを表す目印（None も「結果なし」として保存したいので別物にする）
+MISSING = object()
+
+
+class LocalConnection:
+    """
+    SQLite の接続をスレッドごとに、最初に使うときに開く。
+    import 時に開いた接続を fork 後の gunicorn ワーカーで共有しないよう、
+    PID が変わったら親の接続は使わずに開き直す。setup の SQL は開くたびに流す。
+    """
+
+    def __init__(self, path: str, setup: Sequence[str] = ()):
+        self.path = path
+        self.setup = tuple(setup)
+        self._pid = os.getpid()
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        if pid != self._pid:
+            # 親プロセスの接続（fork で写ってきたもの）は触らずに捨てる
+            self._pid = pid
+            self._local = threading.local()
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            for sql in self.setup:
+                conn.execute(sql)
+            local.conn = conn
+        return conn
+
+
+class SqliteBackend:
+    """
+    ディスク上の共有キャッシュ（SQLite）。
+    再起動後も残り、同じファイルを見る gunicorn ワーカー同士で共有できる。
+    接続はスレッドごと・プロセスごとに遅延して開く（LocalConnection）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = LocalConnection(path, (
+            "PRAGMA journal_mode=WAL",
+            "PRAGMA synchronous=NORMAL",
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)",
+        ))
+
+    def get(self, key: str, now: float):
+        """(値, 期限) を返す。無い・期限切れなら MISSING。"""
+        row = self._conn.get().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= now:
+            return MISSING
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        self._conn.get().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, data, expires_at),
+        )
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        cur = self._conn.get().execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        return cur.rowcount
+
+
+class TTLCache:
+    """
+    上限付き LRU ＋ TTL のメモリキャッシュ。
+    backend を渡すと、メモリに無いときはディスク側も見る（2段構成）。
+    fallback（snapshot.SnapshotTable など get(key, default) を持つ読み取り専用の表）を渡すと、
+    どちらにも無いときに最後に見る（デプロイ直後でも温かい状態から始める）。
+    値は JSON にできるもの（dict / list / str / None など）に限る。
+    clock は期限の判定に使う現在時刻（テストで差し替える用）。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_sec: float = 86400,
+                 backend: Optional[SqliteBackend] = None, name: str = "", fallback=None,
+                 clock: Callable[[], float] = time.time):
+        self.maxsize = maxsize
+        self.ttl_sec = ttl_sec
+        self.backend = backend
+        self.fallback = fallback
+        self.name = name
+        self.clock = clock
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.fallback_hits = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}" if self.name else key
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        now = self.clock()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+        if self.backend is not None:
+            found = self.backend.get(self._key(key), now)
+            if found is not MISSING:
+                value, expires_at = found
+                with self._lock:
+                    self._store(key, value, expires_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        if self.fallback is not None:
+            value = self.fallback.get(key, MISSING)
+            if value is not MISSING:
+                with self._lock:
+                    self._store(key, value, now + self.ttl_sec)
+                    self.hits += 1
+                    self.fallback_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = self.clock() + self.ttl_sec
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self.backend is not None:
+            self.backend.set(self._key(key), value, expires_at)
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "fallback_hits": self.fallback_hits,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
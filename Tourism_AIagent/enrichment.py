@@ -0,0 +1,437 @@
+# enrichment.py
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import time
+
+from google_client import GooglePlacesClient
+from matching import ShopMatch, ShopMatcher
+import metrics
+from spot import Spot
+
+
+def enrich_one(google_client: GooglePlacesClient, hp: Spot, match: Optional[ShopMatch] = None,
+               matcher: Optional[ShopMatcher] = None, fetch_details: bool = True) -> Optional[Spot]:
+    """
+    Hotpepper の1店舗 → Google place_id 検索 → 詳細取得 → Spot 化。
+    - match（突き合わせの結果）があれば place_id の検索は省く
+    - fetch_details=False なら詳細は取らず、キャッシュ済みの詳細か Nearby Search の要約で
+      採点できる形にする（写真などが足りなければ details_pending を立てて後で取る）
+    見つからなければ None。
+    """
+    place_id, summary = match or (None, None)
+
+    # ① Google place_id を検索
+    if not place_id:
+        # 一致率UP: 店名 + 住所で検索
+        query = f"{hp.name} {hp.address}".strip()
+        place_id = google_client.find_place_id(query, hp.lat, hp.lng)
+        if not place_id:
+            return None
+        if matcher is not None:
+            matcher.remember(hp, place_id)
+
+    # ② Google 詳細情報を取得
+    if fetch_details:
+        details = google_client.get_place_details(place_id)
+        if not details:
+            return None
+    else:
+        details = google_client.cached_place_details(place_id)
+
+    return _candidate(google_client, hp, place_id, summary, details)
+
+
+def _candidate(google_client, hp: Spot, place_id: str, summary: Optional[Spot], details: Optional[dict]) -> Spot:
+    # 採点用の内訳（予算・設備）は Hotpepper の店のものを引き継ぐ
+    spot = hp.clone()
+    spot.place_id = place_id
+    if details:
+        return apply_details(google_client, spot, details)
+    if summary is not None:
+        spot.merge_google(summary)
+    spot.details_pending = spot.image_url is None or spot.rating is None
+    return spot
+
+
+def apply_details(google_client, spot: Spot, details: dict) -> Spot:
+    """Place Details の内容で spot の表示用の項目を埋める（採点用の内訳は Hotpepper のまま）。"""
+    # ④ 表示は Google の情報を使う
+    spot.merge_google(Spot.from_google_details(details, details_photo_url(google_client, details)))
+    spot.details_pending = False
+    return spot
+
+
+def details_photo_url(google_client, details: dict) -> Optional[str]:
+    # ③ Google Photo の URL を取得（1枚目を採用）
+    photos = details.get("photos", [])
+    if photos:
+        photo_ref = photos[0].get("photo_reference")
+        if photo_ref:
+            return google_client.get_photo_url(photo_ref)
+    return None
+
+
+def details_fields(google_client, spot: Spot) -> str:
+    """spot に足りない分だけを取るフィールド指定（評価が分かっていれば評価は取らない）。"""
+    if spot.rating is not None:
+        return google_client.DETAILS_BASIC_FIELDS
+    return google_client.DETAILS_FIELDS
+
+
+def hydrate_details(google_client: GooglePlacesClient, spots: List[Spot], max_workers: int = 8,
+                    matcher: Optional[ShopMatcher] = None,
+                    origin: Optional[Tuple[float, float]] = None,
+                    deadline_sec: float = 5.0) -> None:
+    """
+    details_pending の Spot の詳細を並列に取って埋める（上位のカードだけに使う）。
+    取れなかったもの・deadline_sec に間に合わなかったものは details_pending のまま
+    （表示時に取りに来てもらう）。
+    place_id の無い Spot（Hotpepper だけで採点したもの）は写真だけを付ける（hydrate_photos）。
+    """
+    started = time.monotonic()
+    hydrate_photos(google_client, [s for s in spots if s.details_pending and not s.place_id],
+                   max_workers, matcher, origin, deadline_sec)
+    todo = [s for s in spots if s.details_pending and s.place_id]
+    if not todo:
+        return
+
+    def fetch(spot: Spot) -> dict:
+        return google_client.get_place_details(spot.place_id, details_fields(google_client, spot))
+
+    workers = max(1, min(max_workers, len(todo)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="details")
+    try:
+        task = metrics.bind(fetch)
+        futures = {pool.submit(task, spot): spot for spot in todo}
+        try:
+            remaining = max(0.0, deadline_sec - (time.monotonic() - started))
+            for fut in as_completed(futures, timeout=remaining):
+                spot = futures[fut]
+                try:
+                    details = fut.result()
+                except Exception as e:
+                    print("DETAILS_ERROR:", spot.name, e)
+                    metrics.count("enrich.error")
+                    continue
+                if details:
+                    apply_details(google_client, spot, details)
+        except FuturesTimeout:
+            for fut, spot in futures.items():
+                if not fut.done():
+                    print("DETAILS_TIMEOUT:", spot.name)
+                    metrics.count("enrich.timeout")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _photo_place(google_client, spot: Spot, match: Optional[ShopMatch],
+                 matcher: Optional[ShopMatcher]) -> Tuple[Optional[str], Optional[str]]:
+    """(place_id, 写真の URL)。Nearby Search の要約に写真があれば Place Details は呼ばない。"""
+    place_id, summary = match or (None, None)
+    if summary is not None and summary.image_url:
+        return place_id, summary.image_url
+    if not place_id:
+        query = f"{spot.name} {spot.address}".strip()
+        place_id = google_client.find_place_id(query, spot.lat, spot.lng)
+        if not place_id:
+            return None, None
+        if matcher is not None:
+            matcher.remember(spot, place_id)
+    details = google_client.get_place_details(place_id, google_client.DETAILS_PHOTO_FIELDS)
+    return place_id, details_photo_url(google_client, details) if details else None
+
+
+def _apply_photo(spot: Spot, place_id: Optional[str], image_url: Optional[str]) -> None:
+    # 店が見つからない・写真が無い店も、もう取りに行かない（表示は Hotpepper の内容のまま）
+    spot.place_id = place_id or spot.place_id
+    spot.image_url = image_url or spot.image_url
+    spot.details_pending = False
+
+
+def hydrate_photos(google_client: GooglePlacesClient, spots: List[Spot], max_workers: int = 8,
+                   matcher: Optional[ShopMatcher] = None,
+                   origin: Optional[Tuple[float, float]] = None,
+                   deadline_sec: float = 5.0) -> None:
+    """
+    Hotpepper の情報だけで採点・表示する Spot に Google の写真を付ける。
+    place_id は matcher（保存済みの対応 → Nearby Search 1回の突き合わせ）で決め、
+    決まらなかった店だけ FindPlace する。
+    失敗した店・deadline_sec に間に合わなかった店は details_pending のまま。
+    """
+    if not spots:
+        return
+    started = time.monotonic()
+    matched = {}
+    if matcher is not None:
+        with metrics.span("match"):
+            matched = matcher.resolve(google_client, spots, origin)
+
+    task = metrics.bind(_photo_place)
+    workers = max(1, min(max_workers, len(spots)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photos")
+    try:
+        futures = {pool.submit(task, google_client, spot, matched.get(i), matcher): spot
+                   for i, spot in enumerate(spots)}
+        try:
+            remaining = max(0.0, deadline_sec - (time.monotonic() - started))
+            for fut in as_completed(futures, timeout=remaining):
+                spot = futures[fut]
+                try:
+                    _apply_photo(spot, *fut.result())
+                except Exception as e:
+                    print("PHOTO_ERROR:", spot.name, e)
+                    metrics.count("enrich.error")
+        except FuturesTimeout:
+            for fut, spot in futures.items():
+                if not fut.done():
+                    print("PHOTO_TIMEOUT:", spot.name)
+                    metrics.count("enrich.timeout")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def enrich_hotpepper_spots(
+    google_client: GooglePlacesClient,
+    hp_spots: List[Spot],
+    max_workers: int = 8,
+    deadline_sec: float = 5.0,
+    on_result: Optional[Callable[[Spot], None]] = None,
+    matcher: Optional[ShopMatcher] = None,
+    origin: Optional[Tuple[float, float]] = None,
+    fetch_details: bool = True,
+) -> List[Spot]:
+    """
+    Hotpepper の候補店を Google 情報で並列に補完する。
+    - matcher を渡すと、まず Nearby Search 1回の突き合わせで place_id を決め、
+      決まらなかった店だけ FindPlace する（origin は突き合わせの検索中心）
+    - fetch_details=False なら Place Details は呼ばない（enrich_one を参照）
+    - 同時実行数は max_workers で制限
+    - deadline_sec を過ぎても終わらない店は諦める
+    - 失敗した店はスキップし、残りは Hotpepper の並び順のまま返す
+    - on_result を渡すと、1店補完できるたびに（呼び出し元のスレッドで）呼ぶ
+    """
+    if not hp_spots:
+        return []
+
+    started = time.monotonic()
+    matched = {}
+    if matcher is not None:
+        with metrics.span("match"):
+            matched = matcher.resolve(google_client, hp_spots, origin)
+
+    workers = max(1, min(max_workers, len(hp_spots)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich")
+    try:
+        # ワーカー側の span も呼び出し元のリクエストの Trace に入れる
+        task = metrics.bind(enrich_one)
+        futures = [
+            pool.submit(task, google_client, hp, matched.get(i), matcher, fetch_details)
+            for i, hp in enumerate(hp_spots)
+        ]
+        names = {fut: hp.name for hp, fut in zip(hp_spots, futures)}
+        enriched = {}
+
+        try:
+            remaining = max(0.0, deadline_sec - (time.monotonic() - started))
+            for fut in as_completed(futures, timeout=remaining):
+                try:
+                    spot = fut.result()
+                except Exception as e:
+                    print("ENRICH_ERROR:", names[fut], e)
+                    metrics.count("enrich.error")
+                    continue
+                if spot is None:
+                    continue
+                enriched[fut] = spot
+                if on_result is not None:
+                    on_result(spot)
+        except FuturesTimeout:
+            for fut in futures:
+                if not fut.done():
+                    print("ENRICH_TIMEOUT:", names[fut])
+                    metrics.count("enrich.timeout")
+
+        return [enriched[fut] for fut in futures if fut in enriched]
+    finally:
+        # 締め切りを過ぎたタスクは待たずに捨てる（未開始のものはキャンセル）
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def enrich_one_async(google_client, hp: Spot, match: Optional[ShopMatch] = None,
+                           matcher: Optional[ShopMatcher] = None, fetch_details: bool = True) -> Optional[Spot]:
+    """enrich_one の非同期版（google_client は AsyncGooglePlacesClient）。"""
+    place_id, summary = match or (None, None)
+    if not place_id:
+        query = f"{hp.name} {hp.address}".strip()
+        place_id = await google_client.find_place_id(query, hp.lat, hp.lng)
+        if not place_id:
+            return None
+        if matcher is not None:
+            matcher.remember(hp, place_id)
+
+    if fetch_details:
+        details = await google_client.get_place_details(place_id)
+        if not details:
+            return None
+    else:
+        details = google_client.cached_place_details(place_id)
+
+    return _candidate(google_client, hp, place_id, summary, details)
+
+
+async def _gather_until(coros, timeout: float) -> list:
+    """
+    gather(..., return_exceptions=True) に締め切りを付けたもの。
+    締め切りまでに終わらなかったものは捨てて、結果の代わりに asyncio.TimeoutError を入れる。
+    """
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    if not tasks:
+        return []
+    await asyncio.wait(tasks, timeout=max(0.0, timeout))
+    results = []
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+            results.append(asyncio.TimeoutError())
+        elif task.cancelled():
+            results.append(asyncio.CancelledError())
+        else:
+            results.append(task.exception() or task.result())
+    return results
+
+
+async def hydrate_details_async(google_client, spots: List[Spot],
+                                matcher: Optional[ShopMatcher] = None,
+                                origin: Optional[Tuple[float, float]] = None,
+                                deadline_sec: float = 5.0) -> None:
+    """hydrate_details の非同期版。"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_sec
+    await hydrate_photos_async(google_client, [s for s in spots if s.details_pending and not s.place_id],
+                               matcher, origin, deadline_sec)
+    todo = [s for s in spots if s.details_pending and s.place_id]
+    results = await _gather_until(
+        (google_client.get_place_details(s.place_id, details_fields(google_client.sync, s)) for s in todo),
+        deadline - loop.time(),
+    )
+    for spot, result in zip(todo, results):
+        if isinstance(result, asyncio.TimeoutError):
+            print("DETAILS_TIMEOUT:", spot.name)
+            metrics.count("enrich.timeout")
+        elif isinstance(result, BaseException):
+            print("DETAILS_ERROR:", spot.name, result)
+            metrics.count("enrich.error")
+        elif result:
+            apply_details(google_client, spot, result)
+
+
+async def _photo_place_async(google_client, spot: Spot, match: Optional[ShopMatch],
+                             matcher: Optional[ShopMatcher]) -> Tuple[Optional[str], Optional[str]]:
+    place_id, summary = match or (None, None)
+    if summary is not None and summary.image_url:
+        return place_id, summary.image_url
+    if not place_id:
+        query = f"{spot.name} {spot.address}".strip()
+        place_id = await google_client.find_place_id(query, spot.lat, spot.lng)
+        if not place_id:
+            return None, None
+        if matcher is not None:
+            matcher.remember(spot, place_id)
+    details = await google_client.get_place_details(place_id, google_client.sync.DETAILS_PHOTO_FIELDS)
+    return place_id, details_photo_url(google_client, details) if details else None
+
+
+async def hydrate_photos_async(google_client, spots: List[Spot],
+                               matcher: Optional[ShopMatcher] = None,
+                               origin: Optional[Tuple[float, float]] = None,
+                               deadline_sec: float = 5.0) -> None:
+    """hydrate_photos の非同期版。"""
+    if not spots:
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_sec
+    matched = {}
+    if matcher is not None:
+        with metrics.span("match"):
+            matched = await matcher.resolve_async(google_client, spots, origin)
+
+    results = await _gather_until(
+        (_photo_place_async(google_client, spot, matched.get(i), matcher) for i, spot in enumerate(spots)),
+        deadline - loop.time(),
+    )
+    for spot, result in zip(spots, results):
+        if isinstance(result, asyncio.TimeoutError):
+            print("PHOTO_TIMEOUT:", spot.name)
+            metrics.count("enrich.timeout")
+            continue
+        if isinstance(result, BaseException):
+            print("PHOTO_ERROR:", spot.name, result)
+            metrics.count("enrich.error")
+            continue
+        _apply_photo(spot, *result)
+
+
+async def enrich_hotpepper_spots_async(
+    google_client,
+    hp_spots: List[Spot],
+    max_concurrency: int = 8,
+    deadline_sec: float = 5.0,
+    on_result: Optional[Callable[[Spot], None]] = None,
+    matcher: Optional[ShopMatcher] = None,
+    origin: Optional[Tuple[float, float]] = None,
+    fetch_details: bool = True,
+) -> List[Spot]:
+    """
+    enrich_hotpepper_spots の非同期版。スレッドの代わりにタスクで並行に補完する。
+    突き合わせ・締め切り・失敗時の扱い・戻り値の並び順は同期版と同じ。
+    """
+    if not hp_spots:
+        return []
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_sec
+    matched = {}
+    if matcher is not None:
+        with metrics.span("match"):
+            matched = await matcher.resolve_async(google_client, hp_spots, origin)
+
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(hp: Spot, match: Optional[ShopMatch]) -> Optional[Spot]:
+        async with sem:
+            return await enrich_one_async(google_client, hp, match, matcher, fetch_details)
+
+    tasks = [asyncio.create_task(run(hp, matched.get(i))) for i, hp in enumerate(hp_spots)]
+    index = {task: i for i, task in enumerate(tasks)}
+    enriched = {}
+    try:
+        pending = set(tasks)
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            # 完了した順ではなく Hotpepper の並び順で知らせる（同時に終わったもの同士）
+            for task in sorted(done, key=index.get):
+                i = index[task]
+                try:
+                    spot = task.result()
+                except Exception as e:
+                    print("ENRICH_ERROR:", hp_spots[i].name, e)
+                    metrics.count("enrich.error")
+                    continue
+                if spot is None:
+                    continue
+                enriched[i] = spot
+                if on_result is not None:
+                    on_result(spot)
+
+        for task in pending:
+            print("ENRICH_TIMEOUT:", hp_spots[index[task]].name)
+            metrics.count("enrich.timeout")
+        return [enriched[i] for i in range(len(tasks)) if i in enriched]
+    finally:
+        # 締め切りを過ぎたタスクは捨てる
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,102 @@
+# gazetteer.py
+import bisect
+import csv
+import os
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+
+def normalize_station_name(name: str) -> str:
+    """
+    駅名の表記ゆれを吸収したキーにする。
+    全角/半角を揃え、空白と末尾の「駅」を取り除き、英字は小文字に。
+    例）"名古屋駅" / " 名古屋 " / "名古屋　駅" を同じキー "名古屋" に寄せる
+    """
+    key = unicodedata.normalize("NFKC", name or "")
+    key = "".join(key.split()).lower()
+    if key.endswith("駅") and len(key) > 1:
+        key = key[:-1]
+    return key
+
+
+class StationGazetteer:
+    """
+    駅名 → (lat, lng) のローカル表。
+    起動時に CSV（name,lat,lng）から読み込み、API で引いた駅は同じファイルに追記する。
+    キーはソート済みで持つので前方一致（オートコンプリート）も二分探索で引ける。
+    """
+
+    def __init__(self, path: Optional[str] = None, fallback=None):
+        self.path = path
+        # 表に無い駅を引く読み取り専用の表（snapshot.CoordTable。キーは normalize_station_name したもの）
+        self.fallback = fallback
+        self._coords: Dict[str, Tuple[float, float]] = {}
+        self._labels: Dict[str, str] = {}
+        self._sorted_keys: List[str] = []
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path: str) -> None:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith("#"):
+                    continue
+                try:
+                    lat, lng = float(row[1]), float(row[2])
+                except ValueError:
+                    continue  # ヘッダ行や壊れた行は飛ばす
+                self._put(row[0], lat, lng)
+
+    def _put(self, name: str, lat: float, lng: float) -> bool:
+        key = normalize_station_name(name)
+        if not key:
+            return False
+        is_new = key not in self._coords
+        self._coords[key] = (lat, lng)
+        if is_new:
+            self._labels[key] = name.strip()
+            bisect.insort(self._sorted_keys, key)
+        return is_new
+
+    def lookup(self, name: str) -> Optional[Tuple[float, float]]:
+        key = normalize_station_name(name)
+        coords = self._coords.get(key)
+        if coords is None and self.fallback is not None and key:
+            coords = self.fallback.lookup(key)
+        return coords
+
+    def add(self, name: str, lat: float, lng: float) -> None:
+        """新しい駅を登録し、ファイルがあれば追記して次回起動時にも使えるようにする。"""
+        with self._lock:
+            is_new = self._put(name, lat, lng)
+            if is_new and self.path:
+                dirname = os.path.dirname(self.path)
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                with open(self.path, "a", newline="", encoding="utf-8") as f:
+                    csv.writer(f).writerow([name.strip(), f"{lat:.6f}", f"{lng:.6f}"])
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[str]:
+        """前方一致する駅名（表示用）を最大 limit 件返す。"""
+        key = normalize_station_name(prefix)
+        if not key:
+            return []
+        i = bisect.bisect_left(self._sorted_keys, key)
+        names: List[str] = []
+        while i < len(self._sorted_keys) and len(names) < limit:
+            k = self._sorted_keys[i]
+            if not k.startswith(key):
+                break
+            names.append(self._labels[k])
+            i += 1
+        return names
+
+    def items(self) -> List[Tuple[str, float, float]]:
+        """(正規化したキー, lat, lng) の一覧（スナップショット用）"""
+        with self._lock:
+            return [(key, lat, lng) for key, (lat, lng) in self._coords.items()]
+
+    def __len__(self) -> int:
+        return len(self._coords)
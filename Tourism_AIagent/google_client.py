@@ -1,31 +1,114 @@
 # google_client.py
-from typing import List, Tuple, Optional
-import requests
-from spot import Spot
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Sequence, Tuple, Optional
+import queue
+import threading
+import time
+from http_session import http_get
+from cache import TTLCache, MISSING
+from gazetteer import StationGazetteer
+from rate_limiter import ApiQuota, QuotaExceeded
+import metrics
+from spatial_index import SpotIndex
+from spot import Spot, spot_identity
 
 
 class GooglePlacesClient:
+    API_ORIGIN = "https://maps.googleapis.com"
     PLACES_NEARBY_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
     GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
     FIND_PLACE_URL = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
     DETAILS_URL = "https://maps.googleapis.com/maps/api/place/details/json"
     PHOTO_URL = "https://maps.googleapis.com/maps/api/place/photo"
-    
-    def __init__(self, api_key: str):
+
+    # Nearby Search のページ送り（1ページ20件 × 最大3ページ）
+    NEARBY_MAX_PAGES = 3
+    NEXT_PAGE_DELAY_SEC = 2.0   # next_page_token が有効になるまでの目安
+    NEXT_PAGE_RETRY_SEC = 0.5   # まだ無効だったときの再試行間隔
+
+    # Place Details で取るフィールド（フィールドの種類ごとに料金が加算される）
+    DETAILS_FIELDS = "name,rating,user_ratings_total,formatted_address,geometry,photos,types"
+    # 評価・口コミ数（Atmosphere 扱い）を除いたもの。評価が Nearby Search で分かっている店に使う
+    DETAILS_BASIC_FIELDS = "name,formatted_address,geometry,photos,types"
+    # 写真だけ。表示の中身は Hotpepper のまま使う店（Hotpepper だけで採点したとき）に使う
+    DETAILS_PHOTO_FIELDS = "photos"
+
+    def __init__(self, api_key: str,
+                 place_id_cache: Optional[TTLCache] = None,
+                 details_cache: Optional[TTLCache] = None,
+                 gazetteer: Optional[StationGazetteer] = None,
+                 spot_index: Optional[SpotIndex] = None,
+                 quota: Optional[ApiQuota] = None,
+                 base_url: Optional[str] = None):
         self.api_key = api_key
+        if base_url:
+            # 代役サーバー（ベンチマーク用など）に向けるときは、ホスト部分だけ差し替える
+            origin = base_url.rstrip("/")
+            for attr in ("PLACES_NEARBY_URL", "GEOCODE_URL", "FIND_PLACE_URL", "DETAILS_URL", "PHOTO_URL"):
+                setattr(self, attr, getattr(self, attr).replace(self.API_ORIGIN, origin, 1))
+        # find_place_id / get_place_details の結果キャッシュ（None ならキャッシュしない）
+        self.place_id_cache = place_id_cache
+        self.details_cache = details_cache
+        # 駅名 → 座標のローカル表（あれば Geocoding API より先に引く）
+        self.gazetteer = gazetteer
+        # 取得済みスポットの空間インデックス（取得済み範囲内の検索は API を呼ばない）
+        self.spot_index = spot_index
+        # エンドポイントごとのレート制限と呼び出し数・料金の集計（None なら制限しない）
+        self.quota = quota
+
+    def _get_json(self, endpoint: str, url: str, params: dict) -> dict:
+        """
+        レート制限を通してから GET し、JSON を返す。
+        上限で見送ったときや 429 / OVER_QUERY_LIMIT のときは QuotaExceeded。
+        """
+        if self.quota is not None and not self.quota.acquire(endpoint):
+            metrics.count(f"quota.{endpoint}.denied")
+            raise QuotaExceeded(f"{endpoint}: レート上限のため呼び出しを見送りました")
+        with metrics.span(f"google.{endpoint}"):
+            resp = http_get(url, params=params)
+            if self.quota is not None:
+                self.quota.check_response(endpoint, resp)
+            resp.raise_for_status()
+            data = resp.json()
+        self._check_payload(endpoint, data)
+        return data
+
+    def _check_payload(self, endpoint: str, data: dict) -> None:
+        # Google は上限超過を HTTP 200 + status で返すことがある
+        if data.get("status") == "OVER_QUERY_LIMIT":
+            if self.quota is not None:
+                self.quota.record_over_limit(endpoint)
+            raise QuotaExceeded(f"{endpoint}: OVER_QUERY_LIMIT")
 
     def geocode_station(self, station_name: str) -> Tuple[float, float]:
         """
-        駅名から座標を取得（Geocoding API）。
+        駅名から座標を取得。
+        駅名表にあればそれを使い、無ければ Geocoding API で引いて表に書き戻す。
         """
-        params = {
+        if self.gazetteer is not None:
+            coords = self.gazetteer.lookup(station_name)
+            if coords is not None:
+                metrics.count("gazetteer.hit")
+                return coords
+            metrics.count("gazetteer.miss")
+
+        lat, lng = self._fetch_geocode(station_name)
+        if self.gazetteer is not None:
+            self.gazetteer.add(station_name, lat, lng)
+        return lat, lng
+
+    def _fetch_geocode(self, station_name: str) -> Tuple[float, float]:
+        data = self._get_json("geocode", self.GEOCODE_URL, self._geocode_params(station_name))
+        return self._parse_geocode(data, station_name)
+
+    def _geocode_params(self, station_name: str) -> dict:
+        return {
             "address": station_name,
             "region": "jp",
             "key": self.api_key,
         }
-        resp = requests.get(self.GEOCODE_URL, params=params, proxies={"http": None, "https": None}, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+
+    def _parse_geocode(self, data: dict, station_name: str) -> Tuple[float, float]:
         results = data.get("results", [])
         if not results:
             raise ValueError(f"駅名 '{station_name}' から座標を取得できませんでした。")
@@ -41,22 +124,178 @@ class GooglePlacesClient:
         )
 
     def nearby_places(self, center_lat: float, center_lng: float, place_type: str,
-                      radius: int = 3000) -> List[Spot]:
+                      radius: int = 3000, max_pages: int = 1, max_results: int = 60,
+                      time_budget_sec: float = 6.0, keyword: Optional[str] = None) -> List[Spot]:
         """
         指定座標から place_type ごとに Nearby Search。
         （/recommend 用の Spot リスト）
+        max_pages > 1 なら next_page_token をたどって最大 60 件まで集める。
         """
+        spots: List[Spot] = []
+        for page in self.iter_nearby_pages(center_lat, center_lng, place_type, radius=radius,
+                                           max_pages=max_pages, max_results=max_results,
+                                           time_budget_sec=time_budget_sec, keyword=keyword):
+            spots.extend(page)
+        return spots
+
+    def iter_nearby_pages(self, center_lat: float, center_lng: float, place_type: str,
+                          radius: int = 3000, max_pages: int = 3, max_results: int = 60,
+                          time_budget_sec: float = 6.0, keyword: Optional[str] = None,
+                          status: Optional[dict] = None, rankby: Optional[str] = None,
+                          stop: Optional[threading.Event] = None) -> Iterator[List[Spot]]:
+        """
+        Nearby Search の結果を1ページ（最大20件）ずつ返す。
+        next_page_token は発行から少し経たないと有効にならないので、
+        受け取った時刻から NEXT_PAGE_DELAY_SEC 経つまでだけ待つ。
+        呼び出し側が前のページを採点している間に待ち時間が消化される。
+        件数が max_results に達するか time_budget_sec を使い切ったら打ち切る。
+        status を渡すと、打ち切らずに最後のページまで取れたとき status["complete"] = True にする。
+        rankby="distance" なら半径を付けず、中心から近い順に返してもらう。
+        stop がセットされたら、次のページは取りに行かない（待っている途中でもすぐやめる）。
+        """
+        started = time.monotonic()
+        data = self._fetch_nearby(self._nearby_params(center_lat, center_lng, place_type, radius, keyword, rankby))
+        total = 0
+        pages = max(1, min(max_pages, self.NEARBY_MAX_PAGES))
+
+        for page_no in range(pages):
+            results = self._spots_from_nearby_results(data.get("results", []), place_type)
+            page = results[:max_results - total]
+            total += len(page)
+            # トークンが有効になる時刻（ここから先の採点時間は待ち時間に含まれる）
+            not_before = time.monotonic() + self.NEXT_PAGE_DELAY_SEC
+            token = data.get("next_page_token")
+            if status is not None and not token and len(page) == len(results):
+                status["complete"] = True
+            yield page
+
+            if not token or total >= max_results or page_no + 1 >= pages:
+                return
+
+            data = None
+            while data is None:
+                wait = not_before - time.monotonic()
+                if time.monotonic() + max(wait, 0) - started > time_budget_sec:
+                    return
+                if stop is not None:
+                    if stop.wait(max(wait, 0)):
+                        return
+                elif wait > 0:
+                    time.sleep(wait)
+                try:
+                    page_data = self._fetch_nearby({"key": self.api_key, "pagetoken": token})
+                except QuotaExceeded as e:
+                    # 2ページ目以降は諦めて、取れた分だけで続ける
+                    print("QUOTA:", e)
+                    return
+                if page_data.get("status") == "INVALID_REQUEST":
+                    # まだ有効になっていない → 少し待って再試行
+                    not_before = time.monotonic() + self.NEXT_PAGE_RETRY_SEC
+                    continue
+                data = page_data
+
+    def iter_nearby_pages_multi(self, center_lat: float, center_lng: float,
+                                queries: Sequence[Tuple[str, Optional[str]]],
+                                radius: int = 3000, max_pages: int = 1, max_results: int = 60,
+                                time_budget_sec: float = 6.0, max_workers: int = 4) -> Iterator[List[Spot]]:
+        """
+        複数の (place_type, keyword) を並列に Nearby Search し、ページ単位で返す。
+        - 各クエリは別スレッドで iter_nearby_pages を回す（ページ待ちも並列）
+        - 1本のキューで受け、どのクエリのページでも届いた順に返す（遅いクエリを待たない）
+        - place_id（無ければ名前＋座標）で重複を除き、初出のものだけ返す
+        - 全クエリ合わせて max_results 件に達したら打ち切る
+        - 一部のクエリが失敗しても残りで続ける（全部失敗したときだけ例外）
+        - spot_index があれば、取得済み範囲内のクエリは API を呼ばずにそこから返す
+        """
+        pages: queue.Queue = queue.Queue()   # (クエリ番号, ページ)。ページが None ならそのクエリは終わり
+        errors: List[Exception] = []
+        # 読み手がやめたら（件数に達した・呼び出し側が読むのをやめた）、走っているクエリも次のページを取らない
+        stop = threading.Event()
+
+        def produce(i: int, place_type: str, keyword: Optional[str]) -> None:
+            tag = f"{place_type}|{keyword or ''}"
+            try:
+                if stop.is_set():
+                    return
+                if self.spot_index is not None:
+                    known = self.spot_index.query(tag, center_lat, center_lng, radius)
+                    if known is not None:
+                        metrics.count("spot_index.hit")
+                        pages.put((i, known[:max_results]))
+                        return
+
+                fetched: List[Spot] = []
+                status = {}
+                for page in self.iter_nearby_pages(center_lat, center_lng, place_type, radius=radius,
+                                                   max_pages=max_pages, max_results=max_results,
+                                                   time_budget_sec=time_budget_sec, keyword=keyword,
+                                                   status=status, stop=stop):
+                    fetched.extend(page)
+                    pages.put((i, page))
+
+                if self.spot_index is not None:
+                    # 途中で打ち切った結果は円の中の上位の一部なので、取得済み範囲にはしない
+                    self.spot_index.add(tag, fetched, center_lat, center_lng, radius,
+                                        complete=status.get("complete", False))
+            except Exception as e:
+                print("NEARBY_ERROR:", place_type, keyword, e)
+                errors.append(e)
+            finally:
+                pages.put((i, None))
+
+        workers = max(1, min(max_workers, len(queries)))
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nearby")
+        try:
+            for i, (place_type, keyword) in enumerate(queries):
+                pool.submit(metrics.bind(produce), i, place_type, keyword)
+
+            seen = set()
+            found = 0
+            active = len(queries)
+            while active and found < max_results:
+                _, page = pages.get()
+                if page is None:
+                    active -= 1
+                    continue
+                fresh = []
+                for spot in page:
+                    key = spot_identity(spot)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    fresh.append(spot)
+                fresh = fresh[:max_results - found]
+                found += len(fresh)
+                if fresh:
+                    yield fresh
+
+            if queries and len(errors) == len(queries):
+                raise errors[0]
+        finally:
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _nearby_params(self, center_lat: float, center_lng: float, place_type: str,
+                       radius: int, keyword: Optional[str], rankby: Optional[str] = None) -> dict:
         params = {
             "key": self.api_key,
             "location": f"{center_lat},{center_lng}",
-            "radius": radius,
             "type": place_type,
             "language": "ja",
         }
-        resp = requests.get(self.PLACES_NEARBY_URL, params=params, proxies={"http": None, "https": None}, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        results = data.get("results", [])
+        # rankby=distance のときは radius を付けてはいけない（付けると INVALID_REQUEST）
+        if rankby:
+            params["rankby"] = rankby
+        else:
+            params["radius"] = radius
+        if keyword:
+            params["keyword"] = keyword
+        return params
+
+    def _fetch_nearby(self, params: dict) -> dict:
+        return self._get_json("nearby", self.PLACES_NEARBY_URL, params)
+
+    def _spots_from_nearby_results(self, results: List[dict], place_type: str) -> List[Spot]:
         spots: List[Spot] = []
 
         for r in results:
@@ -90,41 +329,109 @@ class GooglePlacesClient:
                 description=description,
                 image_url=image_url,
                 source="google",
+                place_id=r.get("place_id"),
+                place_types=",".join(types),
             )
-            spot.score_breakdown = {
-                "types": ",".join(types),
-            }
             spots.append(spot)
 
         return spots
 
     def find_place_id(self, name: str, lat: float, lng: float) -> Optional[str]:
-        params = {
+        cache_key = self._place_id_cache_key(name, lat, lng)
+        if self.place_id_cache is not None:
+            cached = self.place_id_cache.get(cache_key)
+            if cached is not MISSING:
+                metrics.count("cache.place_id.hit")
+                return cached
+            metrics.count("cache.place_id.miss")
+
+        try:
+            place_id = self._fetch_place_id(name, lat, lng)
+        except QuotaExceeded as e:
+            # 見つからなかった扱いにする（結果はキャッシュしない）
+            print("QUOTA:", e)
+            return None
+        if self.place_id_cache is not None:
+            self.place_id_cache.set(cache_key, place_id)
+        return place_id
+
+    @staticmethod
+    def _place_id_cache_key(name: str, lat: float, lng: float) -> str:
+        # 同じ店は同じ座標で何度も検索されるので、座標は約1m単位に丸めてキーにする
+        return f"{name}|{lat:.5f},{lng:.5f}"
+
+    def _fetch_place_id(self, name: str, lat: float, lng: float) -> Optional[str]:
+        data = self._get_json("find_place", self.FIND_PLACE_URL, self._find_place_params(name, lat, lng))
+        return self._parse_find_place(data)
+
+    def _find_place_params(self, name: str, lat: float, lng: float) -> dict:
+        return {
             "input": name,
             "inputtype": "textquery",
             "locationbias": f"point:{lat},{lng}",
             "key": self.api_key,
         }
-        resp = requests.get(self.FIND_PLACE_URL, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
 
+    def _parse_find_place(self, data: dict) -> Optional[str]:
         candidates = data.get("candidates", [])
         if not candidates:
             return None
 
         return candidates[0].get("place_id")
 
-    def get_place_details(self, place_id: str) -> dict:
-        params = {
+    def get_place_details(self, place_id: str, fields: Optional[str] = None) -> dict:
+        """
+        Place Details（fields を省略すると DETAILS_FIELDS）。
+        キャッシュはフィールドの組ごとに持ち、多く取った結果があればそれで済ませる。
+        """
+        fields = fields or self.DETAILS_FIELDS
+        cached = self.cached_place_details(place_id, fields)
+        if cached is not None:
+            metrics.count("cache.details.hit")
+            return cached
+        if self.details_cache is not None:
+            metrics.count("cache.details.miss")
+
+        try:
+            details = self._fetch_place_details(place_id, fields)
+        except QuotaExceeded as e:
+            print("QUOTA:", e)
+            return {}
+        # 空の結果はキャッシュしない（一時的な失敗を固定化しないため）
+        if details and self.details_cache is not None:
+            self.details_cache.set(self._details_cache_key(place_id, fields), details)
+        return details
+
+    def cached_place_details(self, place_id: str, fields: Optional[str] = None) -> Optional[dict]:
+        """キャッシュにある詳細だけを返す（API は呼ばない）。無ければ None。"""
+        if self.details_cache is None:
+            return None
+        fields = fields or self.DETAILS_FIELDS
+        # 全部入りの結果はどのフィールドの組にも使える
+        keys = [self._details_cache_key(place_id, self.DETAILS_FIELDS)]
+        if fields != self.DETAILS_FIELDS:
+            keys.append(self._details_cache_key(place_id, fields))
+        for key in keys:
+            cached = self.details_cache.get(key)
+            if cached is not MISSING:
+                return cached
+        return None
+
+    def _details_cache_key(self, place_id: str, fields: str) -> str:
+        # 全部入りは従来どおり place_id だけをキーにする（保存済みのキャッシュをそのまま使う）
+        return place_id if fields == self.DETAILS_FIELDS else f"{place_id}|{fields}"
+
+    def _fetch_place_details(self, place_id: str, fields: Optional[str] = None) -> dict:
+        params = self._details_params(place_id, fields)
+        return self._get_json("details", self.DETAILS_URL, params).get("result", {})
+
+    def _details_params(self, place_id: str, fields: Optional[str] = None) -> dict:
+        return {
             "place_id": place_id,
-            "fields": "name,rating,user_ratings_total,formatted_address,geometry,photos,types",
+            "fields": fields or self.DETAILS_FIELDS,
             "key": self.api_key,
             "language": "ja",
         }
-        resp = requests.get(self.DETAILS_URL, params=params, timeout=10)
-        resp.raise_for_status()
-        return resp.json().get("result", {})
 
     def get_photo_url(self, photo_ref: str, max_width: int = 800) -> str:
         url = f"{self.PHOTO_URL}?maxwidth={max_width}&photoreference={photo_ref}&key={self.api_key}"
@@ -1,14 +1,34 @@
 # hotpepper_client.py
-from typing import List, Dict
-import requests
+from typing import List, Dict, Optional, Tuple
+from http_session import http_get
+from rate_limiter import ApiQuota, QuotaExceeded
+import metrics
 from spot import Spot
 
+# 1回の検索で返してもらえる件数の上限（これより多く欲しいときは start でページ送り）
+MAX_COUNT_PER_PAGE = 100
+
+# Hotpepper の検索範囲コード（range）→ 半径(m)
+RANGE_CODES = [(1, 300), (2, 500), (3, 1000), (4, 2000), (5, 3000)]
+
+
+def range_code_for_radius(radius_m: int) -> int:
+    """フォームの半径(m) → その半径を含むいちばん狭い range コード（3km より広ければ 5）。"""
+    for code, meters in RANGE_CODES:
+        if radius_m <= meters:
+            return code
+    return RANGE_CODES[-1][0]
+
 
 class HotpepperClient:
     BASE_URL = "http://webservice.recruit.co.jp/hotpepper/gourmet/v1/"
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, quota: Optional[ApiQuota] = None, base_url: Optional[str] = None):
         self.api_key = api_key
+        self.quota = quota
+        if base_url:
+            # 代役サーバー（ベンチマーク用など）に向ける
+            self.BASE_URL = base_url
 
     def search_restaurants(
         self,
@@ -18,13 +38,55 @@ class HotpepperClient:
         lat: float | None = None,
         lng: float | None = None,
         range_code: int = 4,  # 1〜5 (1:300m, 2:500m, 3:1km, 4:2km, 5:3km)
+        start: int = 1,
     ) -> List[Spot]:
+        params = self._search_params(station_keyword, user_genre_keyword, count, lat, lng, range_code, start)
+        return self._parse_shops(self._get(params))
 
+    def search_pool(
+        self,
+        station_keyword: str,
+        user_genre_keyword: str,
+        max_results: int = MAX_COUNT_PER_PAGE,
+        lat: float | None = None,
+        lng: float | None = None,
+        range_code: int = 4,
+    ) -> List[Spot]:
+        """
+        採点用に候補店をまとめて取る（start / count でページ送りし、max_results 件か
+        該当件数に届くまで）。max_results が 100 件以下なら呼び出しは1回。
+        """
+        spots: List[Spot] = []
+        while len(spots) < max_results:
+            count = min(MAX_COUNT_PER_PAGE, max_results - len(spots))
+            params = self._search_params(station_keyword, user_genre_keyword, count, lat, lng,
+                                         range_code, start=len(spots) + 1)
+            page, available = self._parse_page(self._get(params))
+            spots.extend(page)
+            if not page or len(spots) >= available:
+                break
+        return spots
+
+    def _get(self, params: dict) -> dict:
+        if self.quota is not None and not self.quota.acquire("hotpepper"):
+            metrics.count("quota.hotpepper.denied")
+            raise QuotaExceeded("hotpepper: レート上限のため呼び出しを見送りました")
+        with metrics.span("hotpepper.gourmet"):
+            resp = http_get(self.BASE_URL, params=params)
+            if self.quota is not None:
+                self.quota.check_response("hotpepper", resp)
+            resp.raise_for_status()
+            return resp.json()
+
+    def _search_params(self, station_keyword: str, user_genre_keyword: str, count: int,
+                       lat: Optional[float], lng: Optional[float], range_code: int, start: int = 1) -> dict:
         params = {
             "key": self.api_key,
             "format": "json",
             "count": count,
         }
+        if start > 1:
+            params["start"] = start
 
         if lat is not None and lng is not None:
             # 🔹 地図で選んだ位置を中心に検索
@@ -37,16 +99,18 @@ class HotpepperClient:
         else:
             # 🔹 これまで通り「駅名＋ジャンル」のキーワード検索
             params["keyword"] = f"{station_keyword} {user_genre_keyword}"
+        return params
 
-        resp = requests.get(
-            self.BASE_URL,
-            params=params,
-            proxies={"http": None, "https": None},  # プロキシ無効
-            timeout=10,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-
+    def _parse_shops(self, data: dict) -> List[Spot]:
         shops = data.get("results", {}).get("shop", [])
         spots = [Spot.from_hotpepper_json(s) for s in shops]
         return spots
+
+    def _parse_page(self, data: dict) -> Tuple[List[Spot], int]:
+        """(この回の店, 該当件数の合計)"""
+        spots = self._parse_shops(data)
+        try:
+            available = int(data.get("results", {}).get("results_available", len(spots)))
+        except (TypeError, ValueError):
+            available = len(spots)
+        return spots, available
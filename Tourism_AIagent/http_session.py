@@ -0,0 +1,90 @@
+# http_session.py
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ---- 外部 API 共通の通信設定（ここ1か所で管理）----
+
+# タイムアウト（接続, 読み込み）秒
+DEFAULT_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT", "3")),
+    float(os.getenv("HTTP_READ_TIMEOUT", "10")),
+)
+
+# ホストごとのコネクションプールの大きさ（並列補完の同時実行数以上にしておく）
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+
+# 5xx のときのリトライ回数とバックオフ係数。
+# 429 はここでは再試行しない（rate_limiter.ApiQuota がバケツを空にして控える。
+# 通信層で再試行するとバケツのトークンを使わずに上流へ何度も投げてしまう）
+RETRY_TOTAL = int(os.getenv("HTTP_RETRY_TOTAL", "2"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    # urllib3 は Retry-After 付きの 429 / 413 を status_forcelist に無くても再試行するので、503 だけにする
+    RETRY_AFTER_STATUS_CODES = frozenset([503])
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+
+    # プロキシ無効（環境変数の HTTP(S)_PROXY を見ない）
+    session.trust_env = False
+
+    retry = _Retry(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=RETRY_TOTAL,
+        status=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=8,        # 保持するホスト数（Google / Hotpepper / 画像CDN）
+        pool_maxsize=POOL_MAXSIZE,  # 1ホストあたりの keep-alive 接続数
+        max_retries=retry,
+        pool_block=False,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    プロセス内で共有する keep-alive 付きのセッションを返す。
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def http_get(url: str, params: Optional[dict] = None, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """
+    requests.get の代わりに使う共通 GET。
+    接続の再利用・リトライ・タイムアウト・プロキシ無効をまとめて適用する。
+    """
+    return get_session().get(url, params=params, timeout=timeout, **kwargs)
+
+
+def http_post_json(url: str, payload, headers: Optional[dict] = None, timeout=DEFAULT_TIMEOUT) -> requests.Response:
+    """
+    JSON を POST する（LLM などの外部サービス用）。
+    リトライは GET / HEAD だけなので、POST は1回きり（締め切りのある呼び出しで再送しない）。
+    """
+    return get_session().post(url, json=payload, headers=headers, timeout=timeout)
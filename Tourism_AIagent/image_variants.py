@@ -0,0 +1,106 @@
+# image_variants.py
+import io
+from typing import Optional, Tuple
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow が無い環境では変換せずそのまま返す
+    Image = None
+    features = None
+
+# 生成する幅の段階（細かく刻むとキャッシュの種類が増えすぎるので丸める）
+WIDTH_BUCKETS = (160, 320, 480, 640, 800, 1200, 1600)
+MAX_DPR = 3.0
+
+# Google Photo API として扱うホスト（代役サーバーを使うときは app.py で追加する）
+GOOGLE_PHOTO_HOSTS = {"maps.googleapis.com"}
+
+_MIMETYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+
+
+def _supports(fmt: str) -> bool:
+    if features is None:
+        return False
+    try:
+        return bool(features.check(fmt))
+    except Exception:
+        return False
+
+
+_ENCODABLE = {fmt for fmt in ("avif", "webp") if _supports(fmt)}
+
+
+def snap_width(width: Optional[int], dpr: Optional[float]) -> Optional[int]:
+    """表示幅 × DPR を、WIDTH_BUCKETS のうち収まる最小の段階に丸める。"""
+    if not width or width <= 0:
+        return None
+    ratio = min(max(dpr or 1.0, 1.0), MAX_DPR)
+    needed = int(width * ratio)
+    for bucket in WIDTH_BUCKETS:
+        if bucket >= needed:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+
+def negotiate_format(accept: str) -> Optional[str]:
+    """
+    Accept ヘッダから返せる形式を選ぶ（AVIF > WebP）。
+    どちらも無理なら None（元の形式のまま返す）。
+    """
+    accept = (accept or "").lower()
+    for fmt in ("avif", "webp"):
+        if f"image/{fmt}" in accept and fmt in _ENCODABLE:
+            return fmt
+    return None
+
+
+def is_google_photo_url(img_url: str) -> bool:
+    return urlparse(img_url).hostname in GOOGLE_PHOTO_HOSTS
+
+
+def with_maxwidth(img_url: str, width: int) -> str:
+    """Google Photo API の URL の maxwidth を差し替える（Google 側で縮小させる）。"""
+    u = urlparse(img_url)
+    qs = parse_qs(u.query, keep_blank_values=True)
+    qs["maxwidth"] = [str(width)]
+    return urlunparse(u._replace(query=urlencode(qs, doseq=True)))
+
+
+def can_transcode() -> bool:
+    return Image is not None
+
+
+def transcode(data: bytes, width: Optional[int], fmt: Optional[str]) -> Tuple[bytes, str]:
+    """
+    画像を width 以下に縮小し、fmt（avif / webp / None=JPEG）で書き出す。
+    Pillow が無い・読めない画像の場合は ValueError。
+    """
+    if Image is None:
+        raise ValueError("Pillow is not installed")
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception as e:
+        raise ValueError(f"cannot decode image: {e}")
+
+    if width and img.width > width:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+
+    out_fmt = fmt or "jpeg"
+    if out_fmt == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    buf = io.BytesIO()
+    if out_fmt == "avif":
+        img.save(buf, format="AVIF", quality=55)
+    elif out_fmt == "webp":
+        img.save(buf, format="WEBP", quality=75, method=4)
+    else:
+        img.save(buf, format="JPEG", quality=80, optimize=True, progressive=True)
+    return buf.getvalue(), _MIMETYPES[out_fmt]
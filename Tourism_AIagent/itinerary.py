@@ -0,0 +1,312 @@
+# itinerary.py
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from spot import Spot
+from scoring_batch import haversine_km_array, haversine_km_matrix
+
+# 移動時間の目安：近ければ徒歩、遠ければ電車・バス（乗り換えや待ち時間を上乗せ）
+WALK_KMH = 4.5
+WALK_MAX_KM = 1.2
+TRANSIT_KMH = 20.0
+TRANSIT_OVERHEAD_MIN = 12.0
+
+# 滞在時間が分からないスポットの目安（reasoner と同じ）
+DEFAULT_STAY_MIN = {"restaurant": 60, "place": 90}
+
+# 飲食店に着いてよい時間帯（0時からの分）。営業時間は取っていないので一般的な昼〜夜で見る
+RESTAURANT_HOURS = (11 * 60, 21 * 60)
+
+# 解く時間の上限（リクエストの中で同期に回すので短く切る）
+TIME_LIMIT_MS = 50.0
+
+# 行程はその日のうちに終える（0時からの分）
+DAY_END_MIN = 24 * 60
+
+
+@dataclass
+class Stop:
+    index: int            # 入力の spots の添字
+    arrive_min: float     # 0時からの分
+    depart_min: float
+    travel_min: float     # 前の地点（最初は起点）からの移動
+
+
+@dataclass
+class Itinerary:
+    """1日の行程。dropped は時間に収まらず外した spots の添字（価値の低い順に外したもの）"""
+    stops: List[Stop] = field(default_factory=list)
+    dropped: List[int] = field(default_factory=list)
+    start_min: float = 0.0
+    end_min: float = 0.0
+    travel_min: float = 0.0
+    solve_ms: float = 0.0
+
+
+def travel_minutes(km: np.ndarray) -> np.ndarray:
+    """距離(km) → 移動時間(分)。徒歩圏は歩き、それより遠ければ速い方"""
+    walk = km / WALK_KMH * 60
+    transit = TRANSIT_OVERHEAD_MIN + km / TRANSIT_KMH * 60
+    return np.where(km <= WALK_MAX_KM, walk, np.minimum(walk, transit))
+
+
+class _Problem:
+    """
+    節点 0..n-1 がスポット、n が起点、n+1 が終点の目印（どこからでも 0 分）。
+    経路は常に [起点, ..., 終点] の形で持つので、片道（戻らない）の行程を
+    2-opt / or-opt の同じ式で扱える。起点が無いときは起点からも 0 分（どこから始めてもよい）。
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, stay: np.ndarray, value: np.ndarray,
+                 earliest: np.ndarray, latest: np.ndarray, start_min: float, end_min: float,
+                 origin: Optional[Tuple[float, float]]):
+        n = len(lat)
+        self.n = n
+        self.start = n
+        self.end = n + 1
+        t = np.zeros((n + 2, n + 2))
+        t[:n, :n] = travel_minutes(haversine_km_matrix(lat, lng))
+        if origin is not None:
+            from_origin = travel_minutes(haversine_km_array(origin[0], origin[1], lat, lng))
+            t[n, :n] = from_origin
+            t[:n, n] = from_origin
+        self.t = t
+        self.stay = np.append(stay, [0.0, 0.0])
+        self.value = value
+        self.earliest = np.append(earliest, [start_min, start_min])
+        self.latest = np.append(latest, [end_min, end_min])
+        self.start_min = start_min
+        self.end_min = end_min
+
+    def cost(self, route: np.ndarray) -> float:
+        return float(self.t[route[:-1], route[1:]].sum())
+
+    def schedule(self, route: Sequence[int]) -> Optional[List[Tuple[float, float, float]]]:
+        """各節点の (着, 発, 移動) 。時間帯や1日の終わりに間に合わなければ None"""
+        t, stay, earliest, latest = self.t, self.stay, self.earliest, self.latest
+        now = self.start_min
+        rows = []
+        for prev, node in zip(route[:-1], route[1:]):
+            if node == self.end:
+                break
+            move = t[prev, node]
+            arrive = max(now + move, earliest[node])
+            if arrive > latest[node]:
+                return None
+            now = arrive + stay[node]
+            if now > self.end_min:
+                return None
+            rows.append((arrive, now, move))
+        return rows
+
+
+def _nearest_neighbor(p: _Problem, nodes: Sequence[int]) -> np.ndarray:
+    t = p.t
+    left = list(nodes)
+    route = [p.start]
+    while left:
+        here = route[-1]
+        k = int(np.argmin(t[here, left]))
+        route.append(left.pop(k))
+    route.append(p.end)
+    return np.array(route, dtype=np.intp)
+
+
+def _two_opt(p: _Problem, route: np.ndarray, deadline: float) -> np.ndarray:
+    """区間 route[i..j] を反転して移動が減るものを、i ごとに全 j まとめて調べる（移動時間は対称）"""
+    t = p.t
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, len(route) - 2):
+            j = np.arange(i + 1, len(route) - 1)
+            a, b = route[i - 1], route[i]
+            c, d = route[j], route[j + 1]
+            delta = t[a, c] + t[b, d] - t[a, b] - t[c, d]
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                route[i:j[k] + 1] = route[i:j[k] + 1][::-1].copy()
+                improved = True
+    return route
+
+
+def _or_opt(p: _Problem, route: np.ndarray, deadline: float) -> np.ndarray:
+    """1〜3 個続きの区間を別の位置へ（向きを変えても）移して移動が減るものを探す"""
+    t = p.t
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for size in (1, 2, 3):
+            i = 1
+            while i + size < len(route):
+                first, last = route[i], route[i + size - 1]
+                prev, nxt = route[i - 1], route[i + size]
+                gain = t[prev, first] + t[last, nxt] - t[prev, nxt]
+                rest = np.concatenate([route[:i], route[i + size:]])
+                a, b = rest[:-1], rest[1:]
+                base = t[a, b]
+                forward = t[a, first] + t[last, b] - base
+                backward = t[a, last] + t[first, b] - base
+                add = np.minimum(forward, backward)
+                k = int(np.argmin(add))
+                if add[k] - gain < -1e-9:
+                    segment = route[i:i + size]
+                    if backward[k] < forward[k]:
+                        segment = segment[::-1]
+                    route = np.concatenate([rest[:k + 1], segment, rest[k + 1:]])
+                    improved = True
+                i += 1
+    return route
+
+
+def _improve(p: _Problem, route: np.ndarray, deadline: float) -> np.ndarray:
+    route = _two_opt(p, route, deadline)
+    return _or_opt(p, route, deadline)
+
+
+def _drop_one(p: _Problem, route: np.ndarray) -> Tuple[np.ndarray, int]:
+    """外したときに浮く時間（滞在＋寄り道）あたりの価値が一番低いスポットを外す"""
+    t = p.t
+    prev, node, nxt = route[:-2], route[1:-1], route[2:]
+    saved = p.stay[node] + t[prev, node] + t[node, nxt] - t[prev, nxt]
+    ratio = p.value[node] / np.maximum(saved, 1.0)
+    k = int(np.argmin(ratio)) + 1
+    return np.delete(route, k), int(route[k])
+
+
+def _end_time(p: _Problem, route: Sequence[int]) -> float:
+    rows = p.schedule(route)
+    if rows is None:
+        return float("inf")
+    return rows[-1][1] if rows else p.start_min
+
+
+def _fill_waits(p: _Problem, route: np.ndarray) -> np.ndarray:
+    """
+    時間帯の前に着いて待つスポット（開店前の飲食店など）を、1日が早く終わる位置へ移す。
+    2-opt / or-opt は移動時間しか見ないので、待ち時間はここで詰める。
+    """
+    rows = p.schedule(route)
+    if rows is None:
+        return route
+    waiting = [int(route[i + 1]) for i, (arrive, _, move) in enumerate(rows)
+               if arrive > (rows[i - 1][1] if i else p.start_min) + move + 1e-9]
+    for node in waiting:
+        rest = route[route != node]
+        best, best_end = route, _end_time(p, route)
+        for k in range(1, len(rest)):
+            candidate = np.insert(rest, k, node)
+            end = _end_time(p, candidate)
+            if end < best_end - 1e-9:
+                best, best_end = candidate, end
+        route = best
+    return route
+
+
+def _insert(p: _Problem, route: np.ndarray, node: int, tries: int = 5) -> Optional[np.ndarray]:
+    """寄り道の少ない位置から順に入れてみて、時間に収まった最初の行程を返す"""
+    t = p.t
+    a, b = route[:-1], route[1:]
+    add = t[a, node] + t[node, b] - t[a, b]
+    for k in np.argsort(add, kind="stable")[:tries]:
+        candidate = np.insert(route, k + 1, node)
+        if p.schedule(candidate) is not None:
+            return candidate
+    return None
+
+
+def plan_itinerary(lat: Sequence[float], lng: Sequence[float], stay_min: Sequence[float],
+                   value: Sequence[float], start_min: float, budget_min: float,
+                   origin: Optional[Tuple[float, float]] = None,
+                   windows: Optional[Sequence[Optional[Tuple[float, float]]]] = None,
+                   time_limit_ms: float = TIME_LIMIT_MS) -> Itinerary:
+    """
+    スポットを回る順番を決める（起点から出て、戻らない1日の行程）。
+    最近傍法で作った順路を 2-opt / or-opt で縮め、start_min から budget_min 分に
+    収まらなければ価値（value）の低いものから外す。外した後に空いた時間へ入るものは入れ直す。
+    windows[i] は着いてよい時間帯 (開始, 終了)（0時からの分、None は制限なし）。
+    """
+    began = time.perf_counter()
+    deadline = began + time_limit_ms / 1000
+    n = len(lat)
+    end_min = min(start_min + budget_min, DAY_END_MIN)
+    earliest = np.full(n, start_min)
+    latest = np.full(n, end_min)
+    for i, window in enumerate(windows or []):
+        if window is not None:
+            earliest[i], latest[i] = max(window[0], start_min), min(window[1], end_min)
+
+    stay = np.asarray(stay_min, dtype=np.float64)
+    p = _Problem(
+        np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64), stay,
+        np.asarray(value, dtype=np.float64), earliest, latest, start_min, end_min, origin,
+    )
+    # 1か所だけでも入らないもの（滞在が長すぎる・時間帯が合わない）は最初から外す
+    fits = (earliest + stay <= end_min) & (earliest <= latest)
+    dropped = [int(i) for i in np.flatnonzero(~fits)]
+    route = _improve(p, _nearest_neighbor(p, np.flatnonzero(fits).tolist()), deadline)
+
+    # 収まるまで外す（順路の縮め直しは外し終わってから1回だけ）
+    while len(route) > 2 and p.schedule(route) is None:
+        route, node = _drop_one(p, route)
+        dropped.append(node)
+    # 2-opt / or-opt は移動時間しか見ないので、縮めた結果が時間帯に合わなければ外し終えた順路のままにする
+    improved = _fill_waits(p, _improve(p, route.copy(), deadline))
+    if p.schedule(improved) is not None:
+        route = improved
+
+    # 外したものを価値の高い順に入れ直してみる
+    for node in sorted(dropped, key=lambda i: -p.value[i]):
+        if time.perf_counter() >= deadline:
+            break
+        if not fits[node]:
+            continue
+        inserted = _insert(p, route, node)
+        if inserted is not None:
+            route = inserted
+            dropped.remove(node)
+
+    rows = p.schedule(route) or []
+    stops = [Stop(int(node), arrive, depart, move) for node, (arrive, depart, move) in zip(route[1:], rows)]
+    return Itinerary(
+        stops=stops,
+        dropped=dropped,
+        start_min=start_min,
+        end_min=stops[-1].depart_min if stops else start_min,
+        travel_min=sum(s.travel_min for s in stops),
+        solve_ms=(time.perf_counter() - began) * 1000,
+    )
+
+
+def plan_spots(spots: Sequence[Spot], start_min: float, budget_min: float,
+               origin: Optional[Tuple[float, float]] = None,
+               time_limit_ms: float = TIME_LIMIT_MS) -> Itinerary:
+    """Spot の並び（順位順）から行程を作る。価値は total_score、飲食店は RESTAURANT_HOURS に着く"""
+    stay = [s.stay_time_minutes or DEFAULT_STAY_MIN.get(s.spot_type, 60) for s in spots]
+    # 同点なら順位が上のものを残す
+    value = [(s.total_score or 0.0) + 1.0 - i / (len(spots) + 1) for i, s in enumerate(spots)]
+    windows = [RESTAURANT_HOURS if s.spot_type == "restaurant" else None for s in spots]
+    return plan_itinerary(
+        [s.lat for s in spots], [s.lng for s in spots], stay, value,
+        start_min=start_min, budget_min=budget_min, origin=origin, windows=windows,
+        time_limit_ms=time_limit_ms,
+    )
+
+
+def format_clock(minutes: float) -> str:
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_clock(text: str) -> int:
+    """ "10:30" → 630（時 0〜23・分 0〜59 の数字だけ。不正なら ValueError）"""
+    hours, sep, mins = text.strip().partition(":")
+    if not hours.isdigit() or (sep and not mins.isdigit()):
+        raise ValueError(f"bad time: {text}")
+    h, m = int(hours), int(mins or 0)
+    if not (0 <= h < 24 and 0 <= m < 60):
+        raise ValueError(f"bad time: {text}")
+    return h * 60 + m
@@ -0,0 +1,244 @@
+# matching.py
+import asyncio
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cache import TTLCache, MISSING
+from rate_limiter import QuotaExceeded
+import metrics
+from scoring_batch import haversine_km_array, haversine_km_matrix
+from spot import Spot, haversine_km
+
+# ---- Hotpepper の店 → Google の place_id の突き合わせ ----
+# 店ごとに FindPlace を呼ぶ代わりに、近くに固まっている店ごとに Nearby Search（rankby=distance、
+# 近い順に20件）を1回投げ、店名の近さと距離で手元で突き合わせる（合わなかった店だけ FindPlace に回す）。
+# 半径で探すと人気順の上位20件しか返らず、広い範囲では対象の店がほとんど入らないため、近い順で探す。
+
+MATCH_PLACE_TYPE = "restaurant"
+MATCH_MAX_DISTANCE_KM = 0.25     # これより離れていれば別の店とみなす
+MATCH_MIN_SIMILARITY = 0.75      # 正規化した店名の類似度（0〜1）の下限（「ラーメン ○○」どうしは 0.67 前後）
+MATCH_CLUSTER_RADIUS_M = 120     # 1回の検索（中心の店から近い順20件）でまとめて探す店の範囲
+MATCH_MAX_SEARCHES = 4           # 1回の突き合わせで投げる Nearby Search の上限（残りの店は FindPlace）
+
+# 括弧書き（「（旧 ○○）」「[禁煙]」など）は店名の比較に使わない
+_BRACKETS = re.compile(r"[(\[（［【〔「『].*?[)\]）］】〕」』]")
+
+
+def normalize_shop_name(name: str) -> str:
+    """
+    店名の比較用の形（全角半角・大文字小文字・空白・記号・括弧書きの違いを無くす）。
+    例: 「麺屋 はなび　名駅店（旧店舗）」→「麺屋はなび名駅店」
+    """
+    text = unicodedata.normalize("NFKC", name or "").lower()
+    text = _BRACKETS.sub("", text)
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def name_similarity(a: str, b: str) -> float:
+    """
+    正規化した店名どうしの類似度（0〜1）。
+    片方がもう片方に含まれる（支店名の有無など）ときは高めに見る。
+    """
+    a, b = normalize_shop_name(a), normalize_shop_name(b)
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    ratio = SequenceMatcher(None, a, b).ratio()
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    if len(shorter) >= 3 and shorter in longer:
+        ratio = max(ratio, 0.85)
+    return ratio
+
+
+def match_shops(hp_spots: List[Spot], candidates: List[Spot],
+                max_distance_km: float = MATCH_MAX_DISTANCE_KM,
+                min_similarity: float = MATCH_MIN_SIMILARITY) -> Dict[int, Spot]:
+    """
+    Hotpepper の店（hp_spots）と Nearby Search の結果（candidates）を突き合わせる。
+    戻り値は {hp_spots の添字: 対応する candidates の Spot}。1つの place_id は1店にしか
+    割り当てない（店名の近さ → 距離の順に良い組から決める）。
+    """
+    pairs: List[Tuple[float, float, int, int]] = []
+    for i, hp in enumerate(hp_spots):
+        if not hp.lat and not hp.lng:
+            continue
+        for j, cand in enumerate(candidates):
+            if not cand.place_id:
+                continue
+            dist = haversine_km(hp.lat, hp.lng, cand.lat, cand.lng)
+            if dist > max_distance_km:
+                continue
+            sim = name_similarity(hp.name, cand.name)
+            if sim < min_similarity:
+                continue
+            pairs.append((sim, -dist, i, j))
+
+    pairs.sort(key=lambda p: (-p[0], -p[1], p[2], p[3]))
+    matched: Dict[int, Spot] = {}
+    used = set()
+    for _, _, i, j in pairs:
+        place_id = candidates[j].place_id
+        if i in matched or place_id in used:
+            continue
+        matched[i] = candidates[j]
+        used.add(place_id)
+    return matched
+
+
+def shop_clusters(hp_spots: List[Spot], origin: Optional[Tuple[float, float]] = None,
+                  radius_m: float = MATCH_CLUSTER_RADIUS_M,
+                  max_searches: int = MATCH_MAX_SEARCHES) -> List[Tuple[float, float, List[int]]]:
+    """
+    突き合わせ用の Nearby Search の中心 [(緯度, 経度, その検索で探す hp_spots の添字)]。
+    まだ入っていない店をいちばん多く radius_m 内に含む店を中心に選ぶことを max_searches 回まで繰り返す
+    （同数なら origin に近い方。origin が無ければ入力順で先の方）。どこにも入らなかった店は FindPlace に回る。
+    """
+    located = [i for i, s in enumerate(hp_spots) if s.lat or s.lng]
+    if not located:
+        return []
+    lat = np.array([hp_spots[i].lat for i in located])
+    lng = np.array([hp_spots[i].lng for i in located])
+    near = haversine_km_matrix(lat, lng) <= radius_m / 1000
+    if origin is not None:
+        tie = haversine_km_array(origin[0], origin[1], lat, lng)
+    else:
+        tie = np.arange(len(located), dtype=np.float64)
+
+    left = np.ones(len(located), dtype=bool)
+    clusters = []
+    while left.any() and len(clusters) < max_searches:
+        covers = (near & left[None, :]).sum(axis=1)
+        covers[~left] = 0
+        best = int(np.lexsort((tie, -covers))[0])
+        members = np.flatnonzero(near[best] & left)
+        left[members] = False
+        clusters.append((float(lat[best]), float(lng[best]), [located[j] for j in members]))
+    return clusters
+
+
+# 突き合わせの結果：(place_id, Nearby Search での要約 Spot)。保存済みの対応から決まったときは要約なし
+ShopMatch = Tuple[str, Optional[Spot]]
+
+
+class ShopMatcher:
+    """
+    Hotpepper の店 → Google の place_id を決める。
+    一度決まった対応（hotpepper_id → place_id）は place_map に保存して使い回す
+    （SqliteBackend 付きの TTLCache なら再起動後も残る）。
+    """
+
+    def __init__(self, place_map: Optional[TTLCache] = None,
+                 max_distance_km: float = MATCH_MAX_DISTANCE_KM,
+                 min_similarity: float = MATCH_MIN_SIMILARITY):
+        self.place_map = place_map
+        self.max_distance_km = max_distance_km
+        self.min_similarity = min_similarity
+
+    @staticmethod
+    def _map_key(hp: Spot) -> Optional[str]:
+        return f"hp:{hp.hotpepper_id}" if hp.hotpepper_id else None
+
+    def known(self, hp_spots: List[Spot]) -> Dict[int, ShopMatch]:
+        """保存済みの対応だけで決まる店。"""
+        found: Dict[int, ShopMatch] = {}
+        if self.place_map is None:
+            return found
+        for i, hp in enumerate(hp_spots):
+            key = self._map_key(hp)
+            if key is None:
+                continue
+            place_id = self.place_map.get(key)
+            if place_id is not MISSING and place_id:
+                found[i] = (place_id, None)
+        return found
+
+    def remember(self, hp: Spot, place_id: str) -> None:
+        key = self._map_key(hp)
+        if key is not None and place_id and self.place_map is not None:
+            self.place_map.set(key, place_id)
+
+    def match(self, hp_spots: List[Spot], candidates: List[Spot]) -> Dict[int, ShopMatch]:
+        matched = match_shops(hp_spots, candidates, self.max_distance_km, self.min_similarity)
+        for i, cand in matched.items():
+            self.remember(hp_spots[i], cand.place_id)
+        return {i: (cand.place_id, cand) for i, cand in matched.items()}
+
+    def _plan(self, hp_spots: List[Spot], origin) -> Tuple[Dict[int, ShopMatch], List[int], list]:
+        resolved = self.known(hp_spots)
+        if resolved:
+            metrics.count("match.known", len(resolved))
+        todo = [i for i in range(len(hp_spots)) if i not in resolved]
+        clusters = shop_clusters([hp_spots[i] for i in todo], origin) if todo else []
+        return resolved, todo, clusters
+
+    def _finish(self, hp_spots: List[Spot], resolved: Dict[int, ShopMatch], todo: List[int],
+                candidates: List[Spot]) -> Dict[int, ShopMatch]:
+        matched = self.match([hp_spots[i] for i in todo], candidates)
+        for j, found in matched.items():
+            resolved[todo[j]] = found
+        if matched:
+            metrics.count("match.nearby", len(matched))
+        unmatched = len(todo) - len(matched)
+        if unmatched:
+            metrics.count("match.fallback", unmatched)
+        return resolved
+
+    def resolve(self, google_client, hp_spots: List[Spot],
+                origin: Optional[Tuple[float, float]] = None) -> Dict[int, ShopMatch]:
+        """
+        {hp_spots の添字: (place_id, 要約)}。保存済みの対応 → 店の固まりごとの Nearby Search
+        （並列）での突き合わせの順に決める。ここで決まらなかった店は呼び出し側で FindPlace する。
+        """
+        resolved, todo, clusters = self._plan(hp_spots, origin)
+        if not clusters:
+            return resolved
+
+        def search(lat: float, lng: float) -> List[Spot]:
+            found: List[Spot] = []
+            for page in google_client.iter_nearby_pages(lat, lng, MATCH_PLACE_TYPE, max_pages=1,
+                                                        rankby="distance"):
+                found.extend(page)
+            return found
+
+        candidates: List[Spot] = []
+        with ThreadPoolExecutor(max_workers=len(clusters), thread_name_prefix="match") as pool:
+            futures = [pool.submit(metrics.bind(search), lat, lng) for lat, lng, _ in clusters]
+            for fut in futures:
+                try:
+                    candidates.extend(fut.result())
+                except QuotaExceeded as e:
+                    print("QUOTA:", e)
+                except Exception as e:
+                    print("MATCH_ERROR:", e)
+        return self._finish(hp_spots, resolved, todo, candidates)
+
+    async def resolve_async(self, google_client, hp_spots: List[Spot],
+                            origin: Optional[Tuple[float, float]] = None) -> Dict[int, ShopMatch]:
+        """resolve の非同期版（google_client は AsyncGooglePlacesClient）。"""
+        resolved, todo, clusters = self._plan(hp_spots, origin)
+        if not clusters:
+            return resolved
+
+        async def search(lat: float, lng: float) -> List[Spot]:
+            found: List[Spot] = []
+            async for page in google_client.iter_nearby_pages(lat, lng, MATCH_PLACE_TYPE, max_pages=1,
+                                                              rankby="distance"):
+                found.extend(page)
+            return found
+
+        candidates: List[Spot] = []
+        results = await asyncio.gather(*(search(lat, lng) for lat, lng, _ in clusters), return_exceptions=True)
+        for result in results:
+            if isinstance(result, QuotaExceeded):
+                print("QUOTA:", result)
+            elif isinstance(result, Exception):
+                print("MATCH_ERROR:", result)
+            else:
+                candidates.extend(result)
+        return self._finish(hp_spots, resolved, todo, candidates)
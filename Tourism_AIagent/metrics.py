@@ -0,0 +1,279 @@
+# metrics.py
+import bisect
+import contextvars
+import functools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# レイテンシのヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # 最後は +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    プロセス内のカウンタとヒストグラム（Prometheus のテキスト形式で出力できる）。
+    prometheus_client には依存しない。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}    # name → (type, help)
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(buckets)
+            hist.observe(value)
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple]]) -> None:
+        """
+        出力のたびに呼ぶ関数を登録する（キャッシュのヒット数など、他で数えている値用）。
+        collector は (name, type, help, [(labels dict, value), ...]) を返す。
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: (list(h.counts), h.sum, h.buckets) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+
+        for name in sorted(counters):
+            header(name, "counter", self._help.get(name, ("", ""))[1])
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        for name in sorted(histograms):
+            header(name, "histogram", self._help.get(name, ("", ""))[1])
+            for key, (counts, total, buckets) in sorted(histograms[name].items()):
+                cumulative = 0
+                for le, n in zip(list(buckets) + [float("inf")], counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', _format_value(le)))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total!r}")
+                lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print("METRICS_COLLECTOR_ERROR:", e)
+                continue
+            for name, kind, help_text, samples in families:
+                header(name, kind, help_text)
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REGISTRY.describe("tourism_stage_seconds", "histogram", "Time spent in each stage of a request.")
+REGISTRY.describe("tourism_stage_errors_total", "counter", "Stages that ended with an exception.")
+REGISTRY.describe("tourism_events_total", "counter", "Counted events such as cache hits and misses.")
+REGISTRY.describe("tourism_http_request_seconds", "histogram", "Request latency per Flask endpoint.")
+REGISTRY.describe("tourism_http_requests_total", "counter", "Requests per Flask endpoint and status.")
+
+
+# ---- リクエスト単位のトレース ----
+
+class Trace:
+    """
+    1リクエスト（または1つのバックグラウンド検索）分の段階ごとの時間と件数。
+    スレッドプールの中からも書き込まれるのでロックで守る。
+    """
+
+    def __init__(self, kind: str, trace_id: Optional[str] = None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.started = time.perf_counter()
+        self._stages: Dict[str, List[float]] = {}   # stage → [回数, 合計ms, エラー数]
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float, error: bool) -> None:
+        with self._lock:
+            s = self._stages.setdefault(stage, [0, 0.0, 0])
+            s[0] += 1
+            s[1] += seconds * 1000
+            s[2] += int(error)
+
+    def count(self, event: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + amount
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {"n": int(n), "ms": round(ms, 1), **({"errors": int(err)} if err else {})}
+                for name, (n, ms, err) in self._stages.items()
+            }
+            counts = dict(self._counts)
+        return {
+            "trace_id": self.id,
+            "kind": self.kind,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": stages,
+            "counts": counts,
+        }
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def start_trace(kind: str, trace_id: Optional[str] = None):
+    """新しい Trace を現在のコンテキストに設定し、(Trace, 戻すためのトークン) を返す。"""
+    trace = Trace(kind, trace_id)
+    return trace, _current.set(trace)
+
+
+def end_trace(token, log: bool = True, **fields) -> Optional[dict]:
+    """Trace を外し、構造化ログ（JSON 1行）を出力する。記録した内容を返す。"""
+    trace = _current.get()
+    try:
+        _current.reset(token)
+    except ValueError:
+        # 別のコンテキストで作られたトークン（念のため）
+        _current.set(None)
+    if trace is None:
+        return None
+    record = {"event": "trace", **trace.to_dict(), **fields}
+    if log:
+        print(json.dumps(record, ensure_ascii=False))
+    return record
+
+
+@contextmanager
+def traced(kind: str, trace_id: Optional[str] = None, **fields):
+    """with の範囲を1つの Trace として記録し、終わったらログに出す。"""
+    trace, token = start_trace(kind, trace_id)
+    error = None
+    try:
+        yield trace
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        end_trace(token, **fields, **({"error": error} if error else {}))
+
+
+@contextmanager
+def span(stage: str):
+    """処理1段階分の時間を計る（ヒストグラムと、あれば現在の Trace に記録）。"""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        REGISTRY.observe("tourism_stage_seconds", elapsed, stage=stage)
+        if error:
+            REGISTRY.inc("tourism_stage_errors_total", stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.add_stage(stage, elapsed, error)
+
+
+def timed(stage: str):
+    """関数全体を span で囲むデコレータ。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(event: str, amount: int = 1) -> None:
+    """キャッシュのヒットなどの件数を数える（全体のカウンタと現在の Trace の両方）。"""
+    REGISTRY.inc("tourism_events_total", amount, event=event)
+    trace = _current.get()
+    if trace is not None:
+        trace.count(event, amount)
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    呼び出し時点のコンテキスト（Trace）を引き継いで fn を実行する関数を返す。
+    ThreadPoolExecutor.submit に渡す前に包むと、ワーカー側の span も同じ Trace に入る。
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,188 @@
+# photo_cache.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 64 * 1024
+
+
+def photo_cache_key(img_url: str, variant: str = "") -> str:
+    """
+    画像URL → キャッシュキー。
+    Google Photo API は photo_reference + maxwidth で中身が決まるので、それをキーにする
+    （API キーなどは含めない）。それ以外の URL はクエリごとハッシュする。
+    variant には縮小・形式変換した派生画像の種類（例: "webp@480"）を入れる。
+    """
+    u = urlparse(img_url)
+    qs = parse_qs(u.query)
+    ref = (qs.get("photo_reference") or qs.get("photoreference") or [""])[0]
+    if ref:
+        width = (qs.get("maxwidth") or [""])[0]
+        raw = f"ref:{ref}|w:{width}"
+    else:
+        raw = f"url:{u.hostname}{u.path}?{u.query}"
+    if variant:
+        raw += f"|v:{variant}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PhotoCache:
+    """
+    画像のディスクキャッシュ。
+    - root/ab/<key>.bin に本体、root/ab/<key>.json にメタ情報（Content-Type 等）
+    - 合計サイズが max_bytes を超えたら、古く使われたもの（mtime 順）から削除
+    """
+
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._approx_bytes = self._scan_total()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        d = os.path.join(self.root, key[:2])
+        return os.path.join(d, key + ".bin"), os.path.join(d, key + ".json")
+
+    def lookup(self, key: str) -> Optional[Tuple[str, dict]]:
+        """(本体パス, メタ情報) を返す。無ければ None。"""
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            # 使われた時刻を更新（追い出しの LRU 判定に使う）
+            now = time.time()
+            os.utime(body_path, (now, now))
+        except (OSError, ValueError):
+            return None
+        return body_path, meta
+
+    def open_writer(self, key: str, content_type: str) -> "PhotoCacheWriter":
+        """
+        少しずつ書き込んでから確定するための書き込み口（非同期の応答からも使う）。
+        commit() を呼ぶまではキャッシュに見えない。
+        """
+        return PhotoCacheWriter(self, key, content_type)
+
+    def store_stream(self, key: str, chunks: Iterable[bytes], content_type: str) -> Iterator[bytes]:
+        """
+        上流からのチャンクをそのまま流しつつ、一時ファイルに書き込む。
+        最後まで読み切れたときだけキャッシュとして確定する（途中切断なら捨てる）。
+        """
+        writer = self.open_writer(key, content_type)
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                writer.write(chunk)
+                yield chunk
+            writer.commit()
+        finally:
+            writer.abort()
+
+    def store_bytes(self, key: str, data: bytes, content_type: str) -> None:
+        for _ in self.store_stream(key, [data], content_type):
+            pass
+
+    def read_bytes(self, key: str) -> Optional[Tuple[bytes, str]]:
+        found = self.lookup(key)
+        if found is None:
+            return None
+        body_path, meta = found
+        try:
+            with open(body_path, "rb") as f:
+                return f.read(), meta.get("content_type", "image/jpeg")
+        except OSError:
+            return None
+
+    # ---- サイズ上限と追い出し ----
+
+    def _scan(self):
+        entries = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith(".bin"):
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue  # 別ワーカーが消した直後など
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def _scan_total(self) -> int:
+        return sum(size for _, size, _ in self._scan())
+
+    def _account(self, added: int) -> None:
+        with self._lock:
+            self._approx_bytes += added
+            if self._approx_bytes <= self.max_bytes:
+                return
+            self._evict()
+
+    def _evict(self) -> None:
+        # 他ワーカーの書き込み分もあるので、実際のディスクを見直してから消す
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            for p in (path, path[:-4] + ".json"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+        self._approx_bytes = total
+
+
+class PhotoCacheWriter:
+    """一時ファイルに書き込み、commit() で本体とメタ情報を置き換える。"""
+
+    def __init__(self, cache: PhotoCache, key: str, content_type: str):
+        self.cache = cache
+        self.content_type = content_type
+        self.body_path, self.meta_path = cache._paths(key)
+        os.makedirs(os.path.dirname(self.body_path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.body_path), suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self.size = 0
+        self.done = False
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> None:
+        if self.done:
+            return
+        self._file.close()
+        meta = {
+            "content_type": self.content_type,
+            "size": self.size,
+            "stored_at": time.time(),
+        }
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self.tmp_path, self.body_path)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+        self.done = True
+        self.cache._account(self.size)
+
+    def abort(self) -> None:
+        """確定していなければ一時ファイルを捨てる（commit 後に呼んでも何もしない）。"""
+        if self.done:
+            return
+        self.done = True
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,180 @@
+# prewarm.py
+"""
+人気の駅 × 全ジャンルを先に検索して、アプリのキャッシュを温めておくバッチ。
+
+    python prewarm.py --stations 名古屋駅 東京駅 --concurrency 4 --rate 2
+
+- 候補取得・Place Details・駅の座標・写真（カード表示と同じ縮小版）を取得する
+- 温まるのはプロセスをまたいで残るもの：
+  PLACES_CACHE_DB（SQLite）、STATIONS_FILE（駅名表）、PHOTO_CACHE_DIR（写真）
+- 終わった組み合わせは --state のファイルに記録し、再実行時は飛ばす（途中から再開できる）
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Set
+
+import app
+from spot import Spot
+
+
+class _RateLimiter:
+    """タスクの開始間隔を 1/rate 秒以上あける（全スレッド共通）。"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def load_station_names(path: str) -> List[str]:
+    names = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[0].startswith("#") or row[0] == "name":
+                continue
+            names.append(row[0])
+    return names
+
+
+def load_done(path: str) -> Set[str]:
+    done = set()
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["task"])
+                except (ValueError, KeyError):
+                    continue
+    return done
+
+
+def build_tasks(stations: List[str], categories: List[str]) -> List[dict]:
+    tasks = []
+    for station in stations:
+        for category in categories:
+            genres = app.RESTAURANT_GENRES if category == "restaurant" else app.PLACE_GENRES
+            for genre_key in genres:
+                tasks.append({
+                    "category": category,
+                    "genre": genre_key,
+                    "priority": "balance",   # 候補の取得は優先度に依存しない
+                    "station": station,
+                    "search_mode": "station",
+                    "radius": "1000",
+                })
+    return tasks
+
+
+def task_key(form: dict) -> str:
+    return f"{form['station']}|{form['category']}|{form['genre']}|{form['radius']}"
+
+
+def warm_photos(spots: List[Spot], client) -> int:
+    """カードと同じ URL（縮小版・WebP 優先）で /photo を叩いてディスクキャッシュに入れる。"""
+    warmed = 0
+    for spot in spots:
+        if not spot.image_url:
+            continue
+        for dpr in (1, 2):
+            resp = client.get(
+                "/photo",
+                query_string={"url": spot.image_url, "w": 480, "dpr": dpr},
+                headers={"Accept": "image/avif,image/webp,image/*"},
+            )
+            resp.close()
+            if resp.status_code == 200:
+                warmed += 1
+    return warmed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="人気の駅 × ジャンルでキャッシュを温める")
+    parser.add_argument("--stations", nargs="*", help="駅名（省略時は --stations-file の全駅）")
+    parser.add_argument("--stations-file", default=app.STATIONS_FILE, help="name,lat,lng 形式の CSV")
+    parser.add_argument("--category", choices=["restaurant", "place", "all"], default="all")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行する検索数")
+    parser.add_argument("--rate", type=float, default=1.0, help="1秒あたりに開始する検索数の上限")
+    parser.add_argument("--no-photos", action="store_true", help="写真は取得しない")
+    parser.add_argument("--state", default="prewarm_state.jsonl", help="再開用の進捗ファイル")
+    parser.add_argument("--reset", action="store_true", help="進捗ファイルを無視して最初からやり直す")
+    args = parser.parse_args(argv)
+
+    if not app.PLACES_CACHE_DB:
+        print("WARNING: PLACES_CACHE_DB が未設定なので、Place Details はこのプロセス内にしか残りません。")
+
+    stations = args.stations or load_station_names(args.stations_file)
+    categories = ["restaurant", "place"] if args.category == "all" else [args.category]
+    tasks = build_tasks(stations, categories)
+
+    if args.reset and os.path.exists(args.state):
+        os.remove(args.state)
+    done = load_done(args.state)
+    pending = [t for t in tasks if task_key(t) not in done]
+    print(f"prewarm: {len(tasks)} tasks, {len(tasks) - len(pending)} already done, {len(pending)} to run")
+
+    limiter = _RateLimiter(args.rate)
+    state_lock = threading.Lock()
+    counts = {"ok": 0, "failed": 0, "spots": 0, "photos": 0}
+    started = time.monotonic()
+
+    def run(form: dict) -> str:
+        limiter.wait()
+        t0 = time.monotonic()
+        params, error = app.read_search_form(form)
+        if error:
+            raise ValueError(error)
+        spots = app.search_ranked_spots(params)
+        photos = 0
+        if not args.no_photos:
+            with app.app.test_client() as client:
+                photos = warm_photos(spots, client)
+        with state_lock:
+            counts["spots"] += len(spots)
+            counts["photos"] += photos
+            with open(args.state, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"task": task_key(form), "spots": len(spots), "at": time.time()},
+                                   ensure_ascii=False) + "\n")
+        return f"{len(spots)} spots, {photos} photos ({time.monotonic() - t0:.1f}s)"
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = {pool.submit(run, t): t for t in pending}
+        for i, fut in enumerate(as_completed(futures), 1):
+            form = futures[fut]
+            label = f"[{i}/{len(pending)}] {form['station']} {form['category']}/{form['genre']}"
+            try:
+                print(f"{label}: {fut.result()}")
+                counts["ok"] += 1
+            except Exception as e:
+                print(f"{label}: FAILED {e}")
+                counts["failed"] += 1
+
+    elapsed = time.monotonic() - started
+    print(
+        f"prewarm finished in {elapsed:.1f}s: {counts['ok']} ok, {counts['failed']} failed, "
+        f"{counts['spots']} spots, {counts['photos']} photos"
+    )
+    print("places cache:", json.dumps({
+        "place_id": app.place_id_cache.stats(),
+        "details": app.details_cache.stats(),
+    }))
+    print("api quota:", json.dumps(app.api_quota.stats()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
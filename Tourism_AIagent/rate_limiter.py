@@ -0,0 +1,213 @@
+# rate_limiter.py
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from cache import LocalConnection
+
+
+@dataclass(frozen=True)
+class EndpointLimit:
+    rate_per_sec: float      # 平均で許す呼び出し回数/秒
+    burst: float             # 一度に使える上限（バケツの大きさ）
+    cost_per_1000: float     # 1000回あたりの概算料金（USD）
+
+
+# エンドポイントごとの既定値（料金は Google Maps Platform の公開単価からの概算）
+DEFAULT_LIMITS: Dict[str, EndpointLimit] = {
+    "geocode": EndpointLimit(rate_per_sec=10, burst=20, cost_per_1000=5.0),
+    "nearby": EndpointLimit(rate_per_sec=10, burst=20, cost_per_1000=32.0),
+    "find_place": EndpointLimit(rate_per_sec=20, burst=40, cost_per_1000=17.0),
+    "details": EndpointLimit(rate_per_sec=20, burst=40, cost_per_1000=17.0),
+    "photo": EndpointLimit(rate_per_sec=30, burst=60, cost_per_1000=7.0),
+    "hotpepper": EndpointLimit(rate_per_sec=5, burst=10, cost_per_1000=0.0),
+}
+
+# 429 / OVER_QUERY_LIMIT を受けたら、このくらいの時間は新しい呼び出しを控える
+OVER_LIMIT_BACKOFF_SEC = 2.0
+
+COUNTER_FIELDS = ("calls", "denied", "over_limit", "wait_ms")
+
+
+class QuotaExceeded(RuntimeError):
+    """レート上限で呼び出しを見送ったとき（または上流が OVER_QUERY_LIMIT を返したとき）。"""
+
+
+class MemoryQuotaStore:
+    """プロセス内だけで共有するバケツと集計。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, list] = {}   # endpoint → [tokens, updated_at]
+        self._counters: Dict[str, Dict[str, float]] = {}
+
+    def take(self, endpoint: str, limit: EndpointLimit, now: float) -> float:
+        """トークンを1つ取れたら 0、取れなければ空くまでの目安秒数を返す。"""
+        with self._lock:
+            tokens, updated_at = self._buckets.get(endpoint, [limit.burst, now])
+            tokens = min(limit.burst, tokens + (now - updated_at) * limit.rate_per_sec)
+            if tokens >= 1:
+                self._buckets[endpoint] = [tokens - 1, now]
+                return 0.0
+            self._buckets[endpoint] = [tokens, now]
+            return (1 - tokens) / limit.rate_per_sec
+
+    def drain(self, endpoint: str, limit: EndpointLimit, now: float) -> None:
+        with self._lock:
+            self._buckets[endpoint] = [-limit.rate_per_sec * OVER_LIMIT_BACKOFF_SEC, now]
+
+    def incr(self, endpoint: str, field: str, amount: float = 1) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, dict.fromkeys(COUNTER_FIELDS, 0))
+            counters[field] += amount
+
+    def counters(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {endpoint: dict(c) for endpoint, c in self._counters.items()}
+
+
+class SqliteQuotaStore:
+    """
+    SQLite ファイルでバケツと集計を共有する版（同じファイルを見る gunicorn ワーカー全体で1つの上限）。
+    接続はスレッドごと・プロセスごとに遅延して開く（cache.LocalConnection）。
+    """
+
+    def __init__(self, path: str):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = LocalConnection(path, (
+            "PRAGMA journal_mode=WAL",
+            "CREATE TABLE IF NOT EXISTS buckets (endpoint TEXT PRIMARY KEY, tokens REAL, updated_at REAL)",
+            "CREATE TABLE IF NOT EXISTS counters ("
+            " endpoint TEXT, field TEXT, value REAL, PRIMARY KEY (endpoint, field))",
+        ))
+
+    def take(self, endpoint: str, limit: EndpointLimit, now: float) -> float:
+        conn = self._conn.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE endpoint = ?", (endpoint,)
+            ).fetchone()
+            tokens, updated_at = row if row else (limit.burst, now)
+            tokens = min(limit.burst, tokens + max(0.0, now - updated_at) * limit.rate_per_sec)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / limit.rate_per_sec
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (endpoint, tokens, updated_at) VALUES (?, ?, ?)",
+                (endpoint, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def drain(self, endpoint: str, limit: EndpointLimit, now: float) -> None:
+        self._conn.get().execute(
+            "INSERT OR REPLACE INTO buckets (endpoint, tokens, updated_at) VALUES (?, ?, ?)",
+            (endpoint, -limit.rate_per_sec * OVER_LIMIT_BACKOFF_SEC, now),
+        )
+
+    def incr(self, endpoint: str, field: str, amount: float = 1) -> None:
+        self._conn.get().execute(
+            "INSERT INTO counters (endpoint, field, value) VALUES (?, ?, ?)"
+            " ON CONFLICT(endpoint, field) DO UPDATE SET value = value + excluded.value",
+            (endpoint, field, amount),
+        )
+
+    def counters(self) -> Dict[str, Dict[str, float]]:
+        rows = self._conn.get().execute("SELECT endpoint, field, value FROM counters").fetchall()
+        result: Dict[str, Dict[str, float]] = {}
+        for endpoint, field, value in rows:
+            result.setdefault(endpoint, dict.fromkeys(COUNTER_FIELDS, 0))[field] = value
+        return result
+
+
+class ApiQuota:
+    """
+    外部 API 呼び出しのレート制限（エンドポイントごとのトークンバケツ）と料金の集計。
+    上限に達したら max_wait_sec まで待ち、それでも空かなければ False を返す
+    （呼び出し側はエラーにせず、その結果なしで続ける）。
+    clock はバケツの補充に使う現在時刻（テストで差し替える用）。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, EndpointLimit]] = None, store=None,
+                 max_wait_sec: float = 1.0, clock: Callable[[], float] = time.time):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.store = store if store is not None else MemoryQuotaStore()
+        self.max_wait_sec = max_wait_sec
+        self.clock = clock
+
+    def acquire(self, endpoint: str, max_wait_sec: Optional[float] = None) -> bool:
+        """トークンを1つ取る。空くまで最大 max_wait_sec 待ち、取れなければ False。"""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return True
+        max_wait = self.max_wait_sec if max_wait_sec is None else max_wait_sec
+        started = time.monotonic()
+        while True:
+            wait = self.store.take(endpoint, limit, self.clock())
+            waited = time.monotonic() - started
+            if wait == 0:
+                self.store.incr(endpoint, "calls")
+                if waited > 0:
+                    self.store.incr(endpoint, "wait_ms", round(waited * 1000))
+                return True
+            if waited + wait > max_wait:
+                self.store.incr(endpoint, "denied")
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, endpoint: str, max_wait_sec: Optional[float] = None) -> bool:
+        """acquire の非同期版（待つ間もイベントループを止めない）。"""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return True
+        max_wait = self.max_wait_sec if max_wait_sec is None else max_wait_sec
+        started = time.monotonic()
+        while True:
+            wait = self.store.take(endpoint, limit, self.clock())
+            waited = time.monotonic() - started
+            if wait == 0:
+                self.store.incr(endpoint, "calls")
+                if waited > 0:
+                    self.store.incr(endpoint, "wait_ms", round(waited * 1000))
+                return True
+            if waited + wait > max_wait:
+                self.store.incr(endpoint, "denied")
+                return False
+            await asyncio.sleep(wait)
+
+    def record_over_limit(self, endpoint: str) -> None:
+        """上流から 429 / OVER_QUERY_LIMIT が返ったとき：バケツを空にしてしばらく控える。"""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return
+        self.store.drain(endpoint, limit, self.clock())
+        self.store.incr(endpoint, "over_limit")
+
+    def check_response(self, endpoint: str, resp) -> None:
+        """HTTP 429 が返っていたら記録して QuotaExceeded を投げる（リトライの嵐にしない）。"""
+        if resp.status_code == 429:
+            self.record_over_limit(endpoint)
+            resp.close()
+            raise QuotaExceeded(f"{endpoint}: 429 Too Many Requests")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        counters = self.store.counters()
+        result = {}
+        for endpoint, limit in self.limits.items():
+            c = counters.get(endpoint, dict.fromkeys(COUNTER_FIELDS, 0))
+            result[endpoint] = {
+                **c,
+                "estimated_cost_usd": round(c["calls"] * limit.cost_per_1000 / 1000, 4),
+            }
+        return result
@@ -1,10 +1,24 @@
 # reasoner.py
-from spot import Spot
+import abc
+import asyncio
+import hashlib
+import threading
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+from cache import MISSING, TTLCache
+from spot import Spot, ScoreBreakdown, spot_identity
+import metrics
+
+# (理由の文, 滞在時間[分])
+Reason = Tuple[str, int]
 
 
 def generate_reason_and_stay_time(spot: Spot) -> Spot:
     """
     本来は LLM に投げる関数。v1ではルールベースで簡易生成。
+    LLM（BatchReasoner）を使うときも先にこれで埋めておき、間に合わなかった分はこの文のままにする。
     """
     if spot.spot_type == "restaurant":
         stay = 60
@@ -14,9 +28,9 @@ def generate_reason_and_stay_time(spot: Spot) -> Spot:
     parts = [f"{spot.name} は {spot.address} にあるスポットです。"]
 
     if spot.spot_type == "restaurant":
-        bd = spot.score_breakdown or {}
-        b = bd.get("budget_score")
-        q = bd.get("quality_score")
+        bd = spot.score_breakdown or ScoreBreakdown()
+        b = bd.budget_score
+        q = bd.quality_score
         parts.append("飲食店として")
 
         if b is not None:
@@ -36,9 +50,9 @@ def generate_reason_and_stay_time(spot: Spot) -> Spot:
                 parts.append("基本的な設備情報が揃っているお店です。")
 
     else:
-        bd = spot.score_breakdown or {}
-        p = bd.get("popularity_score")
-        d_km = bd.get("distance_km")
+        bd = spot.score_breakdown or ScoreBreakdown()
+        p = bd.popularity_score
+        d_km = bd.distance_km
 
         if p is not None:
             if p >= 7:
@@ -59,3 +73,212 @@ def generate_reason_and_stay_time(spot: Spot) -> Spot:
     spot.stay_time_minutes = stay
     spot.reason = "".join(parts)
     return spot
+
+
+# ---- LLM などで理由文をまとめて作る ----
+
+def _reason_identity(spot: Spot) -> tuple:
+    # 送った後に詳細を取ると place_id・名前・座標が変わるので、Hotpepper の店は店舗IDで見る
+    # （ページに描くときのキーと、届いた文をしまうときのキーをそろえる）
+    if spot.hotpepper_id:
+        return ("hotpepper_id", spot.hotpepper_id)
+    return spot_identity(spot)
+
+
+def reason_key(spot: Spot) -> str:
+    """理由文のキャッシュキー（同じスポットでも採点の内訳が変われば別の文にする）"""
+    breakdown = spot.score_breakdown or ScoreBreakdown()
+    parts = [spot.spot_type, *_reason_identity(spot)]
+    parts += [f"{name}={round(value, 2)}" for name, value in breakdown.items()]
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def reason_request(spots: Sequence[Spot]) -> List[dict]:
+    """LLM に渡すスポットの情報（id は spots の添字）"""
+    items = []
+    for i, spot in enumerate(spots):
+        items.append({
+            "id": str(i),
+            "spot_type": spot.spot_type,
+            "name": spot.name,
+            "address": spot.address,
+            "genre": spot.genre,
+            "description": spot.description,
+            "rating": spot.rating,
+            "reviews_count": spot.reviews_count,
+            "budget_yen": spot.budget_yen or None,
+            "scores": dict((spot.score_breakdown or ScoreBreakdown()).items()),
+        })
+    return items
+
+
+def parse_reasons(data: dict, count: int) -> Dict[int, Reason]:
+    """{"results": [{"id", "reason", "stay_time_minutes"}]} → {添字: (理由, 滞在時間)}。形のおかしいものは捨てる"""
+    reasons = {}
+    for item in data.get("results") or []:
+        try:
+            i = int(item["id"])
+            text = str(item["reason"]).strip()
+            stay = int(item["stay_time_minutes"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= i < count and text and stay > 0:
+            reasons[i] = (text, stay)
+    return reasons
+
+
+class ReasonerBackend(abc.ABC):
+    """
+    理由文をまとめて作る先。generate(spots) は作れたスポットの分だけ {添字: (理由, 滞在時間)} を返す。
+    返さなかったスポットはルールベースの文（generate_reason_and_stay_time）のままになる。
+    """
+
+    name = "backend"
+
+    @abc.abstractmethod
+    def generate(self, spots: Sequence[Spot]) -> Dict[int, Reason]:
+        ...
+
+    async def generate_async(self, spots: Sequence[Spot]) -> Dict[int, Reason]:
+        # 非同期版が無い実装はスレッドで回す
+        return await asyncio.to_thread(self.generate, spots)
+
+
+class HttpReasonerBackend(ReasonerBackend):
+    """
+    JSON の HTTP エンドポイントに全スポットを1回で送る。
+    送るもの: {"model": ..., "spots": reason_request(spots)}
+    受け取るもの: {"results": [{"id": "0", "reason": "...", "stay_time_minutes": 90}, ...]}
+    （プロンプトの組み立てや LLM の呼び出しはエンドポイント側で行う）
+    """
+
+    name = "http"
+
+    def __init__(self, url: str, api_key: str = "", model: str = "", timeout_sec: float = 10.0):
+        self.url = url
+        self.model = model
+        self.timeout_sec = timeout_sec
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+
+    def _payload(self, spots: Sequence[Spot]) -> dict:
+        return {"model": self.model, "spots": reason_request(spots)}
+
+    def generate(self, spots: Sequence[Spot]) -> Dict[int, Reason]:
+        from http_session import http_post_json
+
+        with metrics.span("reason.llm"):
+            r = http_post_json(self.url, self._payload(spots), headers=self.headers, timeout=self.timeout_sec)
+        r.raise_for_status()
+        return parse_reasons(r.json(), len(spots))
+
+    async def generate_async(self, spots: Sequence[Spot]) -> Dict[int, Reason]:
+        from async_http import http_post_json_async
+
+        with metrics.span("reason.llm"):
+            r = await http_post_json_async(self.url, self._payload(spots), headers=self.headers,
+                                           timeout=self.timeout_sec)
+        r.raise_for_status()
+        return parse_reasons(r.json(), len(spots))
+
+
+def _apply_reason(spot: Spot, reason) -> None:
+    text, stay = reason
+    spot.reason = text
+    spot.stay_time_minutes = stay
+
+
+class BatchReasoner:
+    """
+    採点済みのスポット（上位 max_spots 件）の理由文をバックエンドに1回でまとめて頼む。
+    検索は待たない：ページはルールベースの文で先に返し、届いた文は reason_key ごとにキャッシュに入れて
+    ページから（/reasons で）取りに来てもらう。キャッシュにある分は送らずにその場で差し替える。
+    同時に頼めるのは max_in_flight 件まで。埋まっているときは送らずにルールベースの文のままにする。
+    """
+
+    def __init__(self, backend: ReasonerBackend, cache: TTLCache, max_spots: int = 60, max_in_flight: int = 4):
+        self.backend = backend
+        self.cache = cache
+        self.max_spots = max_spots
+        self.max_in_flight = max_in_flight
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="reason")
+        # プールのキューに溜めない（空きが無ければ送らない）
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._tasks = set()  # 非同期版で走っている呼び出し
+
+    def _from_cache(self, spots: Sequence[Spot]) -> Tuple[List[Spot], List[str]]:
+        """キャッシュにある分は差し替え、無い分 (spots, keys) を返す"""
+        misses, keys = [], []
+        for spot in spots[:self.max_spots]:
+            key = reason_key(spot)
+            cached = self.cache.get(key)
+            if cached is MISSING:
+                misses.append(spot)
+                keys.append(key)
+            else:
+                _apply_reason(spot, cached)
+                metrics.count("cache.reason.hit")
+        return misses, keys
+
+    def _store(self, keys: List[str], reasons: Dict[int, Reason]) -> None:
+        for i, reason in reasons.items():
+            self.cache.set(keys[i], list(reason))
+        metrics.count("reason.fallback", len(keys) - len(reasons))
+
+    def _fetch(self, spots: List[Spot], keys: List[str]) -> None:
+        try:
+            self._store(keys, self.backend.generate(spots))
+        except Exception as e:
+            print("REASONER_ERROR:", e)
+            metrics.count("reason.error")
+        finally:
+            self._slots.release()
+
+    def submit(self, spots: Sequence[Spot]) -> int:
+        """キャッシュにある分は差し替え、無い分は送るだけ送ってすぐ戻る（待たない）。送った件数"""
+        misses, keys = self._from_cache(spots)
+        if not misses:
+            return 0
+        if not self._slots.acquire(blocking=False):
+            metrics.count("reason.skipped", len(misses))
+            return 0
+        # バックエンドに渡すのはコピー（送った後に元の Spot が書き換わっても影響しない）
+        self._pool.submit(metrics.bind(self._fetch), [replace(s) for s in misses], keys)
+        return len(misses)
+
+    async def _fetch_async(self, spots: List[Spot], keys: List[str]) -> None:
+        try:
+            self._store(keys, await self.backend.generate_async(spots))
+        except Exception as e:
+            print("REASONER_ERROR:", e)
+            metrics.count("reason.error")
+
+    def submit_async(self, spots: Sequence[Spot]) -> int:
+        """submit の非同期版（イベントループの中から呼ぶ。タスクを作るだけで待たない）"""
+        misses, keys = self._from_cache(spots)
+        if not misses:
+            return 0
+        if len(self._tasks) >= self.max_in_flight:
+            metrics.count("reason.skipped", len(misses))
+            return 0
+        task = asyncio.ensure_future(self._fetch_async([replace(s) for s in misses], keys))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return len(misses)
+
+    def apply_cached(self, spots: Sequence[Spot]) -> int:
+        """届いている理由文だけを差し替える（送らない）。差し替えた件数"""
+        spots = spots[:self.max_spots]
+        misses, _ = self._from_cache(spots)
+        return len(spots) - len(misses)
+
+    def lookup(self, keys: Sequence[str]) -> Dict[str, Reason]:
+        """届いている理由文（reason_key → (理由, 滞在時間)）。まだのものは入れない"""
+        found = {}
+        for key in keys:
+            cached = self.cache.get(key)
+            if cached is not MISSING:
+                found[key] = tuple(cached)
+        return found
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.name, "max_in_flight": self.max_in_flight, "cache": self.cache.stats()}
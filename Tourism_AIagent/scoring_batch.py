@@ -0,0 +1,232 @@
+# scoring_batch.py
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from spot import Spot, ScoreBreakdown
+from spot_batch import SpotBatch, BREAKDOWN_COLUMNS, STRING_COLUMNS
+from scoring_place import PLACE_WEIGHTS, genre_keywords
+from scoring_restaurant import RESTAURANT_WEIGHTS, distance_score_fixed
+
+# 引数として受け付けるもの（Spot の並びは SpotBatch にしてから計算する）
+Spots = Union[Sequence[Spot], SpotBatch]
+
+EARTH_RADIUS_KM = 6371.0
+
+# popularity_score の段階（scoring_place.popularity_score と同じ境界）
+_RATING_EDGES = np.array([3.5, 4.0, 4.5])
+_RATING_TIERS = np.array([1, 3, 4, 5])
+_REVIEW_EDGES = np.array([100, 300, 1000])
+_REVIEW_BONUS = np.array([0, 1, 2, 3])
+
+# distance_score_km の段階（境界ちょうどは近い側に含める）
+_DISTANCE_EDGES = np.array([1.0, 3.0, 5.0, 10.0])
+_DISTANCE_TIERS = np.array([5, 4, 3, 2, 1])
+
+# walking_distance_score の段階（飲食用）
+_WALKING_EDGES = np.array([0.3, 0.5, 1.0, 2.0])
+
+# budget_score の段階（予算の上限、0 は不明）
+_BUDGET_EDGES = np.array([1000, 2000, 3000, 5000])
+_BUDGET_TIERS = np.array([5, 4, 3, 2, 1])
+
+
+@dataclass
+class BatchScores:
+    """
+    まとめて計算したスコア。
+    order は total の高い順のインデックス（同点は入力順のまま）。
+    """
+    total: np.ndarray
+    order: np.ndarray
+    components: Dict[str, np.ndarray] = field(default_factory=dict)
+    weights: Dict[str, float] = field(default_factory=dict)
+
+
+def haversine_km_array(lat1: float, lng1: float, lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    """1点 → 複数点の距離(km)をまとめて計算（spot.haversine_km のベクトル版）"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lng2 - lng1)
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def haversine_km_matrix(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """全点の組み合わせの距離(km)。(n, n) の対称行列で、対角は 0"""
+    phi = np.radians(lat)
+    lam = np.radians(lng)
+    dphi = phi[:, None] - phi[None, :]
+    dlambda = lam[:, None] - lam[None, :]
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(dlambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(np.maximum(1 - a, 0.0)))
+    return EARTH_RADIUS_KM * c
+
+
+def popularity_scores(ratings: np.ndarray, reviews: np.ndarray) -> np.ndarray:
+    """ratings は評価なしを NaN で表す"""
+    base = _RATING_TIERS[np.searchsorted(_RATING_EDGES, np.nan_to_num(ratings, nan=0.0), side="right")]
+    base = np.where(np.isnan(ratings), 2, base)
+    bonus = _REVIEW_BONUS[np.searchsorted(_REVIEW_EDGES, reviews, side="right")]
+    return base + bonus
+
+
+def distance_scores(distances_km: np.ndarray) -> np.ndarray:
+    return _DISTANCE_TIERS[np.searchsorted(_DISTANCE_EDGES, distances_km, side="left")]
+
+
+def walking_distance_scores(distances_km: np.ndarray) -> np.ndarray:
+    return _DISTANCE_TIERS[np.searchsorted(_WALKING_EDGES, distances_km, side="left")]
+
+
+def budget_scores(budget_yen: np.ndarray) -> np.ndarray:
+    scores = _BUDGET_TIERS[np.searchsorted(_BUDGET_EDGES, budget_yen, side="left")]
+    return np.where(budget_yen > 0, scores, 3)
+
+
+def quality_scores(batch: SpotBatch) -> np.ndarray:
+    """scoring_restaurant.quality_score のベクトル版"""
+    return (
+        batch.flag("private_room") * 2
+        + batch.flag("wifi")
+        + batch.flag("parking")
+        + (batch.desc_len >= 50)
+        + (batch.desc_len >= 120)
+    ).astype(np.int64)
+
+
+_TYPES = STRING_COLUMNS.index("place_types")
+
+
+def _as_batch(spots: Spots) -> SpotBatch:
+    return spots if isinstance(spots, SpotBatch) else SpotBatch.from_spots(spots)
+
+
+def _rank(total: np.ndarray) -> np.ndarray:
+    return np.argsort(-total, kind="stable")
+
+
+def score_places_batch(spots: Spots, user_priority: str,
+                       station_lat: float, station_lng: float,
+                       user_genre_keyword: Union[str, Sequence[str]]) -> BatchScores:
+    """
+    calc_place_scores をまとめて行う版。Spot は書き換えない（apply_batch_scores で反映）。
+    """
+    batch = _as_batch(spots)
+
+    # ジャンル一致は types の文字列ごとに1回だけ判定する（同じ組み合わせの Spot が多い）
+    keywords = genre_keywords(user_genre_keyword)
+    unique_types, inverse = np.unique(batch.text[:, _TYPES], return_inverse=True)
+    types_hit = np.fromiter(
+        (
+            any(k in (batch.strings.get(i) or "").replace(",", " ").lower() for k in keywords)
+            for i in unique_types.tolist()
+        ),
+        dtype=bool,
+        count=len(unique_types),
+    )
+    genre_hit = types_hit[inverse.reshape(-1)]
+
+    dist_km = haversine_km_array(station_lat, station_lng, batch.lat, batch.lng)
+    p = popularity_scores(batch.rating, np.maximum(batch.reviews_count, 0))
+    g = np.where(genre_hit, 3, 1)
+    d = distance_scores(dist_km)
+
+    w_p, w_g, w_d = PLACE_WEIGHTS.get(user_priority, PLACE_WEIGHTS["balance"])
+    total = p * w_p + g * w_g + d * w_d
+
+    return BatchScores(
+        total=total,
+        order=_rank(total),
+        components={
+            "popularity_score": p,
+            "genre_score": g,
+            "distance_score": d,
+            "distance_km": dist_km,
+        },
+        weights={
+            "weight_popularity": w_p,
+            "weight_genre": w_g,
+            "weight_distance": w_d,
+        },
+    )
+
+
+def score_restaurants_batch(spots: Spots, user_priority: str,
+                            origin: Optional[Tuple[float, float]] = None) -> BatchScores:
+    """
+    calc_restaurant_scores をまとめて行う版（予算・設備・距離・合計・並べ替えをすべて NumPy で）。
+    origin が無いとき・座標の無い店の距離スコアは固定値。
+    """
+    batch = _as_batch(spots)
+    n = len(batch)
+    b = budget_scores(batch.budget_yen)
+    q = quality_scores(batch)
+
+    components = {"budget_score": b, "quality_score": q}
+    if origin is not None:
+        dist_km = haversine_km_array(origin[0], origin[1], batch.lat, batch.lng)
+        located = (batch.lat != 0) | (batch.lng != 0)
+        d = np.where(located, walking_distance_scores(dist_km), distance_score_fixed())
+        components["distance_score"] = d
+        components["distance_km"] = np.where(located, dist_km, np.nan)
+    else:
+        d = np.full(n, distance_score_fixed(), dtype=np.int64)
+        components["distance_score"] = d
+
+    w_b, w_q, w_d = RESTAURANT_WEIGHTS.get(user_priority, RESTAURANT_WEIGHTS["balance"])
+    total = b * w_b + q * w_q + d * w_d
+
+    return BatchScores(
+        total=total,
+        order=_rank(total),
+        components=components,
+        weights={
+            "weight_budget": w_b,
+            "weight_quality": w_q,
+            "weight_distance": w_d,
+        },
+    )
+
+
+def apply_batch_scores(spots: Spots, scores: BatchScores) -> Spots:
+    """
+    BatchScores を各 Spot の total_score / score_breakdown に書き戻し、
+    スコア順に並べたリストを返す（calc_*_scores → sort と同じ結果）。
+    SpotBatch のときは元の列は書き換えず、スコアを入れて並べ替えた新しい SpotBatch を返す。
+    """
+    if isinstance(spots, SpotBatch):
+        return _apply_to_batch(spots, scores)
+
+    for i, spot in enumerate(spots):
+        breakdown = ScoreBreakdown(**scores.weights)
+        for name, values in scores.components.items():
+            if name == "distance_km":
+                if not np.isnan(values[i]):
+                    breakdown.distance_km = round(float(values[i]), 2)
+            else:
+                setattr(breakdown, name, int(values[i]))
+        spot.score_breakdown = breakdown
+        spot.total_score = float(scores.total[i])
+    return [spots[i] for i in scores.order]
+
+
+def _apply_to_batch(batch: SpotBatch, scores: BatchScores) -> SpotBatch:
+    # 元の batch（キャッシュ・スナップショットの読み取り専用の列のこともある）は書き換えず、
+    # 並べ替えたコピーに書き込む
+    ranked = batch.take(scores.order)
+    breakdown = np.full((len(batch), len(BREAKDOWN_COLUMNS)), np.nan)
+    for name, values in scores.components.items():
+        column = values.round(2) if name == "distance_km" else values
+        breakdown[:, BREAKDOWN_COLUMNS.index(name)] = column[scores.order]
+    for name, weight in scores.weights.items():
+        breakdown[:, BREAKDOWN_COLUMNS.index(name)] = weight
+    ranked.breakdown = breakdown
+    ranked.has_breakdown = np.ones(len(batch), dtype=bool)
+    ranked.total_score = scores.total[scores.order].astype(np.float64)
+    return ranked
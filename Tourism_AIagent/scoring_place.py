@@ -1,88 +1,99 @@
 # scoring_place.py
-from typing import List
-from spot import Spot, haversine_km
+from typing import List, Sequence, Union
+from spot import Spot, ScoreBreakdown, haversine_km
+
+# 優先度ごとの重み（人気, ジャンル, 距離）
+PLACE_WEIGHTS = {
+    "popularity": (0.6, 0.2, 0.2),
+    "genre": (0.2, 0.6, 0.2),
+    "distance": (0.2, 0.2, 0.6),
+    "balance": (1/3, 1/3, 1/3),
+}
+
+
+def popularity_score(rating_val, reviews_val: int) -> int:
+    if rating_val is None:
+        base = 2
+    else:
+        if rating_val >= 4.5:
+            base = 5
+        elif rating_val >= 4.0:
+            base = 4
+        elif rating_val >= 3.5:
+            base = 3
+        else:
+            base = 1
+
+    if reviews_val >= 1000:
+        bonus = 3
+    elif reviews_val >= 300:
+        bonus = 2
+    elif reviews_val >= 100:
+        bonus = 1
+    else:
+        bonus = 0
+    return base + bonus
+
+
+def genre_keywords(genre_keyword: Union[str, Sequence[str]]) -> List[str]:
+    """ジャンル指定（1つの type 名 or 複数の type 名）→ 小文字のキーワード一覧"""
+    if isinstance(genre_keyword, str):
+        genre_keyword = [genre_keyword]
+    return [k.lower() for k in genre_keyword if k]
+
+
+def genre_score(types: List[str], genre_keyword: Union[str, Sequence[str]]) -> int:
+    joined = " ".join(types).lower()
+    if any(keyword in joined for keyword in genre_keywords(genre_keyword)):
+        return 3
+    return 1
+
+
+def distance_score_km(distance_km: float) -> int:
+    if distance_km <= 1.0:
+        return 5
+    elif distance_km <= 3.0:
+        return 4
+    elif distance_km <= 5.0:
+        return 3
+    elif distance_km <= 10.0:
+        return 2
+    else:
+        return 1
 
 
 def calc_place_scores(spot: Spot, user_priority: str,
                       station_lat: float, station_lng: float,
-                      user_genre_keyword: str) -> Spot:
+                      user_genre_keyword: Union[str, Sequence[str]]) -> Spot:
     """
     rating + reviews_count → popularity_score
-    types とユーザー指定ジャンル → genre_score
+    types とユーザー指定ジャンル（type 名、複数可）→ genre_score
     駅からの距離 → distance_score
     """
     rating = spot.rating
     reviews = spot.reviews_count or 0
 
-    def popularity_score(rating_val, reviews_val: int) -> int:
-        if rating_val is None:
-            base = 2
-        else:
-            if rating_val >= 4.5:
-                base = 5
-            elif rating_val >= 4.0:
-                base = 4
-            elif rating_val >= 3.5:
-                base = 3
-            else:
-                base = 1
-
-        if reviews_val >= 1000:
-            bonus = 3
-        elif reviews_val >= 300:
-            bonus = 2
-        elif reviews_val >= 100:
-            bonus = 1
-        else:
-            bonus = 0
-        return base + bonus
-
-    types_text = (spot.score_breakdown or {}).get("types", "")
+    types_text = spot.place_types
     types_list: List[str] = types_text.split(",") if types_text else []
 
-    def genre_score(types: List[str], genre_keyword: str) -> int:
-        keyword = genre_keyword.lower()
-        joined = " ".join(types).lower()
-        if keyword and keyword in joined:
-            return 3
-        return 1
-
     dist_km = haversine_km(station_lat, station_lng, spot.lat, spot.lng)
 
-    def distance_score_km(distance_km: float) -> int:
-        if distance_km <= 1.0:
-            return 5
-        elif distance_km <= 3.0:
-            return 4
-        elif distance_km <= 5.0:
-            return 3
-        elif distance_km <= 10.0:
-            return 2
-        else:
-            return 1
-
     p_score = popularity_score(rating, reviews)
     g_score = genre_score(types_list, user_genre_keyword)
     d_score = distance_score_km(dist_km)
 
-    weights_map = {
-        "popularity": (0.6, 0.2, 0.2),
-        "genre": (0.2, 0.6, 0.2),
-        "distance": (0.2, 0.2, 0.6),
-        "balance": (1/3, 1/3, 1/3),
-    }
-    w_p, w_g, w_d = weights_map.get(user_priority, weights_map["balance"])
+    w_p, w_g, w_d = PLACE_WEIGHTS.get(user_priority, PLACE_WEIGHTS["balance"])
 
     total = p_score * w_p + g_score * w_g + d_score * w_d
 
-    spot.score_breakdown = {
-        "popularity_score": p_score,
-        "genre_score": g_score,
-        "distance_score": d_score,
-        "distance_km": round(dist_km, 2),
-        "weight_popularity": w_p,
-        "weight_genre": w_g,
-        "weight_distance": w_d,
-    }
+    spot.score_breakdown = ScoreBreakdown(
+        popularity_score=p_score,
+        genre_score=g_score,
+        distance_score=d_score,
+        distance_km=round(dist_km, 2),
+        weight_popularity=w_p,
+        weight_genre=w_g,
+        weight_distance=w_d,
+    )
     spot.total_score = total
     return spot
@@ -1,68 +1,95 @@
 # scoring_restaurant.py
-from spot import Spot
+from typing import Optional, Tuple
 
+from spot import Spot, ScoreBreakdown, haversine_km
+
+# 優先度ごとの重み（予算, クオリティ, 距離）
+RESTAURANT_WEIGHTS = {
+    "budget": (0.6, 0.2, 0.2),
+    "quality": (0.2, 0.6, 0.2),
+    "distance": (0.2, 0.2, 0.6),
+    "balance": (1/3, 1/3, 1/3),
+}
+
+
+def budget_score(budget_yen: int) -> int:
+    """予算の上限（円）→ スコア。0 は不明。"""
+    if not budget_yen:
+        return 3  # 不明なら中間
+    elif budget_yen <= 1000:
+        return 5
+    elif budget_yen <= 2000:
+        return 4
+    elif budget_yen <= 3000:
+        return 3
+    elif budget_yen <= 5000:
+        return 2
+    else:
+        return 1
 
-def calc_restaurant_scores(spot: Spot, user_priority: str) -> Spot:
-    """
-    予算 / クオリティ / 距離(簡易)でスコアを算出。
-    """
-    breakdown = spot.score_breakdown or {}
-    budget_text = str(breakdown.get("budget_text", ""))
 
-    def budget_score(text: str) -> int:
-        if "1000" in text:
-            return 5
-        elif "2000" in text:
-            return 4
-        elif "3000" in text:
-            return 3
-        elif "5000" in text:
-            return 2
-        elif text:
-            return 1
-        else:
-            return 3  # 不明なら中間
+def quality_score(spot: Spot) -> int:
+    """Hotpepper の設備（個室・Wi-Fi・駐車場）と紹介文の長さ → スコア"""
+    score = 0
+    if spot.private_room:
+        score += 2
+    if spot.wifi:
+        score += 1
+    if spot.parking:
+        score += 1
+    if spot.desc_len >= 50:
+        score += 1
+    if spot.desc_len >= 120:
+        score += 1
+    return score
 
-    def quality_score(bd) -> int:
-        score = 0
-        if bd.get("private_room", 0) > 0:
-            score += 2
-        if bd.get("wifi", 0) > 0:
-            score += 1
-        if bd.get("parking", 0) > 0:
-            score += 1
-        desc_len = bd.get("desc_len", 0)
-        if desc_len >= 50:
-            score += 1
-        if desc_len >= 120:
-            score += 1
-        return score
 
-    # v1: 距離は固定値（将来は駅との距離で計算）
-    def distance_score_fixed() -> int:
+# 起点が分からないとき（駅名で Google 補完する経路など）の距離スコア
+def distance_score_fixed() -> int:
+    return 3
+
+
+# 歩いて行く距離の段階（Hotpepper の検索範囲 300m / 500m / 1km / 2km に合わせる）
+def walking_distance_score(distance_km: float) -> int:
+    if distance_km <= 0.3:
+        return 5
+    elif distance_km <= 0.5:
+        return 4
+    elif distance_km <= 1.0:
         return 3
+    elif distance_km <= 2.0:
+        return 2
+    else:
+        return 1
+
 
-    b_score = budget_score(budget_text)
-    q_score = quality_score(breakdown)
-    d_score = distance_score_fixed()
+def calc_restaurant_scores(spot: Spot, user_priority: str,
+                           origin: Optional[Tuple[float, float]] = None) -> Spot:
+    """
+    予算 / クオリティ / 距離でスコアを算出。
+    距離は origin（駅・地図で選んだ位置）からの直線距離。origin か店の座標が無ければ固定値。
+    """
+    b_score = budget_score(spot.budget_yen)
+    q_score = quality_score(spot)
+    distance_km = None
+    if origin is not None and (spot.lat or spot.lng):
+        distance_km = haversine_km(origin[0], origin[1], spot.lat, spot.lng)
+        d_score = walking_distance_score(distance_km)
+    else:
+        d_score = distance_score_fixed()
 
-    weights_map = {
-        "budget": (0.6, 0.2, 0.2),
-        "quality": (0.2, 0.6, 0.2),
-        "distance": (0.2, 0.2, 0.6),
-        "balance": (1/3, 1/3, 1/3),
-    }
-    w_b, w_q, w_d = weights_map.get(user_priority, weights_map["balance"])
+    w_b, w_q, w_d = RESTAURANT_WEIGHTS.get(user_priority, RESTAURANT_WEIGHTS["balance"])
 
     total = b_score * w_b + q_score * w_q + d_score * w_d
 
-    spot.score_breakdown = {
-        "budget_score": b_score,
-        "quality_score": q_score,
-        "distance_score": d_score,
-        "weight_budget": w_b,
-        "weight_quality": w_q,
-        "weight_distance": w_d,
-    }
+    spot.score_breakdown = ScoreBreakdown(
+        budget_score=b_score,
+        quality_score=q_score,
+        distance_score=d_score,
+        distance_km=round(distance_km, 2) if distance_km is not None else None,
+        weight_budget=w_b,
+        weight_quality=w_q,
+        weight_distance=w_d,
+    )
     spot.total_score = total
     return spot
@@ -0,0 +1,97 @@
+# search_jobs.py
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from spot import Spot
+
+
+class SearchJob:
+    """
+    バックグラウンドで進む1回分の検索。
+    スポットは補完・スコア計算が終わったものから add() で溜めていき、
+    最後に finish() で最終ランキングに置き換える。
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.done = False
+        self.error: Optional[str] = None
+        self._spots: List[Tuple[int, Spot]] = []  # (カードのキー, Spot)
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def add(self, spot: Spot) -> None:
+        with self._lock:
+            self._spots.append((self._next_key, spot))
+            self._next_key += 1
+
+    def finish(self, ranked: List[Spot]) -> None:
+        """最終ランキングを確定する（add 済みの Spot はキーを引き継ぐ）。"""
+        with self._lock:
+            keys = {id(spot): key for key, spot in self._spots}
+            final = []
+            for spot in ranked:
+                key = keys.get(id(spot))
+                if key is None:
+                    key = self._next_key
+                    self._next_key += 1
+                final.append((key, spot))
+            self._spots = final
+            self.done = True
+
+    def fail(self, message: str) -> None:
+        with self._lock:
+            self.error = message
+            self.done = True
+
+    def snapshot(self) -> List[Tuple[int, Spot]]:
+        """いま見せられるカードを、暫定スコア順で返す。"""
+        with self._lock:
+            items = list(self._spots)
+            if self.done:
+                return items
+        items.sort(key=lambda item: item[1].total_score or 0, reverse=True)
+        return items
+
+
+class SearchJobRegistry:
+    """
+    実行中・完了済みの検索ジョブを保持する（プロセス内）。
+    古いジョブは ttl_sec を過ぎたら捨てる。
+    """
+
+    def __init__(self, max_workers: int = 8, ttl_sec: float = 600):
+        self.ttl_sec = ttl_sec
+        self._jobs: Dict[str, SearchJob] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search-job")
+
+    def start(self, run: Callable[[SearchJob], None]) -> SearchJob:
+        job = SearchJob()
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job: SearchJob, run: Callable[[SearchJob], None]) -> None:
+        try:
+            run(job)
+        except Exception as e:
+            print("ERROR:", e)
+            job.fail(str(e))
+        if not job.done:
+            job.finish([spot for _, spot in job.snapshot()])
+
+    def get(self, job_id: str) -> Optional[SearchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire(self) -> None:
+        limit = time.time() - self.ttl_sec
+        for job_id in [j for j, job in self._jobs.items() if job.created_at < limit]:
+            del self._jobs[job_id]
@@ -0,0 +1,109 @@
+# singleflight.py
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Exception = None
+
+
+class SingleFlight:
+    """
+    同じキーの処理が実行中なら、新しく始めずにその結果を待って共有する。
+    （同じ駅・ジャンルへの同時アクセスで、上流 API を1回しか呼ばないようにする）
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        (結果, 自分が実行したか) を返す。
+        実行中の呼び出しが例外で終わった場合は、待っていた側にも同じ例外を投げる。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "shared": self.shared,
+            }
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight の asyncio 版（同じイベントループ内のタスク同士で結果を共有する）。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            # 待っている側がキャンセルされても、実行中の処理は止めない
+            return await asyncio.shield(call), False
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as e:
+            call.set_exception(e)
+            # 誰も待っていなくても「例外が取り出されなかった」警告を出さない
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
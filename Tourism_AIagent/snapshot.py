@@ -0,0 +1,417 @@
+# snapshot.py
+"""
+キャッシュ・候補 Spot のスナップショット（読み取り専用のバイナリファイル）。
+
+    python snapshot.py build --out data/snapshot.bin      # PLACES_CACHE_DB と駅名表から作る
+    python snapshot.py info data/snapshot.bin
+
+SNAPSHOT_FILE に指定すると、アプリは起動時にこれを mmap で開き、メモリ・SQLite の
+キャッシュに無いときの読み取り元にする（再起動・デプロイ直後もキャッシュが温かい）。
+mmap なので、同じファイルを開いた gunicorn ワーカー同士は同じページを共有する。
+
+ファイルの形式（バージョン 1、リトルエンディアン）:
+    先頭 16 バイト  MAGIC(8) / バージョン(u32) / 目次の長さ(u32)
+    目次            JSON。配列名 → {"dtype", "shape", "offset"}
+    配列            固定長の数値の列。目次の後ろの 64 バイト境界から始め、それぞれ 64 バイト境界に
+                    そろえる（offset はその位置からの相対）
+文字列はすべて1つの文字列ヒープ（"heap/bytes" の UTF-8 と "heap/offsets" の位置）に入れ、
+列にはヒープの番号（None は -1）を入れる。
+    spots/<name>/...   SpotBatch の列（座標などはコピーせずに NumPy の配列として読める）
+    table/<name>/...   キー（ソート済み）→ JSON の値と期限（キャッシュの中身）
+    coords/<name>/...  キー（ソート済み）→ 緯度・経度（駅名表など）
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from cache import MISSING
+from spot import Spot
+from spot_batch import SpotBatch, StringTable, NO_VALUE
+
+MAGIC = b"TASNAP\x00\x00"
+VERSION = 1
+_HEADER = struct.Struct("<8sII")
+_ALIGN = 64
+
+# SpotBatch の列のうちファイルに入れるもの（文字列の列 text はヒープの番号）
+_SPOT_ARRAYS = (
+    "text", "lat", "lng", "rating", "reviews_count", "budget_yen", "desc_len",
+    "stay_time_minutes", "total_score", "flags", "has_breakdown",
+)
+
+
+class SnapshotError(ValueError):
+    """スナップショットとして読めないファイル（形式・バージョン違い、壊れている）"""
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+# ---- 書き出し ----
+
+class SnapshotWriter:
+    """
+    Spot のまとまり・キャッシュの表・座標の表を集めて1つのファイルに書く。
+    同じ文字列（ジャンル・住所など）はファイル全体で1回だけ持つ。
+    """
+
+    def __init__(self):
+        self._strings = StringTable()
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def _put(self, name: str, array: np.ndarray) -> None:
+        if name in self._arrays:
+            raise ValueError(f"snapshot: {name} は登録済みです")
+        self._arrays[name] = np.ascontiguousarray(array)
+
+    def _refs(self, values: Iterable[Optional[str]]) -> np.ndarray:
+        return np.array([self._strings.add(v) for v in values], dtype=np.int32)
+
+    def add_spots(self, name: str, spots: Union[Sequence[Spot], SpotBatch]) -> None:
+        if isinstance(spots, SpotBatch):
+            # 文字列の番号をこのファイルのヒープの番号に付け替える
+            remap = self._refs(spots.strings.get(i) for i in range(len(spots.strings)))
+            text = np.where(spots.text >= 0, remap[np.maximum(spots.text, 0)] if len(remap) else 0, NO_VALUE)
+            batch = spots
+        else:
+            batch = SpotBatch.from_spots(spots, self._strings)
+            text = batch.text
+        for column in _SPOT_ARRAYS:
+            self._put(f"spots/{name}/{column}", text if column == "text" else getattr(batch, column))
+        if batch.breakdown is not None:
+            self._put(f"spots/{name}/breakdown", batch.breakdown)
+
+    def add_table(self, name: str, items: Iterable[Tuple[str, Any, float]]) -> None:
+        """(キー, JSON にできる値, 期限の UNIX 時刻) の表。期限なしは math.inf。"""
+        rows = sorted(items, key=lambda row: row[0])
+        self._put(f"table/{name}/keys", self._refs(key for key, _, _ in rows))
+        self._put(f"table/{name}/values", self._refs(json.dumps(v, ensure_ascii=False) for _, v, _ in rows))
+        self._put(f"table/{name}/expires_at", np.array([e for _, _, e in rows], dtype=np.float64))
+
+    def add_coords(self, name: str, items: Iterable[Tuple[str, float, float]]) -> None:
+        """(キー, 緯度, 経度) の表。"""
+        rows = sorted(items, key=lambda row: row[0])
+        self._put(f"coords/{name}/keys", self._refs(key for key, _, _ in rows))
+        self._put(f"coords/{name}/lat", np.array([lat for _, lat, _ in rows], dtype=np.float64))
+        self._put(f"coords/{name}/lng", np.array([lng for _, _, lng in rows], dtype=np.float64))
+
+    def _heap(self) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [v.encode("utf-8") for v in self._strings.values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        if encoded:
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def write(self, path: str) -> int:
+        """path に書き出す（一時ファイルに書いてから置き換えるので、読んでいる側は壊れない）。書いたバイト数。"""
+        offsets, heap = self._heap()
+        arrays = dict(self._arrays)
+        arrays["heap/offsets"] = offsets
+        arrays["heap/bytes"] = heap
+
+        # 配列の位置は目次の直後（64 バイト境界）からの相対
+        layout, pos = {}, 0
+        for name, array in arrays.items():
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": pos}
+            pos = _align(pos + array.nbytes)
+        body = json.dumps({"arrays": layout, "created_at": time.time()}, ensure_ascii=False).encode("utf-8")
+        base = _align(_HEADER.size + len(body))
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(body)))
+            f.write(body)
+            for name, array in arrays.items():
+                f.seek(base + layout[name]["offset"])
+                f.write(array.tobytes())
+            # 最後の配列が空だと seek しただけで終わるので、目次どおりの長さまで伸ばしておく
+            size = base + pos
+            f.truncate(size)
+        os.replace(tmp, path)
+        return size
+
+
+# ---- 読み込み ----
+
+class MappedStrings:
+    """ファイルの文字列ヒープ（StringTable の読み取り専用版。使うときに UTF-8 から戻す）"""
+
+    def __init__(self, offsets: np.ndarray, heap: np.ndarray):
+        self._offsets = offsets
+        self._heap = heap
+
+    def get(self, i: int) -> Optional[str]:
+        if i < 0:
+            return None
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._heap[start:end].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+class _SortedKeys:
+    """ソート済みのキー列（ヒープの番号）を二分探索する"""
+
+    def __init__(self, strings: MappedStrings, refs: np.ndarray):
+        self._strings = strings
+        self._refs = refs
+
+    def index(self, key: str) -> int:
+        lo, hi = 0, len(self._refs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._strings.get(int(self._refs[mid])) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._refs) and self._strings.get(int(self._refs[lo])) == key:
+            return lo
+        return -1
+
+    def __iter__(self) -> Iterator[str]:
+        return (self._strings.get(int(i)) for i in self._refs)
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+
+class SnapshotTable:
+    """キー → 値の読み取り専用の表（TTLCache の fallback にそのまま渡せる）"""
+
+    def __init__(self, strings: MappedStrings, keys: np.ndarray, values: np.ndarray, expires_at: np.ndarray):
+        self._keys = _SortedKeys(strings, keys)
+        self._strings = strings
+        self._values = values
+        self.expires_at = expires_at
+
+    def get(self, key: str, default: Any = MISSING, now: Optional[float] = None) -> Any:
+        """値（期限切れ・無ければ default）"""
+        i = self._keys.index(key)
+        if i < 0:
+            return default
+        if self.expires_at[i] <= (time.time() if now is None else now):
+            return default
+        return json.loads(self._strings.get(int(self._values[i])))
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not MISSING
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class CoordTable:
+    """キー → (lat, lng) の読み取り専用の表。lat / lng は mmap の上の配列そのもの"""
+
+    def __init__(self, strings: MappedStrings, keys: np.ndarray, lat: np.ndarray, lng: np.ndarray):
+        self._keys = _SortedKeys(strings, keys)
+        self.lat = lat
+        self.lng = lng
+
+    def lookup(self, key: str) -> Optional[Tuple[float, float]]:
+        i = self._keys.index(key)
+        if i < 0:
+            return None
+        return float(self.lat[i]), float(self.lng[i])
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class Snapshot:
+    """
+    スナップショットを mmap で開く。配列はファイルの上を直接指す読み取り専用の NumPy 配列
+    （コピーしない）。文字列は使うときにヒープから取り出す。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:  # 空のファイル
+                raise SnapshotError(f"{path}: {e}") from e
+        try:
+            self._arrays = self._read_directory()
+        except Exception:
+            self._mm.close()
+            raise
+        self.strings = MappedStrings(self.array("heap/offsets"), self.array("heap/bytes"))
+
+    def _read_directory(self) -> Dict[str, dict]:
+        if len(self._mm) < _HEADER.size:
+            raise SnapshotError(f"{self.path}: スナップショットではありません")
+        magic, version, dir_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path}: スナップショットではありません")
+        if version != VERSION:
+            raise SnapshotError(f"{self.path}: 対応していないバージョンです（{version}）")
+        try:
+            directory = json.loads(self._mm[_HEADER.size:_HEADER.size + dir_len].decode("utf-8"))
+        except ValueError as e:
+            raise SnapshotError(f"{self.path}: 目次が壊れています") from e
+        self.created_at = directory.get("created_at")
+        base = _align(_HEADER.size + dir_len)
+        arrays = directory["arrays"]
+        for name, entry in arrays.items():
+            entry["offset"] += base
+            dtype = np.dtype(entry["dtype"])
+            nbytes = dtype.itemsize * math.prod(entry["shape"])
+            if entry["offset"] + nbytes > len(self._mm):
+                raise SnapshotError(f"{self.path}: {name} がファイルの外を指しています")
+        return arrays
+
+    def array(self, name: str) -> np.ndarray:
+        entry = self._arrays.get(name)
+        if entry is None:
+            raise KeyError(name)
+        dtype = np.dtype(entry["dtype"])
+        count = math.prod(entry["shape"])
+        return np.frombuffer(self._mm, dtype=dtype, count=count, offset=entry["offset"]).reshape(entry["shape"])
+
+    def names(self, kind: str) -> List[str]:
+        """kind（"spots" / "table" / "coords"）の名前の一覧"""
+        return sorted({name.split("/")[1] for name in self._arrays if name.startswith(kind + "/")})
+
+    def has(self, kind: str, name: str) -> bool:
+        return any(n.startswith(f"{kind}/{name}/") for n in self._arrays)
+
+    def spots(self, name: str) -> SpotBatch:
+        prefix = f"spots/{name}/"
+        columns = {column: self.array(prefix + column) for column in _SPOT_ARRAYS}
+        breakdown = self.array(prefix + "breakdown") if prefix + "breakdown" in self._arrays else None
+        return SpotBatch(strings=self.strings, breakdown=breakdown, **columns)
+
+    def table(self, name: str) -> SnapshotTable:
+        prefix = f"table/{name}/"
+        return SnapshotTable(self.strings, self.array(prefix + "keys"), self.array(prefix + "values"),
+                             self.array(prefix + "expires_at"))
+
+    def coords(self, name: str) -> CoordTable:
+        prefix = f"coords/{name}/"
+        return CoordTable(self.strings, self.array(prefix + "keys"), self.array(prefix + "lat"),
+                          self.array(prefix + "lng"))
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "bytes": len(self._mm),
+            "created_at": self.created_at,
+            "strings": len(self.strings),
+            "spots": {name: len(self.spots(name)) for name in self.names("spots")},
+            "tables": {name: len(self.table(name)) for name in self.names("table")},
+            "coords": {name: len(self.coords(name)) for name in self.names("coords")},
+        }
+
+    def close(self) -> None:
+        """
+        mmap を閉じる。取り出した配列（SpotBatch・表など）がまだ残っているうちは閉じられないので、
+        そのときは参照が無くなったところで GC に閉じてもらう。
+        """
+        self.strings = None
+        self._arrays = {}
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """path が空・無い・読めなければ None（スナップショット無しで動く）"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, SnapshotError) as e:
+        print("SNAPSHOT_ERROR:", e)
+        return None
+
+
+# ---- ライブのキャッシュから作る ----
+
+def cache_rows(db_path: str, now: Optional[float] = None) -> Dict[str, List[Tuple[str, Any, float]]]:
+    """PLACES_CACHE_DB（SqliteBackend）の期限内の行を、キャッシュ名ごとの (キー, 値, 期限) に分ける。"""
+    now = time.time() if now is None else now
+    tables: Dict[str, List[Tuple[str, Any, float]]] = {}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT key, value, expires_at FROM cache WHERE expires_at > ?", (now,))
+        for full_key, value, expires_at in rows:
+            name, sep, key = full_key.partition(":")
+            if not sep:
+                continue
+            tables.setdefault(name, []).append((key, json.loads(value), expires_at))
+    finally:
+        conn.close()
+    return tables
+
+
+def build_from_caches(out: str, cache_db: Optional[str], stations_file: Optional[str]) -> Dict[str, int]:
+    from gazetteer import StationGazetteer
+
+    writer = SnapshotWriter()
+    counts: Dict[str, int] = {}
+    if cache_db:
+        for name, rows in cache_rows(cache_db).items():
+            writer.add_table(name, rows)
+            counts[f"table/{name}"] = len(rows)
+    if stations_file and os.path.exists(stations_file):
+        gazetteer = StationGazetteer(stations_file)
+        items = gazetteer.items()
+        writer.add_coords("stations", items)
+        counts["coords/stations"] = len(items)
+    counts["bytes"] = writer.write(out)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="キャッシュのスナップショットを作る・中身を見る")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="PLACES_CACHE_DB と駅名表からスナップショットを作る")
+    build.add_argument("--out", required=True, help="書き出すファイル")
+    build.add_argument("--cache-db", default=os.getenv("PLACES_CACHE_DB", ""), help="SqliteBackend のファイル")
+    build.add_argument("--stations-file", default=os.getenv("STATIONS_FILE", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data", "stations.csv")), help="name,lat,lng 形式の CSV")
+    info = sub.add_parser("info", help="スナップショットの中身の件数を表示する")
+    info.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if not args.cache_db:
+            print("WARNING: --cache-db（PLACES_CACHE_DB）が未指定なので、キャッシュの表は入りません。")
+        counts = build_from_caches(args.out, args.cache_db or None, args.stations_file)
+        print(json.dumps(counts, ensure_ascii=False))
+        return 0
+
+    try:
+        snapshot = Snapshot(args.path)
+    except (OSError, SnapshotError) as e:
+        print("ERROR:", e, file=sys.stderr)
+        return 1
+    print(json.dumps(snapshot.info(), ensure_ascii=False, indent=2))
+    snapshot.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
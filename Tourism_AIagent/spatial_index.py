@@ -0,0 +1,136 @@
+# spatial_index.py
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from spot import Spot, haversine_km, spot_identity
+
+KM_PER_DEG_LAT = 111.32
+
+
+class SpotIndex:
+    """
+    これまでに取得した Spot のローカル空間インデックス（緯度経度のグリッド）。
+    - Spot はタグ（検索した type など）ごとに、グリッドのセルへ入れておく
+    - Nearby Search を実際に投げた円を「取得済み範囲」として時刻付きで覚える
+    - 新しい検索円がまだ新しい取得済み範囲にすっぽり入っていれば、API を呼ばずに
+      インデックスから半径内の Spot を返す
+    Nearby Search 自体が上位 20〜60 件しか返さないので、返すのは
+    「その範囲で API から得た結果のうち、検索円に入るもの」になる。
+    """
+
+    def __init__(self, cell_deg: float = 0.01, max_age_sec: float = 6 * 3600):
+        self.cell_deg = cell_deg
+        self.max_age_sec = max_age_sec
+        # tag → cell → identity → (Spot, 登録順, 登録時刻)
+        self._cells: Dict[str, Dict[Tuple[int, int], Dict[tuple, Tuple[Spot, int, float]]]] = defaultdict(
+            lambda: defaultdict(dict)
+        )
+        # tag → cell（円の中心）→ [(lat, lng, radius_km, 取得時刻)]
+        self._coverage: Dict[str, Dict[Tuple[int, int], List[tuple]]] = defaultdict(lambda: defaultdict(list))
+        self._max_radius_km: Dict[str, float] = defaultdict(float)
+        self._seq = 0
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def _cells_around(self, lat: float, lng: float, radius_km: float):
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlng = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        lat0, lng0 = self._cell(lat - dlat, lng - dlng)
+        lat1, lng1 = self._cell(lat + dlat, lng + dlng)
+        for i in range(lat0, lat1 + 1):
+            for j in range(lng0, lng1 + 1):
+                yield i, j
+
+    def add(self, tag: str, spots: List[Spot], center_lat: float, center_lng: float, radius_m: float,
+            complete: bool = True) -> None:
+        """
+        center から radius_m の範囲を検索した結果として spots を登録する。
+        complete=False（件数・ページ数・時間で途中までしか取れなかった）なら、Spot だけ入れて
+        その円は取得済み範囲にしない（円の中の上位の一部しか持っていないため）。
+        """
+        now = time.time()
+        if now - self._last_purge > self.max_age_sec / 10:
+            self.purge()
+        with self._lock:
+            cells = self._cells[tag]
+            for spot in spots:
+                self._seq += 1
+                cells[self._cell(spot.lat, spot.lng)][spot_identity(spot)] = (spot, self._seq, now)
+            if not complete:
+                return
+            radius_km = radius_m / 1000.0
+            self._coverage[tag][self._cell(center_lat, center_lng)].append(
+                (center_lat, center_lng, radius_km, now)
+            )
+            self._max_radius_km[tag] = max(self._max_radius_km[tag], radius_km)
+
+    def _is_covered(self, tag: str, lat: float, lng: float, radius_km: float, now: float) -> bool:
+        coverage = self._coverage.get(tag)
+        if not coverage:
+            return False
+        # 取得済み円の中心は、最大半径ぶん離れたセルまでしかありえない
+        for cell in self._cells_around(lat, lng, self._max_radius_km[tag]):
+            for c_lat, c_lng, c_radius, fetched_at in coverage.get(cell, ()):
+                if now - fetched_at > self.max_age_sec:
+                    continue
+                if haversine_km(lat, lng, c_lat, c_lng) + radius_km <= c_radius:
+                    return True
+        return False
+
+    def query(self, tag: str, lat: float, lng: float, radius_m: float) -> Optional[List[Spot]]:
+        """
+        取得済み範囲に入っていれば半径内の Spot（最初に取得した順）を返す。
+        入っていなければ None（API を呼ぶ必要がある）。
+        """
+        radius_km = radius_m / 1000.0
+        now = time.time()
+        with self._lock:
+            if not self._is_covered(tag, lat, lng, radius_km, now):
+                self.misses += 1
+                return None
+            self.hits += 1
+            found = []
+            cells = self._cells.get(tag, {})
+            for cell in self._cells_around(lat, lng, radius_km):
+                for spot, seq, added_at in cells.get(cell, {}).values():
+                    if now - added_at > self.max_age_sec:
+                        continue
+                    if haversine_km(lat, lng, spot.lat, spot.lng) <= radius_km:
+                        found.append((seq, spot))
+        found.sort(key=lambda item: item[0])
+        return [spot for _, spot in found]
+
+    def purge(self) -> None:
+        """古くなった取得済み範囲と Spot を捨てる。"""
+        limit = time.time() - self.max_age_sec
+        with self._lock:
+            self._last_purge = time.time()
+            for coverage in self._coverage.values():
+                for cell in list(coverage):
+                    coverage[cell] = [c for c in coverage[cell] if c[3] >= limit]
+                    if not coverage[cell]:
+                        del coverage[cell]
+            for cells in self._cells.values():
+                for cell in list(cells):
+                    bucket = cells[cell]
+                    for key in [k for k, item in bucket.items() if item[2] < limit]:
+                        del bucket[key]
+                    if not bucket:
+                        del cells[cell]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "spots": sum(len(bucket) for cells in self._cells.values() for bucket in cells.values()),
+                "covered_areas": sum(len(c) for cov in self._coverage.values() for c in cov.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,10 +1,37 @@
 # spot.py
-from dataclasses import dataclass
-from typing import Optional, Dict
+from dataclasses import dataclass, fields, replace
+from typing import Iterator, Optional, Tuple
 import math
-
-
-@dataclass
+import re
+
+
+@dataclass(slots=True)
+class ScoreBreakdown:
+    """
+    採点結果の内訳（デバッグ・説明用）。飲食は budget / quality / distance、
+    観光は popularity / genre / distance を使い、使わない項目は None のまま。
+    """
+    budget_score: Optional[int] = None
+    quality_score: Optional[int] = None
+    popularity_score: Optional[int] = None
+    genre_score: Optional[int] = None
+    distance_score: Optional[int] = None
+    distance_km: Optional[float] = None
+    weight_budget: Optional[float] = None
+    weight_quality: Optional[float] = None
+    weight_popularity: Optional[float] = None
+    weight_genre: Optional[float] = None
+    weight_distance: Optional[float] = None
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        """値の入っている項目だけ（テンプレートの内訳表示用）"""
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value is not None:
+                yield f.name, value
+
+
+@dataclass(slots=True)
 class Spot:
     spot_type: str  # "restaurant" or "place"
     name: str
@@ -17,13 +44,27 @@ class Spot:
     description: Optional[str] = None
     image_url: Optional[str] = None  # 画像URL（Google / Hotpepper 両対応）
     source: str = ""
+    place_id: Optional[str] = None  # Google の place_id（重複除去・詳細取得用）
+    hotpepper_id: Optional[str] = None  # Hotpepper の店舗ID（Google の店との対応づけ用）
+    details_pending: bool = False  # Google の詳細（写真・住所など）をまだ取っていない
+    # 採点に使う元データ（観光は Google の types、飲食は Hotpepper の予算・設備・紹介文の長さ）
+    place_types: str = ""  # カンマ区切り
+    budget_yen: int = 0  # 予算の上限（円）。0 は不明
+    private_room: bool = False
+    wifi: bool = False
+    parking: bool = False
+    desc_len: int = 0
     # LLM またはルールベースが埋めるフィールド
     stay_time_minutes: Optional[int] = None
     reason: Optional[str] = None
     # スコア詳細（デバッグ・説明用）
-    score_breakdown: Optional[Dict[str, float]] = None
+    score_breakdown: Optional[ScoreBreakdown] = None
     total_score: Optional[float] = None
 
+    def clone(self) -> "Spot":
+        """採点用のコピー（score_breakdown も別のものにする）"""
+        return replace(self, score_breakdown=replace(self.score_breakdown) if self.score_breakdown else None)
+
     # 🔹 Hotpepper API の shop JSON → Spot に変換（検索用の最小構成）
     @classmethod
     def from_hotpepper_json(cls, shop: dict) -> "Spot":
@@ -42,21 +83,47 @@ class Spot:
             # 変換できなければ 0.0 のまま（あとで Google 側で弾かれる想定）
             pass
 
-        # 🔸 Hotpepper のジャンル・説明・画像などはもう UI に使わないので捨てる
+        # 🔸 Hotpepper の説明・画像などは UI に使わないので捨てる
+        #    （予算・設備・キャッチは採点に使う分だけ数値にして残す）
+        budget = shop.get("budget") or {}
         return cls(
             spot_type="restaurant",
             name=name,
             address=address,
             lat=lat,
             lng=lng,
-            genre="",          # ジャンルは Google の types 側で持つ
+            # Google で補完できればその types で上書きする
+            genre=(shop.get("genre") or {}).get("name", ""),
             rating=None,
             reviews_count=None,
             description=None,
             image_url=None,
             source="hotpepper",
+            hotpepper_id=shop.get("id") or None,
+            budget_yen=budget_yen(budget.get("name") or budget.get("average") or ""),
+            private_room=_yes(shop.get("private_room")),
+            wifi=_yes(shop.get("wifi")),
+            parking=_yes(shop.get("parking")),
+            desc_len=len(shop.get("catch") or ""),
         )
 
+    # 🔹 Google の情報で表示用の項目を上書きする（採点に使う Hotpepper の項目はそのまま）
+    def merge_google(self, other: "Spot") -> "Spot":
+        self.name = other.name or self.name
+        self.address = other.address or self.address
+        if other.lat or other.lng:
+            self.lat, self.lng = other.lat, other.lng
+        self.genre = other.genre or self.genre
+        if other.rating is not None:
+            self.rating = other.rating
+            self.reviews_count = other.reviews_count
+        self.image_url = other.image_url or self.image_url
+        self.place_id = other.place_id or self.place_id
+        # 写真だけ取った詳細（名前なし）なら表示の中身は Hotpepper のまま
+        if other.name:
+            self.source = other.source
+        return self
+
     # 🔹 Nearby Search の生 JSON → Spot にする汎用メソッド（観光用）
     @classmethod
     def from_google_place_json(cls, place: dict, genre_label: str = "") -> "Spot":
@@ -95,6 +162,7 @@ class Spot:
             description=None,
             image_url=None,           # 観光の画像は別で埋めるならここに
             source="google_places",
+            place_id=place.get("place_id"),
         )
 
     # 🔹 Google Place Details ＋ 画像URL → Spot に変換（グルメ用 / Google表示モード）
@@ -123,10 +191,33 @@ class Spot:
             description="",       # 説明文は今は空でもOK
             image_url=image_url,  # ← ここに Google の Photo URL が入る
             source="google_places",
-            score_breakdown={"google_types": ",".join(types)} if types else None,
+            place_id=details.get("place_id"),
+            place_types=",".join(types),
         )
 
 
+def _yes(value) -> bool:
+    # Hotpepper の設備欄は「あり」「あり ：30台」「なし」「未確認」などの文字列
+    return str(value or "").startswith("あり")
+
+
+# 「2001～3000円」「1500円（通常平均）」などの金額部分
+_YEN_AMOUNT = re.compile(r"\d[\d,]*")
+
+
+def budget_yen(text: str) -> int:
+    """Hotpepper の予算の文字列 → 上限の金額（円）。読めなければ 0。"""
+    amounts = [int(m.replace(",", "")) for m in _YEN_AMOUNT.findall(text or "")]
+    return max(amounts) if amounts else 0
+
+
+def spot_identity(spot: Spot) -> tuple:
+    """同じスポットかどうかの判定キー（place_id 優先、無ければ名前＋座標）"""
+    if spot.place_id:
+        return ("place_id", spot.place_id)
+    return ("name_loc", spot.name, round(spot.lat, 4), round(spot.lng, 4))
+
+
 def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
     """2点の緯度経度から距離(km)を計算"""
     R = 6371.0
@@ -0,0 +1,204 @@
+# spot_batch.py
+from dataclasses import fields
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from spot import Spot, ScoreBreakdown
+
+# 文字列の列（値は StringTable の番号、None は -1）
+STRING_COLUMNS = (
+    "spot_type", "name", "address", "genre", "description", "image_url",
+    "source", "place_id", "hotpepper_id", "place_types", "reason",
+)
+
+# bool の列（flags のビット）
+FLAG_COLUMNS = ("details_pending", "private_room", "wifi", "parking")
+
+# 内訳の列（None は NaN）。*_score は整数に戻す
+BREAKDOWN_COLUMNS = tuple(f.name for f in fields(ScoreBreakdown))
+_INT_BREAKDOWN = frozenset(name for name in BREAKDOWN_COLUMNS if name.endswith("_score"))
+
+NO_VALUE = -1   # 整数の列の None
+
+
+class StringTable:
+    """同じ文字列は1回だけ持ち、列には番号を入れる（店名・ジャンル・住所などの重複をまとめる）"""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_VALUE
+        i = self._index.get(value)
+        if i is None:
+            i = len(self.values)
+            self.values.append(value)
+            self._index[value] = i
+        return i
+
+    def get(self, i: int) -> Optional[str]:
+        return None if i < 0 else self.values[i]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class SpotBatch:
+    """
+    Spot の列指向のまとまり（キャッシュ・まとめての採点用）。
+    座標・評価・スコアなどは連続した配列、文字列は StringTable の番号で持つ。
+    Optional の数値は NaN（小数）/ -1（整数）で表す。
+    テンプレートなど1件ずつ扱うところには spot(i) / to_spots() で Spot に戻して渡す。
+    """
+
+    __slots__ = (
+        "strings", "text", "lat", "lng", "rating", "reviews_count", "budget_yen", "desc_len",
+        "stay_time_minutes", "total_score", "flags", "breakdown", "has_breakdown",
+    )
+
+    def __init__(self, strings: StringTable, text: np.ndarray, lat: np.ndarray, lng: np.ndarray,
+                 rating: np.ndarray, reviews_count: np.ndarray, budget_yen: np.ndarray, desc_len: np.ndarray,
+                 stay_time_minutes: np.ndarray, total_score: np.ndarray, flags: np.ndarray,
+                 breakdown: Optional[np.ndarray], has_breakdown: np.ndarray):
+        self.strings = strings
+        self.text = text                  # (n, len(STRING_COLUMNS)) int32
+        self.lat = lat                    # float64
+        self.lng = lng                    # float64
+        self.rating = rating              # float64（評価なしは NaN）
+        self.reviews_count = reviews_count  # int32（不明は -1）
+        self.budget_yen = budget_yen      # int32
+        self.desc_len = desc_len          # int32
+        self.stay_time_minutes = stay_time_minutes  # int32（未設定は -1）
+        self.total_score = total_score    # float64（未採点は NaN）
+        self.flags = flags                # uint8（FLAG_COLUMNS のビット）
+        self.breakdown = breakdown        # (n, len(BREAKDOWN_COLUMNS)) float64。どれも内訳なしなら None
+        self.has_breakdown = has_breakdown  # bool
+
+    @classmethod
+    def from_spots(cls, spots: Sequence[Spot], strings: Optional[StringTable] = None) -> "SpotBatch":
+        strings = strings if strings is not None else StringTable()
+        n = len(spots)
+        text = np.empty((n, len(STRING_COLUMNS)), dtype=np.int32)
+        flags = np.zeros(n, dtype=np.uint8)
+        has_breakdown = np.fromiter((s.score_breakdown is not None for s in spots), dtype=bool, count=n)
+        # 採点前の候補（キャッシュするもの）は内訳を持たないので、そのときは配列を作らない
+        breakdown = np.full((n, len(BREAKDOWN_COLUMNS)), np.nan) if has_breakdown.any() else None
+        for i, s in enumerate(spots):
+            text[i] = [strings.add(getattr(s, name)) for name in STRING_COLUMNS]
+            flags[i] = sum(1 << bit for bit, name in enumerate(FLAG_COLUMNS) if getattr(s, name))
+            if s.score_breakdown is not None:
+                breakdown[i] = [
+                    np.nan if v is None else v
+                    for v in (getattr(s.score_breakdown, name) for name in BREAKDOWN_COLUMNS)
+                ]
+
+        def floats(values: Iterable[Optional[float]]) -> np.ndarray:
+            return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=n)
+
+        def ints(values: Iterable[Optional[int]]) -> np.ndarray:
+            return np.fromiter((NO_VALUE if v is None else v for v in values), dtype=np.int32, count=n)
+
+        return cls(
+            strings=strings,
+            text=text,
+            lat=floats(s.lat for s in spots),
+            lng=floats(s.lng for s in spots),
+            rating=floats(s.rating for s in spots),
+            reviews_count=ints(s.reviews_count for s in spots),
+            budget_yen=ints(s.budget_yen for s in spots),
+            desc_len=ints(s.desc_len for s in spots),
+            stay_time_minutes=ints(s.stay_time_minutes for s in spots),
+            total_score=floats(s.total_score for s in spots),
+            flags=flags,
+            breakdown=breakdown,
+            has_breakdown=has_breakdown,
+        )
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def column(self, name: str) -> List[Optional[str]]:
+        """文字列の列を Python の文字列のリストで（同じ文字列は同じオブジェクト）"""
+        get = self.strings.get
+        return [get(i) for i in self.text[:, STRING_COLUMNS.index(name)]]
+
+    def flag(self, name: str) -> np.ndarray:
+        return (self.flags & (1 << FLAG_COLUMNS.index(name))) != 0
+
+    def spot(self, i: int) -> Spot:
+        return self.take([i]).to_spots()[0]
+
+    def _breakdown(self, row: List[float]) -> ScoreBreakdown:
+        values = {}
+        for name, v in zip(BREAKDOWN_COLUMNS, row):
+            if v != v:  # NaN
+                continue
+            values[name] = int(v) if name in _INT_BREAKDOWN else v
+        return ScoreBreakdown(**values)
+
+    def to_spots(self) -> List[Spot]:
+        # 列ごとに Python の値のリストにしてから組み立てる（1件ずつ配列を引くより速い）
+        get = self.strings.get
+        text = [[get(j) for j in row] for row in self.text.tolist()]
+        flags = self.flags.tolist()
+        breakdown = self.breakdown.tolist() if self.breakdown is not None else None
+        has_breakdown = self.has_breakdown.tolist()
+
+        def optional(values: List, missing) -> List:
+            return [None if (v != v if missing is None else v == missing) else v for v in values]
+
+        columns = zip(
+            self.lat.tolist(), self.lng.tolist(),
+            optional(self.rating.tolist(), None),
+            optional(self.reviews_count.tolist(), NO_VALUE),
+            self.budget_yen.tolist(), self.desc_len.tolist(),
+            optional(self.stay_time_minutes.tolist(), NO_VALUE),
+            optional(self.total_score.tolist(), None),
+        )
+        spots = []
+        for i, (lat, lng, rating, reviews, budget, desc_len, stay, total) in enumerate(columns):
+            kwargs = dict(zip(STRING_COLUMNS, text[i]))
+            kwargs["place_types"] = kwargs["place_types"] or ""
+            for bit, name in enumerate(FLAG_COLUMNS):
+                kwargs[name] = bool(flags[i] & (1 << bit))
+            spots.append(Spot(
+                lat=lat,
+                lng=lng,
+                rating=rating,
+                reviews_count=reviews,
+                budget_yen=budget,
+                desc_len=desc_len,
+                stay_time_minutes=stay,
+                total_score=total,
+                score_breakdown=self._breakdown(breakdown[i]) if has_breakdown[i] else None,
+                **kwargs,
+            ))
+        return spots
+
+    def take(self, indices: Sequence[int]) -> "SpotBatch":
+        """indices の順に抜き出したもの（文字列の表は共有する）"""
+        idx = np.asarray(indices, dtype=np.intp)
+        return SpotBatch(
+            strings=self.strings,
+            text=self.text[idx],
+            lat=self.lat[idx],
+            lng=self.lng[idx],
+            rating=self.rating[idx],
+            reviews_count=self.reviews_count[idx],
+            budget_yen=self.budget_yen[idx],
+            desc_len=self.desc_len[idx],
+            stay_time_minutes=self.stay_time_minutes[idx],
+            total_score=self.total_score[idx],
+            flags=self.flags[idx],
+            breakdown=self.breakdown[idx] if self.breakdown is not None else None,
+            has_breakdown=self.has_breakdown[idx],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """配列の分のバイト数（文字列の表は含まない）"""
+        arrays = (getattr(self, name) for name in self.__slots__ if name != "strings")
+        return sum(a.nbytes for a in arrays if a is not None)
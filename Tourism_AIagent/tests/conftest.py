@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# アプリのモジュールはリポジトリ直下に平置きなので、そのまま import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,147 @@
+# tests/test_cache.py
+import os
+import threading
+
+import pytest
+
+from cache import MISSING, SqliteBackend, TTLCache
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_memory_entry_expires_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl_sec=60, clock=clock)
+    cache.set("details:ChIJ-a", {"name": "名古屋城"})
+
+    clock.now += 59.9
+    assert cache.get("details:ChIJ-a") == {"name": "名古屋城"}
+    clock.now += 0.1
+    assert cache.get("details:ChIJ-a") is MISSING
+    assert cache.get("details:ChIJ-a", None) is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_none_is_cached_as_a_value():
+    cache = TTLCache(maxsize=10, ttl_sec=60, clock=FakeClock())
+    cache.set("place_id:存在しない店", None)
+    assert cache.get("place_id:存在しない店") is None
+    assert cache.get("place_id:別の店") is MISSING
+
+
+def test_set_restarts_the_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl_sec=60, clock=clock)
+    cache.set("k", 1)
+    clock.now += 50
+    cache.set("k", 2)
+    clock.now += 50
+    assert cache.get("k") == 2
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl_sec=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")          # a を最近使ったことにする
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_disk_entry_expires_with_the_same_clock(tmp_path):
+    clock = FakeClock()
+    backend = SqliteBackend(str(tmp_path / "cache.db"))
+    writer = TTLCache(maxsize=10, ttl_sec=60, backend=backend, name="details", clock=clock)
+    writer.set("ChIJ-a", {"name": "熱田神宮"})
+
+    # 別ワーカー（メモリは空）からはディスクを見る。期限もディスクの行のものを引き継ぐ
+    reader = TTLCache(maxsize=10, ttl_sec=60, backend=backend, name="details", clock=clock)
+    clock.now += 30
+    assert reader.get("ChIJ-a") == {"name": "熱田神宮"}
+    assert reader.disk_hits == 1
+    clock.now += 30
+    assert reader.get("ChIJ-a") is MISSING
+    assert writer.get("ChIJ-a") is MISSING
+    # キーはキャッシュ名つきで保存される
+    assert backend.get("details:ChIJ-a", now=clock.now - 1) == ({"name": "熱田神宮"}, 1060.0)
+
+
+def test_fallback_is_read_last_and_cached_for_ttl():
+    clock = FakeClock()
+    fallback = {"ChIJ-snap": {"name": "名古屋テレビ塔"}}
+    cache = TTLCache(maxsize=10, ttl_sec=60, fallback=fallback, clock=clock)
+
+    assert cache.get("ChIJ-snap") == {"name": "名古屋テレビ塔"}
+    assert cache.fallback_hits == 1
+    fallback.clear()
+    clock.now += 59
+    assert cache.get("ChIJ-snap") == {"name": "名古屋テレビ塔"}
+    clock.now += 1
+    assert cache.get("ChIJ-snap") is MISSING
+
+
+def test_backend_opens_one_connection_per_thread(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "cache.db"))
+    backend.set("k", {"v": 1}, expires_at=2e9)
+    main_conn = backend._conn.get()
+
+    seen = {}
+
+    def worker():
+        seen["value"] = backend.get("k", now=0)
+        seen["conn"] = backend._conn.get()
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+
+    assert seen["value"] == ({"v": 1}, 2e9)
+    assert seen["conn"] is not main_conn
+    assert backend._conn.get() is main_conn
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork が無い環境")
+def test_forked_child_does_not_reuse_parent_connection(tmp_path):
+    # gunicorn --preload と同じく、親で開いた接続を子が使わずに開き直すこと
+    backend = SqliteBackend(str(tmp_path / "cache.db"))
+    backend.set("parent", 1, expires_at=2e9)
+    backend._conn.get()
+    parent_local = backend._conn._local
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        ok = False
+        try:
+            backend.set("child", 2, expires_at=2e9)
+            ok = backend._conn._local is not parent_local and backend.get("parent", now=0) == (1, 2e9)
+        finally:
+            os.write(write_fd, b"1" if ok else b"0")
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 1)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    assert result == b"1"
+    assert backend._conn._local is parent_local
+    assert backend.get("child", now=0) == (2, 2e9)
+
+
+def test_expired_rows_are_missing(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "cache.db"))
+    backend.set("k", "v", expires_at=100.0)
+
+    assert backend.get("k", now=99.0) == ("v", 100.0)
+    assert backend.get("k", now=100.0) is MISSING
+    assert backend.purge_expired(now=100.0) == 1
@@ -0,0 +1,75 @@
+# tests/test_google_client.py
+import threading
+import time
+
+from google_client import GooglePlacesClient
+
+
+class PagedClient(GooglePlacesClient):
+    """Nearby Search を呼ばずに、クエリごとに 20 件 × 3 ページを返す"""
+
+    NEXT_PAGE_DELAY_SEC = 0.05
+    NEXT_PAGE_RETRY_SEC = 0.05
+
+    def __init__(self):
+        super().__init__("test-key")
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _fetch_nearby(self, params: dict) -> dict:
+        with self._lock:
+            self.calls.append(params)
+        if "pagetoken" in params:
+            place_type, page = params["pagetoken"].rsplit(":", 1)
+            page = int(page)
+        else:
+            place_type, page = params["type"], 0
+        results = [
+            {
+                "place_id": f"{place_type}_{page}_{i}",
+                "name": f"{place_type} {page}-{i}",
+                "geometry": {"location": {"lat": 35.17 + i / 1000, "lng": 136.88 + page / 1000}},
+                "types": [place_type],
+            }
+            for i in range(20)
+        ]
+        data = {"status": "OK", "results": results}
+        if page < 2:
+            data["next_page_token"] = f"{place_type}:{page + 1}"
+        return data
+
+
+def _pages_requested(client: PagedClient) -> int:
+    return sum("pagetoken" in p for p in client.calls)
+
+
+def test_multi_stops_paging_once_max_results_is_reached():
+    client = PagedClient()
+    queries = [("museum", None), ("park", None)]
+    spots = [s for page in client.iter_nearby_pages_multi(35.17, 136.88, queries, max_pages=3, max_results=30)
+             for s in page]
+    time.sleep(0.3)  # 止めなければ、この間に各クエリが2ページ目を取りに行く
+
+    assert len(spots) == 30
+    assert _pages_requested(client) == 0
+
+
+def test_multi_stops_paging_when_the_caller_stops_reading():
+    client = PagedClient()
+    pages = client.iter_nearby_pages_multi(35.17, 136.88, [("museum", None), ("park", None)],
+                                           max_pages=3, max_results=120)
+    next(pages)
+    pages.close()
+    time.sleep(0.3)
+
+    assert _pages_requested(client) == 0
+
+
+def test_multi_reads_every_page_when_allowed():
+    client = PagedClient()
+    spots = [s for page in client.iter_nearby_pages_multi(35.17, 136.88, [("museum", None), ("park", None)],
+                                                          max_pages=3, max_results=120)
+             for s in page]
+
+    assert len(spots) == 120
+    assert _pages_requested(client) == 4
@@ -0,0 +1,53 @@
+# tests/test_itinerary.py
+import numpy as np
+import pytest
+
+from itinerary import RESTAURANT_HOURS, format_clock, parse_clock, plan_itinerary
+
+
+def _random_problem(seed: int):
+    """飲食店（時間帯あり）と観光地を混ぜた、起点つきの小さな問題"""
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(3, 12))
+    lat = 35.68 + rng.normal(0, 0.03, n)
+    lng = 139.76 + rng.normal(0, 0.03, n)
+    stay = rng.choice([30, 60, 90, 120], n).astype(float)
+    value = rng.uniform(1, 5, n)
+    windows = [RESTAURANT_HOURS if rng.random() < 0.4 else None for _ in range(n)]
+    start = float(rng.choice([9 * 60, 10 * 60, 17 * 60, 20 * 60]))
+    budget = float(rng.choice([120, 240, 480]))
+    return n, dict(lat=lat, lng=lng, stay_min=stay, value=value, start_min=start, budget_min=budget,
+                   origin=(35.68, 139.76), windows=windows)
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_every_spot_is_either_visited_or_dropped(seed):
+    # 縮めた順路が時間帯に合わなくなっても、スポットが行程からも dropped からも消えてはいけない
+    n, kwargs = _random_problem(seed)
+    plan = plan_itinerary(**kwargs, time_limit_ms=1000)
+
+    assert sorted([s.index for s in plan.stops] + plan.dropped) == list(range(n))
+    end = kwargs["start_min"] + kwargs["budget_min"]
+    for stop, window in ((s, kwargs["windows"][s.index]) for s in plan.stops):
+        assert stop.depart_min <= end + 1e-6
+        if window is not None:
+            assert window[0] <= stop.arrive_min <= window[1]
+
+
+def test_day_ends_at_midnight():
+    plan = plan_itinerary([35.68, 35.69], [139.76, 139.77], [120, 120], [1.0, 2.0],
+                          start_min=23 * 60, budget_min=8 * 60)
+    assert plan.stops == []
+    assert sorted(plan.dropped) == [0, 1]
+    assert format_clock(plan.end_min) == "23:00"
+
+
+@pytest.mark.parametrize("text, minutes", [("10:00", 600), ("9:05", 545), ("0:00", 0), ("23:59", 1439), ("7", 420)])
+def test_parse_clock(text, minutes):
+    assert parse_clock(text) == minutes
+
+
+@pytest.mark.parametrize("text", ["10:-5", "10:99", "24:00", "-1:00", "10:", "", "ab:cd", "10:5x"])
+def test_parse_clock_rejects_bad_times(text):
+    with pytest.raises(ValueError):
+        parse_clock(text)
@@ -0,0 +1,162 @@
+# tests/test_matching.py
+import pytest
+
+from cache import TTLCache
+from matching import (
+    MATCH_MIN_SIMILARITY, ShopMatcher, match_shops, name_similarity, normalize_shop_name, shop_clusters,
+)
+from spot import Spot
+
+NAGOYA = (35.1709, 136.8815)
+M = 1 / 111_000     # 南北 1m ぶんの緯度
+
+
+def _hp(name: str, north_m: float = 0.0, east_m: float = 0.0, hotpepper_id: str = None,
+        located: bool = True) -> Spot:
+    # located=False は座標の取れなかった店（Hotpepper は 0, 0 で返す）
+    lat, lng = (NAGOYA[0] + north_m * M, NAGOYA[1] + east_m * M / 0.817) if located else (0.0, 0.0)
+    return Spot(spot_type="restaurant", name=name, address="愛知県名古屋市中村区", lat=lat, lng=lng,
+                genre="居酒屋", source="hotpepper", hotpepper_id=hotpepper_id)
+
+
+def _google(name: str, place_id: str, north_m: float = 0.0, east_m: float = 0.0) -> Spot:
+    return Spot(spot_type="restaurant", name=name, address="中村区名駅", lat=NAGOYA[0] + north_m * M,
+                lng=NAGOYA[1] + east_m * M / 0.817, genre="restaurant", source="google", place_id=place_id)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("麺屋 はなび　名駅店（旧店舗）", "麺屋はなび名駅店"),
+    ("ＢＡＲ　ｋｅｉ！", "barkei"),
+    ("【個室】焼肉 ぼくり", "焼肉ぼくり"),
+    ("ｶﾌｪ ﾗﾃ", "カフェラテ"),
+    ("カフェ・ド・クリエ", "カフェドクリエ"),
+    ("ラーメン（醤油）と[餃子]", "ラーメンと"),
+    ("「」", ""),
+    ("　 ", ""),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_shop_name(name, expected):
+    assert normalize_shop_name(name) == expected
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    # 表記ゆれだけなら同じ店
+    ("麺屋 はなび　名駅店（旧店舗）", "麺屋はなび 名駅店", 1.0),
+    ("ＣＯＦＦＥＥ　ＨＯＵＳＥ", "coffee house", 1.0),
+    # 支店名の有無は含まれる方を 0.85 まで引き上げる
+    ("麺屋はなび 名駅店", "麺屋はなび", 0.85),
+    ("矢場とん 矢場町本店", "矢場とん", 0.85),
+    ("Bar K", "Bar Kei", 0.85),
+    # 2文字以下は含まれていても引き上げない
+    ("寿司", "寿司処 まつ", pytest.approx(0.571, abs=1e-3)),
+    # 比べられない名前は 0
+    ("", "麺屋はなび", 0.0),
+    ("【禁煙】", "麺屋はなび", 0.0),
+    ("鳥貴族 名駅店", "とりきぞく", 0.0),
+])
+def test_name_similarity(a, b, expected):
+    assert name_similarity(a, b) == expected
+    assert name_similarity(b, a) == expected
+
+
+@pytest.mark.parametrize("a, b", [
+    ("スターバックス コーヒー 名古屋駅店", "スターバックスコーヒー JR名古屋駅店"),
+    ("コメダ珈琲店 名駅南店", "コメダ珈琲店 名駅西口店"),
+    ("世界の山ちゃん 本店", "世界の山ちゃん 名駅西口店"),
+    ("居酒屋 和", "居酒屋 わ"),        # 下限ちょうど（0.75）は通す
+])
+def test_similar_names_reach_threshold(a, b):
+    assert name_similarity(a, b) >= MATCH_MIN_SIMILARITY
+
+
+@pytest.mark.parametrize("a, b", [
+    ("ラーメン 亀島", "ラーメン 蓮"),
+    ("寿司", "寿司処 まつ"),
+    ("焼肉 ぼくり", "焼鳥 とりまる"),
+])
+def test_different_shops_stay_below_threshold(a, b):
+    assert name_similarity(a, b) < MATCH_MIN_SIMILARITY
+
+
+def test_match_is_greedy_and_one_to_one():
+    hp = [
+        _hp("コメダ珈琲店 名駅南店", north_m=0),
+        _hp("コメダ珈琲店 名駅西口店", north_m=60),
+        _hp("麺屋はなび 名駅店", north_m=-40),
+    ]
+    candidates = [
+        _google("コメダ珈琲店 名駅西口店", "p-west", north_m=55),
+        _google("コメダ珈琲店 名駅南店", "p-south", north_m=5),
+        _google("麺屋はなび", "p-hanabi", north_m=-30),
+        # 同じ place_id が2回（別ページ・別クエリ）返っても1店にしか割り当てない
+        _google("麺屋はなび 名駅店", "p-hanabi", north_m=-30),
+    ]
+    matched = match_shops(hp, candidates)
+
+    assert {i: c.place_id for i, c in matched.items()} == {0: "p-south", 1: "p-west", 2: "p-hanabi"}
+    # 完全一致（1.0）の組が支店名なし（0.85）より先に決まる
+    assert matched[2].name == "麺屋はなび 名駅店"
+
+
+def test_best_pair_wins_and_the_loser_is_left_unmatched():
+    # Google 側に1店しか無ければ、名前の近い方の Hotpepper の店だけが取る
+    hp = [_hp("世界の山ちゃん 本店"), _hp("世界の山ちゃん 名駅西口店", north_m=10)]
+    candidates = [_google("世界の山ちゃん 名駅西口店", "p-yama", north_m=10)]
+
+    assert {i: c.place_id for i, c in match_shops(hp, candidates).items()} == {1: "p-yama"}
+
+
+def test_same_name_prefers_the_closer_candidate():
+    hp = [_hp("矢場とん")]
+    candidates = [_google("矢場とん", "p-far", north_m=200), _google("矢場とん", "p-near", north_m=20)]
+
+    assert match_shops(hp, candidates)[0].place_id == "p-near"
+
+
+@pytest.mark.parametrize("hp, candidate", [
+    (_hp("ラーメン 亀島"), _google("ラーメン 蓮", "p-ren", north_m=5)),            # 名前が違う
+    (_hp("麺屋はなび 名駅店"), _google("麺屋はなび 名駅店", "p-far", north_m=300)),  # 離れすぎ
+    (_hp("麺屋はなび", located=False), _google("麺屋はなび", "p-nocoords")),                                # 座標なし
+    (_hp("麺屋はなび"), _google("麺屋はなび", None)),                               # place_id なし
+])
+def test_rejected_pairs(hp, candidate):
+    assert match_shops([hp], [candidate]) == {}
+
+
+def test_clusters_cover_dense_spots_first():
+    hp = [
+        _hp("A", north_m=0), _hp("B", north_m=80), _hp("C", north_m=160),   # 駅前に3店
+        _hp("D", north_m=1000), _hp("E", north_m=1060),                     # 北に2店
+        _hp("F", east_m=3000),                                             # 離れた1店
+        _hp("G", located=False),                                           # 座標なし
+    ]
+    clusters = shop_clusters(hp, origin=NAGOYA, radius_m=120, max_searches=4)
+
+    assert [members for _, _, members in clusters] == [[0, 1, 2], [3, 4], [5]]
+    # 中心はその固まりの店の位置（3店をすべて 120m 内に入れるのは真ん中の B）
+    assert clusters[0][:2] == (hp[1].lat, hp[1].lng)
+
+
+def test_clusters_respect_max_searches_and_break_ties_toward_origin():
+    hp = [_hp("遠い店", north_m=2000), _hp("近い店", north_m=200), _hp("中間の店", north_m=1000)]
+
+    clusters = shop_clusters(hp, origin=NAGOYA, radius_m=50, max_searches=2)
+    assert [members for _, _, members in clusters] == [[1], [2]]
+
+    # origin が無ければ入力順
+    clusters = shop_clusters(hp, radius_m=50, max_searches=2)
+    assert [members for _, _, members in clusters] == [[0], [1]]
+
+
+def test_clusters_without_coordinates():
+    assert shop_clusters([_hp("A", located=False), _hp("B", located=False)]) == []
+
+
+def test_matcher_remembers_matches():
+    matcher = ShopMatcher(TTLCache(100, 3600, name="shop_place"))
+    hp = [_hp("麺屋はなび 名駅店", hotpepper_id="J0001"), _hp("ラーメン 亀島", hotpepper_id="J0002")]
+    found = matcher.match(hp, [_google("麺屋はなび", "p-hanabi", north_m=10), _google("ラーメン 蓮", "p-ren")])
+
+    assert {i: pid for i, (pid, _) in found.items()} == {0: "p-hanabi"}
+    assert matcher.known(hp) == {0: ("p-hanabi", None)}
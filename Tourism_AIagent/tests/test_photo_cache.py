@@ -0,0 +1,90 @@
+# tests/test_photo_cache.py
+import os
+
+import pytest
+
+from photo_cache import PhotoCache, photo_cache_key
+
+SIZE = 1000
+
+
+def _keys(n: int):
+    return [photo_cache_key(f"https://maps.googleapis.com/maps/api/place/photo?photo_reference=ref{i}&maxwidth=800")
+            for i in range(n)]
+
+
+def _disk_bytes(cache: PhotoCache) -> int:
+    return sum(size for _, size, _ in cache._scan())
+
+
+def _backdate(cache: PhotoCache, key: str, mtime: float) -> None:
+    body_path, _ = cache._paths(key)
+    os.utime(body_path, (mtime, mtime))
+
+
+def test_eviction_drops_least_recently_used_and_stays_under_limit(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_bytes=5 * SIZE)
+    keys = _keys(6)
+    for i, key in enumerate(keys[:5]):
+        cache.store_bytes(key, bytes([i]) * SIZE, "image/jpeg")
+        _backdate(cache, key, 1_000_000_000 + i)
+    assert _disk_bytes(cache) == 5 * SIZE       # ちょうど上限までは消さない
+
+    # 最初に入れたものを読むと、最近使ったことになる
+    assert cache.read_bytes(keys[0]) == (bytes([0]) * SIZE, "image/jpeg")
+    cache.store_bytes(keys[5], b"x" * SIZE, "image/webp")
+
+    # 上限を超えたら、使われた時刻の古いものから上限の 9 割まで消す
+    assert _disk_bytes(cache) <= cache.max_bytes * 0.9
+    assert cache._approx_bytes == _disk_bytes(cache)
+    kept = [i for i, key in enumerate(keys) if cache.lookup(key) is not None]
+    assert kept == [0, 3, 4, 5]
+    # 本体と一緒にメタ情報も消える
+    for key in (keys[1], keys[2]):
+        assert not any(os.path.exists(p) for p in cache._paths(key))
+
+
+def test_many_writes_never_leave_the_cache_over_the_limit(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_bytes=8 * SIZE)
+    for i, key in enumerate(_keys(40)):
+        cache.store_bytes(key, b"p" * (SIZE + 37 * (i % 5)), "image/jpeg")
+        _backdate(cache, key, 1_000_000_000 + i)
+        assert _disk_bytes(cache) <= cache.max_bytes
+    # 残っているのは最後に書いたもの
+    assert cache.lookup(_keys(40)[-1]) is not None
+
+
+def test_existing_files_are_counted_on_start(tmp_path):
+    first = PhotoCache(str(tmp_path), max_bytes=10 * SIZE)
+    for key in _keys(4):
+        first.store_bytes(key, b"a" * SIZE, "image/jpeg")
+
+    # 再起動（別ワーカー）でもディスク上の分から数え始める
+    second = PhotoCache(str(tmp_path), max_bytes=4 * SIZE)
+    assert second._approx_bytes == 4 * SIZE
+    second.store_bytes(_keys(5)[4], b"b" * SIZE, "image/jpeg")
+    assert _disk_bytes(second) <= second.max_bytes
+
+
+def test_interrupted_stream_is_not_cached(tmp_path):
+    cache = PhotoCache(str(tmp_path), max_bytes=10 * SIZE)
+    key = _keys(1)[0]
+
+    def upstream():
+        yield b"a" * 100
+        raise ConnectionError("切断")
+
+    with pytest.raises(ConnectionError):
+        for _ in cache.store_stream(key, upstream(), "image/jpeg"):
+            pass
+
+    assert cache.lookup(key) is None
+    assert _disk_bytes(cache) == 0
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+
+def test_cache_key_ignores_api_key_and_separates_variants():
+    base = "https://maps.googleapis.com/maps/api/place/photo?photo_reference=abc&maxwidth=800"
+    assert photo_cache_key(base + "&key=AAA") == photo_cache_key(base + "&key=BBB")
+    assert photo_cache_key(base) != photo_cache_key(base.replace("800", "400"))
+    assert photo_cache_key(base) != photo_cache_key(base, variant="webp@480")
@@ -0,0 +1,95 @@
+# tests/test_rate_limiter.py
+import pytest
+
+from google_client import GooglePlacesClient
+from rate_limiter import ApiQuota, EndpointLimit, MemoryQuotaStore, QuotaExceeded, SqliteQuotaStore
+
+LIMITS = {"nearby": EndpointLimit(rate_per_sec=2, burst=3, cost_per_1000=32.0)}
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _quota(clock, store=None):
+    return ApiQuota(LIMITS, store=store or MemoryQuotaStore(), max_wait_sec=0, clock=clock)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryQuotaStore()
+    return SqliteQuotaStore(str(tmp_path / "quota.db"))
+
+
+def test_bucket_refills_at_rate(store):
+    clock = FakeClock()
+    quota = _quota(clock, store)
+
+    assert [quota.acquire("nearby") for _ in range(4)] == [True, True, True, False]
+
+    clock.now += 0.4           # 0.8 トークン分：まだ足りない
+    assert quota.acquire("nearby") is False
+    clock.now += 0.1           # 合わせて 1 トークン
+    assert quota.acquire("nearby") is True
+    assert quota.acquire("nearby") is False
+
+    clock.now += 60            # 長く空いても burst までしか貯まらない
+    assert [quota.acquire("nearby") for _ in range(4)] == [True, True, True, False]
+
+    stats = quota.stats()["nearby"]
+    assert stats["calls"] == 7
+    assert stats["denied"] == 4
+    assert stats["estimated_cost_usd"] == round(7 * 32.0 / 1000, 4)
+
+
+def test_over_limit_backs_off(store):
+    clock = FakeClock()
+    quota = _quota(clock, store)
+
+    quota.record_over_limit("nearby")
+    clock.now += 1.9
+    assert quota.acquire("nearby") is False
+    clock.now += 0.6
+    assert quota.acquire("nearby") is True
+    assert quota.stats()["nearby"]["over_limit"] == 1
+
+
+def test_unknown_endpoint_is_not_limited():
+    assert _quota(FakeClock()).acquire("geocode") is True
+
+
+def test_empty_bucket_raises_quota_exceeded_before_calling_api():
+    clock = FakeClock()
+    quota = _quota(clock)
+    client = GooglePlacesClient("key", quota=quota, base_url="http://127.0.0.1:9")
+    for _ in range(3):
+        assert quota.acquire("nearby")
+
+    # バケツが空なら HTTP を投げる前に見送る（接続先は存在しないポート）
+    with pytest.raises(QuotaExceeded):
+        client._get_json("nearby", client.PLACES_NEARBY_URL, {})
+    assert quota.stats()["nearby"]["denied"] == 1
+
+
+def test_two_stores_share_one_sqlite_file(tmp_path):
+    # 別ワーカーに見立てた2つの store が、同じファイルで1つのバケツと集計を共有する
+    path = str(tmp_path / "quota.db")
+    clock = FakeClock()
+    a = _quota(clock, SqliteQuotaStore(path))
+    b = _quota(clock, SqliteQuotaStore(path))
+
+    assert a.acquire("nearby") and b.acquire("nearby") and a.acquire("nearby")
+    assert b.acquire("nearby") is False
+    assert a.acquire("nearby") is False
+
+    clock.now += 0.5
+    assert b.acquire("nearby") is True
+    assert a.acquire("nearby") is False
+
+    assert a.stats()["nearby"]["calls"] == b.stats()["nearby"]["calls"] == 4
+    assert a.stats()["nearby"]["denied"] == 3
@@ -0,0 +1,103 @@
+# tests/test_reasoner.py
+from typing import Dict, Sequence
+
+import pytest
+
+import enrichment
+from cache import TTLCache
+from reasoner import BatchReasoner, Reason, ReasonerBackend, generate_reason_and_stay_time, reason_key
+from scoring_batch import apply_batch_scores, score_restaurants_batch
+from spot import Spot
+
+
+class StubBackend(ReasonerBackend):
+    """LLM の代役：受け取ったスポットに決まった文を返す"""
+
+    name = "stub"
+
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, spots: Sequence[Spot]) -> Dict[int, Reason]:
+        self.calls.append([s.name for s in spots])
+        return {i: (f"[LLM] {s.name}", 45) for i, s in enumerate(spots)}
+
+
+class FakeGoogle:
+    """hydrate_details が呼ぶところだけの Google クライアント（名前・座標は Hotpepper と変えて返す）"""
+
+    DETAILS_FIELDS = "full"
+    DETAILS_BASIC_FIELDS = "basic"
+    DETAILS_PHOTO_FIELDS = "photo"
+
+    def find_place_id(self, query, lat, lng):
+        return "pid_" + query.split()[0]
+
+    def get_place_details(self, place_id, fields=None):
+        return {
+            "place_id": place_id,
+            "name": place_id.replace("pid_", "") + "（Google）",
+            "formatted_address": "日本、〒450-0002 愛知県名古屋市中村区名駅",
+            "geometry": {"location": {"lat": 35.1709, "lng": 136.8815}},
+            "rating": 4.1,
+            "user_ratings_total": 120,
+            "types": ["restaurant"],
+            "photos": [{"photo_reference": "ref_" + place_id}],
+        }
+
+    def get_photo_url(self, ref):
+        return "https://example.com/photo/" + ref
+
+
+def _scored_shops():
+    shops = [
+        {"id": "J001", "name": "麺屋 はなび 名駅店", "address": "愛知県名古屋市中村区名駅4", "lat": "35.1705", "lng": "136.8820",
+         "genre": {"name": "ラーメン"}, "budget": {"name": "～1000円"}},
+        {"id": "J002", "name": "味噌煮込みうどん 山本屋", "address": "愛知県名古屋市中村区名駅3", "lat": "35.1712", "lng": "136.8801",
+         "genre": {"name": "和食"}, "budget": {"name": "1001～1500円"}},
+    ]
+    spots = [Spot.from_hotpepper_json(shop) for shop in shops]
+    # 2件目は place_id が分かっていて、詳細（名前・座標）だけ後から取る
+    spots[1].place_id = "pid_山本屋"
+    spots[1].details_pending = True
+    spots[0].details_pending = True
+    ranked = apply_batch_scores(spots, score_restaurants_batch(spots, "balance", (35.1709, 136.8815)))
+    for spot in ranked:
+        generate_reason_and_stay_time(spot)
+    return ranked
+
+
+def test_reasons_are_found_after_details_hydration():
+    # submit → 詳細の取得（place_id・名前・座標が変わる）→ ページのキーで lookup、の順でも届いた文が見つかる
+    backend = StubBackend()
+    reasoner = BatchReasoner(backend, TTLCache(100, 3600, name="reason"))
+    ranked = _scored_shops()
+
+    assert reasoner.submit(ranked) == 2
+    enrichment.hydrate_details(FakeGoogle(), ranked, max_workers=2)
+    reasoner._pool.shutdown(wait=True)
+
+    assert all(s.place_id for s in ranked)
+    assert all(not s.details_pending for s in ranked)
+    found = reasoner.lookup([reason_key(s) for s in ranked])
+    assert len(found) == 2
+    assert reasoner.apply_cached(ranked) == 2
+    assert [s.reason for s in ranked] == [f"[LLM] {name}" for name in backend.calls[0]]
+    assert [s.stay_time_minutes for s in ranked] == [45, 45]
+
+
+def test_cached_reasons_are_not_sent_again():
+    backend = StubBackend()
+    reasoner = BatchReasoner(backend, TTLCache(100, 3600, name="reason"))
+    reasoner.submit(_scored_shops())
+    reasoner._pool.shutdown(wait=True)
+
+    ranked = _scored_shops()
+    assert reasoner.submit(ranked) == 0
+    assert len(backend.calls) == 1
+    assert all(s.reason.startswith("[LLM]") for s in ranked)
+
+
+def test_backend_must_implement_generate():
+    with pytest.raises(TypeError):
+        ReasonerBackend()
@@ -0,0 +1,129 @@
+# tests/test_scoring_batch.py
+import math
+from dataclasses import fields
+
+import numpy as np
+import pytest
+
+from scoring_batch import (
+    EARTH_RADIUS_KM, apply_batch_scores, budget_scores, distance_scores, popularity_scores,
+    score_places_batch, score_restaurants_batch, walking_distance_scores,
+)
+from scoring_place import PLACE_WEIGHTS, calc_place_scores, distance_score_km, popularity_score
+from scoring_restaurant import RESTAURANT_WEIGHTS, budget_score, calc_restaurant_scores, walking_distance_score
+from spot import ScoreBreakdown, Spot
+from spot_batch import SpotBatch
+
+ORIGIN = (35.681236, 139.767125)   # 東京駅
+
+# 各段階の境界ちょうどと、その前後
+RATINGS = [None, 0.0, 3.4, 3.49, 3.5, 3.99, 4.0, 4.49, 4.5, 5.0]
+REVIEWS = [None, 0, 99, 100, 299, 300, 999, 1000, 25000]
+BUDGETS = [0, 1, 999, 1000, 1001, 2000, 2001, 3000, 3001, 5000, 5001, 30000]
+PLACE_KM = [0.0, 0.999, 1.0, 1.001, 2.999, 3.0, 3.001, 5.0, 5.001, 10.0, 10.001, 40.0]
+WALKING_KM = [0.0, 0.299, 0.3, 0.301, 0.5, 0.501, 0.999, 1.0, 1.001, 2.0, 2.001, 8.0]
+
+
+def _north_of(km: float):
+    """ORIGIN から真北に km 離れた座標"""
+    return ORIGIN[0] + math.degrees(km / EARTH_RADIUS_KM), ORIGIN[1]
+
+
+def _place(i: int, rating=None, reviews=None, km=0.5, types="tourist_attraction,museum") -> Spot:
+    lat, lng = _north_of(km)
+    return Spot(spot_type="place", name=f"スポット{i}", address="東京都千代田区", lat=lat, lng=lng,
+                genre="観光", rating=rating, reviews_count=reviews, place_types=types)
+
+
+def _restaurant(i: int, budget=0, km=None, private_room=False, wifi=False, parking=False, desc_len=0) -> Spot:
+    lat, lng = _north_of(km) if km is not None else (0.0, 0.0)
+    return Spot(spot_type="restaurant", name=f"居酒屋{i}", address="東京都千代田区", lat=lat, lng=lng,
+                genre="居酒屋", budget_yen=budget, private_room=private_room, wifi=wifi,
+                parking=parking, desc_len=desc_len, source="hotpepper")
+
+
+def _place_cases(axis: str):
+    if axis == "rating":
+        return [_place(i, rating=r, reviews=150) for i, r in enumerate(RATINGS)]
+    if axis == "reviews":
+        return [_place(i, rating=4.2, reviews=n) for i, n in enumerate(REVIEWS)]
+    if axis == "distance":
+        return [_place(i, rating=3.8, reviews=10, km=km) for i, km in enumerate(PLACE_KM)]
+    # ジャンルの一致・不一致・types なし
+    return [_place(i, types=t) for i, t in enumerate(["museum", "park,point_of_interest", "", "art_gallery"])]
+
+
+def _restaurant_cases(axis: str):
+    if axis == "budget":
+        return [_restaurant(i, budget=b, km=0.4) for i, b in enumerate(BUDGETS)]
+    if axis == "distance":
+        return [_restaurant(i, budget=1500, km=km) for i, km in enumerate(WALKING_KM)] + [_restaurant(99)]
+    # 設備と紹介文の長さ
+    return [
+        _restaurant(i, km=0.4, private_room=p, wifi=w, parking=k, desc_len=d)
+        for i, (p, w, k, d) in enumerate([
+            (False, False, False, 0), (True, False, False, 49), (False, True, False, 50),
+            (False, False, True, 119), (True, True, True, 120), (True, False, True, 500),
+        ])
+    ]
+
+
+def _assert_same(scalar, batch):
+    # 同点の並びも calc_*_scores → 安定ソートと同じになる
+    assert [s.name for s in batch] == [s.name for s in scalar]
+    for s, b in zip(scalar, batch):
+        for f in fields(ScoreBreakdown):
+            assert getattr(b.score_breakdown, f.name) == getattr(s.score_breakdown, f.name), (s.name, f.name)
+        assert b.total_score == s.total_score, s.name
+
+
+def _scalar_ranked(spots):
+    return sorted(spots, key=lambda s: s.total_score, reverse=True)
+
+
+@pytest.mark.parametrize("priority", [*PLACE_WEIGHTS, "unknown"])
+@pytest.mark.parametrize("axis", ["rating", "reviews", "distance", "genre"])
+def test_place_batch_matches_scalar(axis, priority):
+    spots = _place_cases(axis)
+    genres = ["museum", "art_gallery"]
+    scalar = _scalar_ranked([calc_place_scores(s.clone(), priority, *ORIGIN, genres) for s in spots])
+
+    scores = score_places_batch(spots, priority, *ORIGIN, genres)
+    _assert_same(scalar, apply_batch_scores([s.clone() for s in spots], scores))
+    _assert_same(scalar, apply_batch_scores(SpotBatch.from_spots(spots), scores).to_spots())
+
+
+@pytest.mark.parametrize("priority", [*RESTAURANT_WEIGHTS, "unknown"])
+@pytest.mark.parametrize("axis", ["budget", "distance", "quality"])
+@pytest.mark.parametrize("origin", [ORIGIN, None], ids=["origin", "no_origin"])
+def test_restaurant_batch_matches_scalar(axis, priority, origin):
+    spots = _restaurant_cases(axis)
+    scalar = _scalar_ranked([calc_restaurant_scores(s.clone(), priority, origin) for s in spots])
+
+    scores = score_restaurants_batch(spots, priority, origin)
+    _assert_same(scalar, apply_batch_scores([s.clone() for s in spots], scores))
+    _assert_same(scalar, apply_batch_scores(SpotBatch.from_spots(spots), scores).to_spots())
+
+
+# 段階の関数を境界ちょうどの値で直接くらべる（座標からの距離計算の誤差を挟まない）
+
+@pytest.mark.parametrize("rating", RATINGS)
+@pytest.mark.parametrize("reviews", [n for n in REVIEWS if n is not None])
+def test_popularity_tiers(rating, reviews):
+    batch = popularity_scores(np.array([np.nan if rating is None else rating]), np.array([reviews]))
+    assert int(batch[0]) == popularity_score(rating, reviews)
+
+
+@pytest.mark.parametrize("km", PLACE_KM)
+def test_distance_tiers(km):
+    assert int(distance_scores(np.array([km]))[0]) == distance_score_km(km)
+
+
+@pytest.mark.parametrize("km", WALKING_KM)
+def test_walking_distance_tiers(km):
+    assert int(walking_distance_scores(np.array([km]))[0]) == walking_distance_score(km)
+
+
+@pytest.mark.parametrize("budget", BUDGETS)
+def test_budget_tiers(budget):
+    assert int(budget_scores(np.array([budget]))[0]) == budget_score(budget)
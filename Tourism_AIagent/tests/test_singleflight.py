@@ -0,0 +1,142 @@
+# tests/test_singleflight.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+WAITERS = 8
+
+
+def _wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timeout")
+        time.sleep(0.005)
+
+
+def _run_together(flight: SingleFlight, fn):
+    """1つ目の呼び出しが fn の中にいる間に、残りの呼び出しがすべて待ちに入るようにして同時に呼ぶ"""
+    release = threading.Event()
+    calls = []
+
+    def leader_fn():
+        calls.append(threading.current_thread().name)
+        release.wait(5)
+        return fn()
+
+    def call():
+        try:
+            return flight.do("名古屋駅:ramen", leader_fn)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=WAITERS) as pool:
+        futures = [pool.submit(call)]
+        _wait_until(lambda: calls)
+        futures += [pool.submit(call) for _ in range(WAITERS - 1)]
+        _wait_until(lambda: flight.stats()["shared"] == WAITERS - 1)
+        release.set()
+        results = [f.result() for f in futures]
+    return calls, results
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls, results = _run_together(flight, lambda: ["スポットA", "スポットB"])
+
+    assert len(calls) == 1
+    assert [r for r, _ in results] == [["スポットA", "スポットB"]] * WAITERS
+    # 同じオブジェクトを共有する
+    assert all(r is results[0][0] for r, _ in results)
+    assert [leader for _, leader in results].count(True) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "shared": WAITERS - 1}
+
+
+def test_exception_reaches_every_waiter():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("Nearby Search が失敗")
+
+    calls, results = _run_together(flight, fail)
+
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "Nearby Search が失敗" for r in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_finished_key_runs_again():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == (1, True)
+    assert flight.do("k", lambda: 2) == (2, True)
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: int("x"))
+    assert flight.do("k", lambda: 3) == (3, True)
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        slow = pool.submit(flight.do, "a", lambda: release.wait(5) and "a")
+        _wait_until(lambda: flight.stats()["in_flight"] == 1)
+        assert flight.do("b", lambda: "b") == ("b", True)
+        release.set()
+        assert slow.result() == ("a", True)
+
+
+def test_async_callers_share_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"name": "名古屋城"}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fetch) for _ in range(WAITERS)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == [{"name": "名古屋城"}] * WAITERS
+    assert [leader for _, leader in results].count(True) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "shared": WAITERS - 1}
+
+
+def test_async_exception_reaches_every_waiter():
+    flight = AsyncSingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("details が失敗")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fail) for _ in range(WAITERS)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_async_waiter_cancel_does_not_stop_the_leader():
+    flight = AsyncSingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await leader, waiter.cancelled()
+
+    assert asyncio.run(main()) == (("ok", True), True)
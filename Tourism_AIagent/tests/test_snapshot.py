@@ -0,0 +1,141 @@
+# tests/test_snapshot.py
+import math
+import os
+
+import numpy as np
+import pytest
+
+from cache import MISSING, SqliteBackend
+from snapshot import Snapshot, SnapshotError, SnapshotWriter, build_from_caches, open_snapshot
+from spot import ScoreBreakdown, Spot
+from spot_batch import SpotBatch
+
+
+def _spots():
+    return [
+        Spot(spot_type="place", name="浅草寺", address="東京都台東区浅草2-3-1", lat=35.7148, lng=139.7967,
+             genre="寺院", rating=4.5, reviews_count=60000, place_id="ChIJ-sensoji", place_types="place_of_worship",
+             total_score=4.2, stay_time_minutes=60,
+             score_breakdown=ScoreBreakdown(popularity_score=8, genre_score=3, distance_score=5, distance_km=0.8,
+                                            weight_popularity=1/3, weight_genre=1/3, weight_distance=1/3)),
+        Spot(spot_type="restaurant", name="天丼 てんや 浅草店", address="東京都台東区浅草1-1-1", lat=35.7110, lng=139.7960,
+             genre="和食", source="hotpepper", hotpepper_id="J000111222", budget_yen=1000, wifi=True, desc_len=30),
+        Spot(spot_type="place", name="隅田公園", address="", lat=35.7120, lng=139.8010, genre="公園"),
+    ]
+
+
+def _write(tmp_path, build, name="snap.bin"):
+    writer = SnapshotWriter()
+    build(writer)
+    path = str(tmp_path / name)
+    size = writer.write(path)
+    return path, size
+
+
+def test_spots_round_trip(tmp_path):
+    spots = _spots()
+    path, size = _write(tmp_path, lambda w: (
+        w.add_spots("list", spots),
+        w.add_spots("batch", SpotBatch.from_spots(list(reversed(spots)))),
+    ))
+    snap = Snapshot(path)
+
+    assert os.path.getsize(path) == size
+    assert snap.spots("list").to_spots() == spots
+    assert snap.spots("batch").to_spots() == list(reversed(spots))
+    # 配列は mmap の上を指す読み取り専用のもの（コピーしない）
+    assert not snap.spots("list").lat.flags.writeable
+    assert snap.names("spots") == ["batch", "list"]
+    snap.close()
+
+
+def test_tables_and_coords_round_trip(tmp_path):
+    path, _ = _write(tmp_path, lambda w: (
+        w.add_table("details", [
+            ("ChIJ-b", {"name": "東京タワー", "rating": 4.4}, math.inf),
+            ("ChIJ-a", ["写真", None], math.inf),
+            ("ChIJ-old", "期限切れ", 100.0),
+            ("ChIJ-none", None, math.inf),
+        ]),
+        w.add_coords("stations", [("東京", 35.6812, 139.7671), ("上野", 35.7138, 139.7773)]),
+    ))
+    snap = Snapshot(path)
+    table = snap.table("details")
+
+    assert list(table.keys()) == ["ChIJ-a", "ChIJ-b", "ChIJ-none", "ChIJ-old"]
+    assert table.get("ChIJ-b") == {"name": "東京タワー", "rating": 4.4}
+    assert table.get("ChIJ-a") == ["写真", None]
+    # None も「結果なし」として入っている値で、無いキー（MISSING）とは別
+    assert table.get("ChIJ-none") is None
+    assert table.get("ChIJ-old") is MISSING
+    assert table.get("ChIJ-old", now=99.0) == "期限切れ"
+    assert table.get("ChIJ-zzz") is MISSING and "ChIJ-zzz" not in table
+
+    stations = snap.coords("stations")
+    assert stations.lookup("上野") == (35.7138, 139.7773)
+    assert stations.lookup("品川") is None
+    assert snap.info()["tables"] == {"details": 4}
+    snap.close()
+
+
+@pytest.mark.parametrize("build", [
+    lambda w: w.add_table("empty", []),
+    lambda w: w.add_coords("empty", []),
+    lambda w: w.add_spots("empty", []),
+    lambda w: None,
+], ids=["empty_table", "empty_coords", "empty_spots", "nothing"])
+def test_empty_last_array_is_padded(tmp_path, build):
+    # 文字列が無いと最後の配列（heap/bytes）が空になる。ファイルは目次どおりの長さまで伸ばす
+    path, size = _write(tmp_path, build)
+
+    assert os.path.getsize(path) == size
+    snap = Snapshot(path)
+    assert len(snap.strings) == 0
+    assert snap.array("heap/bytes").size == 0
+    for kind in ("table", "coords", "spots"):
+        for name in snap.names(kind):
+            assert len(getattr(snap, kind)(name)) == 0
+    snap.close()
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path, size = _write(tmp_path, lambda w: w.add_spots("spots", _spots()))
+    with open(path, "r+b") as f:
+        f.truncate(size - 64)
+
+    with pytest.raises(SnapshotError):
+        Snapshot(path)
+    assert open_snapshot(path) is None
+
+
+@pytest.mark.parametrize("content", [b"", b"xx" * 20, b"NOTSNAP!" + bytes(8)])
+def test_not_a_snapshot(tmp_path, content):
+    path = tmp_path / "bad.bin"
+    path.write_bytes(content)
+
+    with pytest.raises(SnapshotError):
+        Snapshot(str(path))
+    assert open_snapshot(str(path)) is None
+
+
+def test_open_snapshot_without_file():
+    assert open_snapshot("") is None
+    assert open_snapshot("/nonexistent/snapshot.bin") is None
+
+
+def test_build_from_cache_db(tmp_path):
+    db = str(tmp_path / "cache.db")
+    backend = SqliteBackend(db)
+    backend.set("details:ChIJ-x", {"name": "国立西洋美術館"}, expires_at=4e9)
+    backend.set("place_id:上野 美術館", "ChIJ-x", expires_at=4e9)
+    backend.set("details:ChIJ-old", {"name": "閉館"}, expires_at=1.0)
+
+    out = str(tmp_path / "snap.bin")
+    build_from_caches(out, db, None)
+    snap = Snapshot(out)
+
+    assert snap.table("details").get("ChIJ-x") == {"name": "国立西洋美術館"}
+    assert "ChIJ-old" not in snap.table("details")
+    assert snap.table("place_id").get("上野 美術館") == "ChIJ-x"
+    assert np.all(snap.table("details").expires_at > 1.0)
+    snap.close()
@@ -0,0 +1,85 @@
+# tests/test_spatial_index.py
+from spatial_index import SpotIndex
+from spot import Spot
+
+KYOTO = (34.9858, 135.7588)     # 京都駅
+M = 1 / 111_000                 # 南北 1m ぶんの緯度
+
+
+def _spot(name: str, north_m: float, place_id: str) -> Spot:
+    return Spot(spot_type="place", name=name, address="京都市", lat=KYOTO[0] + north_m * M, lng=KYOTO[1],
+                genre="寺院", place_id=place_id, place_types="tourist_attraction")
+
+
+SPOTS = [
+    _spot("東本願寺", 500, "p-higashi"),
+    _spot("京都タワー", 100, "p-tower"),
+    _spot("西本願寺", 1100, "p-nishi"),
+    _spot("伏見稲荷大社", -2900, "p-inari"),
+]
+
+
+def test_circle_inside_a_fetched_circle_is_served_locally():
+    index = SpotIndex()
+    index.add("tourist_attraction", SPOTS, *KYOTO, radius_m=3000)
+
+    # 同じ円・中に入る小さな円はヒット（半径内のものだけを、登録順で返す）
+    assert [s.name for s in index.query("tourist_attraction", *KYOTO, radius_m=3000)] == [
+        "東本願寺", "京都タワー", "西本願寺", "伏見稲荷大社"]
+    inner = index.query("tourist_attraction", KYOTO[0] + 500 * M, KYOTO[1], radius_m=700)
+    assert [s.name for s in inner] == ["東本願寺", "京都タワー", "西本願寺"]
+    assert index.stats()["hits"] == 2
+
+
+def test_circle_sticking_out_is_a_miss():
+    index = SpotIndex()
+    index.add("tourist_attraction", SPOTS, *KYOTO, radius_m=1000)
+
+    assert index.query("tourist_attraction", *KYOTO, radius_m=1001) is None
+    assert index.query("tourist_attraction", KYOTO[0] + 600 * M, KYOTO[1], radius_m=500) is None
+    assert index.query("museum", *KYOTO, radius_m=100) is None
+    assert index.stats()["misses"] == 3
+
+
+def test_incomplete_fetch_is_not_coverage():
+    # 件数・ページ・時間で途中までしか取れなかった円は、その中の一部しか持っていない
+    index = SpotIndex()
+    index.add("tourist_attraction", SPOTS[:2], *KYOTO, radius_m=3000, complete=False)
+
+    assert index.query("tourist_attraction", *KYOTO, radius_m=500) is None
+    assert index.stats() == {"spots": 2, "covered_areas": 0, "hits": 0, "misses": 1}
+
+    # 後から完全に取れた円があれば、先に入れた Spot もそこから返す
+    index.add("tourist_attraction", SPOTS[2:], *KYOTO, radius_m=3000)
+    assert [s.place_id for s in index.query("tourist_attraction", *KYOTO, radius_m=3000)] == [
+        "p-higashi", "p-tower", "p-nishi", "p-inari"]
+
+
+def test_coverage_from_a_neighbouring_cell():
+    # 取得済み円の中心が別のセルにあっても見つける（セルは 0.01 度 ≒ 1.1km）
+    index = SpotIndex(cell_deg=0.01)
+    index.add("tourist_attraction", SPOTS, *KYOTO, radius_m=5000)
+
+    found = index.query("tourist_attraction", KYOTO[0] - 2900 * M, KYOTO[1], radius_m=1000)
+    assert [s.name for s in found] == ["伏見稲荷大社"]
+
+
+def test_same_spot_is_kept_once():
+    index = SpotIndex()
+    index.add("tourist_attraction", SPOTS, *KYOTO, radius_m=3000)
+    index.add("tourist_attraction", SPOTS[:1], *KYOTO, radius_m=3000)
+
+    assert index.stats()["spots"] == len(SPOTS)
+    assert len(index.query("tourist_attraction", *KYOTO, radius_m=3000)) == len(SPOTS)
+
+
+def test_old_coverage_is_ignored():
+    index = SpotIndex(max_age_sec=60)
+    index.add("tourist_attraction", SPOTS, *KYOTO, radius_m=3000)
+    # 登録時刻を古くしたことにする
+    for coverage in index._coverage["tourist_attraction"].values():
+        coverage[:] = [(lat, lng, r, t - 61) for lat, lng, r, t in coverage]
+
+    assert index.query("tourist_attraction", *KYOTO, radius_m=100) is None
+    index.purge()
+    assert index.stats()["covered_areas"] == 0
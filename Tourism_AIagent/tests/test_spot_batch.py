@@ -0,0 +1,131 @@
+# tests/test_spot_batch.py
+import numpy as np
+import pytest
+
+from spot import ScoreBreakdown, Spot
+from spot_batch import BREAKDOWN_COLUMNS, FLAG_COLUMNS, NO_VALUE, SpotBatch, StringTable
+
+
+def _spots():
+    return [
+        # 採点前の Hotpepper の店（評価・口コミなし、内訳なし）
+        Spot(spot_type="restaurant", name="炭火焼鳥 とりまる", address="東京都新宿区西新宿1-1-1",
+             lat=35.6909, lng=139.6995, genre="居酒屋", source="hotpepper", hotpepper_id="J001234567",
+             budget_yen=3000, private_room=True, parking=True, desc_len=64, details_pending=True),
+        # 採点済みの観光地（評価 0.0・口コミ 0・滞在 0 は None と区別する）
+        Spot(spot_type="place", name="新宿御苑", address="東京都新宿区内藤町11", lat=35.6852, lng=139.7101,
+             genre="公園", rating=0.0, reviews_count=0, place_id="ChIJ-gyoen", place_types="park,point_of_interest",
+             stay_time_minutes=0, total_score=0.0, reason="都心の大きな庭園",
+             score_breakdown=ScoreBreakdown(popularity_score=3, genre_score=1, distance_score=5, distance_km=0.0,
+                                            weight_popularity=0.6, weight_genre=0.2, weight_distance=0.2)),
+        # 採点済みの飲食店（内訳の一部だけ埋まっている）
+        Spot(spot_type="restaurant", name="ラーメン 一心", address="東京都新宿区新宿3-2-1", lat=35.6905, lng=139.7040,
+             genre="ラーメン", rating=4.5, reviews_count=1200, wifi=True, stay_time_minutes=45, total_score=3.6,
+             score_breakdown=ScoreBreakdown(budget_score=5, quality_score=1, distance_score=4, distance_km=0.44,
+                                            weight_budget=0.2, weight_quality=0.2, weight_distance=0.6)),
+        # 座標なし・文字列の None だらけ
+        Spot(spot_type="place", name="名無しの寺", address="", lat=0.0, lng=0.0, genre="",
+             description=None, image_url=None, place_id=None),
+    ]
+
+
+def test_round_trip_keeps_every_field():
+    spots = _spots()
+    assert SpotBatch.from_spots(spots).to_spots() == spots
+
+
+def test_none_and_zero_are_kept_apart():
+    batch = SpotBatch.from_spots(_spots())
+
+    assert np.isnan(batch.rating[0]) and batch.rating[1] == 0.0
+    assert batch.reviews_count[0] == NO_VALUE and batch.reviews_count[1] == 0
+    assert batch.stay_time_minutes[0] == NO_VALUE and batch.stay_time_minutes[1] == 0
+    assert np.isnan(batch.total_score[0]) and batch.total_score[1] == 0.0
+
+    back = batch.to_spots()
+    assert (back[0].rating, back[0].reviews_count, back[0].stay_time_minutes, back[0].total_score) == (None,) * 4
+    assert (back[1].rating, back[1].reviews_count, back[1].stay_time_minutes, back[1].total_score) == (0.0, 0, 0, 0.0)
+
+
+def test_flag_bits():
+    batch = SpotBatch.from_spots(_spots())
+    assert batch.flag("details_pending").tolist() == [True, False, False, False]
+    assert batch.flag("private_room").tolist() == [True, False, False, False]
+    assert batch.flag("wifi").tolist() == [False, False, True, False]
+    assert batch.flag("parking").tolist() == [True, False, False, False]
+    assert batch.flags[0] == sum(1 << FLAG_COLUMNS.index(n) for n in ("details_pending", "private_room", "parking"))
+
+
+def test_breakdown_scores_come_back_as_int_and_the_rest_as_float():
+    back = SpotBatch.from_spots(_spots()).to_spots()
+    restaurant = back[2].score_breakdown
+
+    for name, value in restaurant.items():
+        if name.endswith("_score"):
+            assert type(value) is int, name
+        else:
+            assert type(value) is float, name
+    assert restaurant.distance_km == 0.44
+    assert restaurant.popularity_score is None and restaurant.weight_genre is None
+    # 0 の内訳（distance_km=0.0）も None にならない
+    assert back[1].score_breakdown.distance_km == 0.0
+
+
+def test_rows_without_breakdown_stay_none():
+    batch = SpotBatch.from_spots(_spots())
+    assert batch.has_breakdown.tolist() == [False, True, True, False]
+    assert np.isnan(batch.breakdown[0]).all()
+
+    back = batch.to_spots()
+    assert back[0].score_breakdown is None and back[3].score_breakdown is None
+
+
+def test_batch_without_any_breakdown_has_no_array():
+    spots = [_spots()[0], _spots()[3]]
+    batch = SpotBatch.from_spots(spots)
+
+    assert batch.breakdown is None
+    assert batch.take([1, 0]).breakdown is None
+    assert batch.to_spots() == spots
+    assert batch.nbytes > 0
+
+
+def test_empty_batch():
+    batch = SpotBatch.from_spots([])
+
+    assert len(batch) == 0
+    assert batch.breakdown is None
+    assert batch.to_spots() == []
+    assert batch.take([]).to_spots() == []
+
+
+@pytest.mark.parametrize("indices", [[2, 0], [1, 1, 3], [3, 2, 1, 0], []])
+def test_take_picks_rows_in_order(indices):
+    spots = _spots()
+    batch = SpotBatch.from_spots(spots)
+    taken = batch.take(indices)
+
+    assert taken.strings is batch.strings
+    assert taken.to_spots() == [spots[i] for i in indices]
+    for i, j in enumerate(indices):
+        assert taken.spot(i) == spots[j]
+
+
+def test_take_does_not_write_through():
+    batch = SpotBatch.from_spots(_spots())
+    taken = batch.take([1])
+    taken.total_score[0] = 9.9
+    taken.breakdown[0, BREAKDOWN_COLUMNS.index("genre_score")] = 3
+
+    assert batch.total_score[1] == 0.0
+    assert batch.spot(1).score_breakdown.genre_score == 1
+
+
+def test_strings_are_shared_across_batches():
+    strings = StringTable()
+    a = SpotBatch.from_spots(_spots()[:2], strings)
+    b = SpotBatch.from_spots(_spots()[1:], strings)
+
+    assert a.text[1].tolist() == b.text[0].tolist()
+    assert b.column("name") == [s.name for s in _spots()[1:]]
+    assert a.column("place_id")[0] is None